@@ -0,0 +1,87 @@
+'''
+Load test of the dashboard scatter callback, comparing the copy + isin + px.scatter callback with FigureCache.
+
+Concurrent users are simulated by a thread pool picking axes, positions and teams from the dropdown options.
+
+    python -m benchmarks.bench_app_callback --players 600 --users 16 --calls 2000
+'''
+#%% Imports
+import time
+import threading
+import logging
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks import synthetic, reference
+from src.figures import FigureCache
+
+logger = logging.getLogger(__name__)
+
+positions = ['Goalkeeper', 'Defender', 'Midfielder', 'Forward']
+axes = ['now_cost', 'total_points', 'form', 'minutes', 'xG', 'xA', 'bps', 'selected_by_percent']
+
+#%% Benchmark
+
+def player_frame(n_players, seed=0):
+    rng = np.random.default_rng(seed)
+    df = synthetic.players({id: None for id in range(1, n_players + 1)}, seed)
+    return df.assign(**{axis: rng.random(n_players) * 100 for axis in axes})
+
+
+def selections(n_calls, seed=0):
+    '''
+    Dropdown states, half of them the default positions and teams and the rest with one position or team removed.
+    '''
+    rng = np.random.default_rng(seed)
+    states = []
+    for _ in range(n_calls):
+        x_axis, y_axis = rng.choice(axes, size=2, replace=False)
+        filter_by, team = list(positions), list(range(1, 21))
+        if rng.random() < 0.25:
+            filter_by.pop(rng.integers(len(filter_by)))
+        elif rng.random() < 0.33:
+            team.pop(rng.integers(len(team)))
+        states.append((x_axis, y_axis, filter_by, team))
+    return states
+
+
+def calls_per_second(callback, states, users):
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(users) as pool:
+        list(pool.map(lambda state: callback(*state), states))
+    return len(states) / (time.perf_counter() - t_start)
+
+
+def bench(n_players, users, n_calls):
+    '''
+    Callbacks per second of the old callback, of FigureCache on a cold cache and of the same calls once cached.
+    The cache is large enough to hold every selection, so the warm run is all hits.
+    The old callback is serialised with a lock, as px.scatter fails when called from several threads at once.
+    '''
+    df = player_frame(n_players)
+    states = selections(n_calls)
+    figures = FigureCache(df, positions, max_size=n_calls)
+    lock = threading.Lock()
+
+    def legacy(*state):
+        with lock:
+            return reference.update_graph(df, *state)
+
+    results = {'copy+isin': calls_per_second(legacy, states[:n_calls // 10], users),
+               'figure cache cold': calls_per_second(figures.scatter, states, users)}
+    results['hit rate'] = figures.hits / n_calls
+    results['figure cache warm'] = calls_per_second(figures.scatter, states, users)
+    return results
+
+
+#%% If name main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, default=600)
+    parser.add_argument('--users', type=int, default=16)
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = bench(args.players, args.users, args.calls)
+    print(f"{args.players} players, {args.users} users: " + ', '.join(f"{key} {value:.2f}" for key, value in results.items()))
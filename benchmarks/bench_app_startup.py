@@ -0,0 +1,64 @@
+'''
+Cold start of the dashboard: the time from starting python to the app being importable and its layout built,
+with a stored snapshot of n players. Exits with an error if it takes longer than the budget.
+
+    python -m benchmarks.bench_app_startup --players 600 6000 --budget 10
+'''
+#%% Imports
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+from benchmarks import synthetic
+from src import storage
+
+logger = logging.getLogger(__name__)
+src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+#%% Benchmark
+
+def write_snapshot(directory, n_players, n_gameweeks=28):
+    from src import pre_process as pp
+
+    hist_data = synthetic.element_summary(n_players, n_gameweeks)
+    store = os.path.join(directory, storage.store)
+    storage.write_players(synthetic.player_stats(n_players), gameweek=n_gameweeks, directory=store)
+    storage.write_gameweeks(pp.process_gw_data(synthetic.players(hist_data), hist_data), directory=store)
+
+
+def cold_start(directory):
+    '''
+    Seconds for a new python process to import app and build its layout, run from directory.
+    '''
+    t_start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import app; app.serve_layout(); assert app.dataset.status == "loaded"'],
+                   cwd=directory, env=dict(os.environ, PYTHONPATH=src), check=True, capture_output=True)
+    return time.perf_counter() - t_start
+
+
+def bench(n_players):
+    directory = tempfile.mkdtemp()
+    try:
+        write_snapshot(directory, n_players)
+        return cold_start(directory)
+    finally:
+        shutil.rmtree(directory)
+
+
+#%% If name main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, nargs='+', default=[600, 6000])
+    parser.add_argument('--budget', type=float, default=10, help='seconds')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for n_players in args.players:
+        seconds = bench(n_players)
+        print(f"{n_players:>6} players: cold start {seconds:.2f}s, budget {args.budget:.0f}s")
+        if seconds > args.budget:
+            sys.exit(f"Cold start of {seconds:.2f}s is over the {args.budget}s budget.")
@@ -0,0 +1,70 @@
+'''
+Benchmark of FixtureMatrix.join against a merge of gw_df with a frame of fixtures per team and gameweek and a
+rolling sum for the next gameweeks, as the notebooks would, and of the lookahead query for every player.
+
+    python -m benchmarks.bench_fixtures --players 600 6000 --gameweeks 38
+'''
+#%% Imports
+import time
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from tests.test_fixtures import season
+from src.fixtures import FixtureMatrix
+
+logger = logging.getLogger(__name__)
+
+#%% Benchmark
+
+def merged(gw_df, fixtures, ahead=5):
+    '''
+    Fixtures and the difficulty of the next ahead gameweeks per row with pandas merges.
+    '''
+    fixtures = pd.DataFrame.from_records(fixtures).dropna(subset=['event'])
+    sides = pd.concat([fixtures.rename(columns={'team_h': 'team', 'team_h_difficulty': 'difficulty'}),
+                       fixtures.rename(columns={'team_a': 'team', 'team_a_difficulty': 'difficulty'})])
+    per_gameweek = sides.groupby(['team', 'event'])['difficulty'].agg(['sum', 'count', 'mean'])
+    per_gameweek = per_gameweek.reindex(pd.MultiIndex.from_product([range(1, 21), range(1, 40)],
+                                                                   names=['team', 'event']), fill_value=0)
+    per_gameweek['next'] = per_gameweek.groupby('team')['sum'].transform(
+        lambda values: values[::-1].rolling(ahead, min_periods=1).sum()[::-1].shift(-1, fill_value=0))
+    return gw_df.reset_index().merge(per_gameweek, left_on=['team', 'round'], right_index=True, how='left')
+
+
+def bench(n_players, n_gameweeks=38, repeats=3):
+    fixtures, teams = season(n_teams=20, n_gameweeks=n_gameweeks)
+    rounds = np.tile(np.arange(1, n_gameweeks + 1), n_players)
+    gw_df = pd.DataFrame({'id': np.repeat(np.arange(n_players), n_gameweeks),
+                          'team': np.repeat(np.arange(n_players) % 20 + 1, n_gameweeks)},
+                         index=pd.Index(rounds, name='round'))
+    matrix = FixtureMatrix(fixtures, teams)
+    player_teams = gw_df['team'].to_numpy()[::n_gameweeks]
+
+    def best(function):
+        timings = []
+        for _ in range(repeats):
+            t_start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - t_start)
+        return min(timings)
+
+    return {'build': best(lambda: FixtureMatrix(fixtures, teams)),
+            'join': best(lambda: matrix.join(gw_df)),
+            'merge': best(lambda: merged(gw_df, fixtures)),
+            'lookahead': best(lambda: matrix.ahead('difficulty', 20, 5)[player_teams])}
+
+
+#%% If name main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, nargs='+', default=[600, 6000])
+    parser.add_argument('--gameweeks', type=int, default=38)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for n_players in args.players:
+        timings = bench(n_players, args.gameweeks, args.repeats)
+        print(f"{n_players:>6} players: build {1000 * timings['build']:.1f}ms, join {1000 * timings['join']:.1f}ms, "
+              f"merge {1000 * timings['merge']:.1f}ms, next 5 of every player {1000 * timings['lookahead']:.3f}ms")
@@ -0,0 +1,74 @@
+'''
+Benchmark of FormFeatures: a full recompute over every gameweek against updating with one new gameweek, and the
+groupby rolling and ewm the notebooks used.
+
+    python -m benchmarks.bench_form --players 600 6000
+'''
+#%% Imports
+import time
+import logging
+import argparse
+from benchmarks import synthetic
+from src import pre_process as pp
+
+logger = logging.getLogger(__name__)
+
+#%% Benchmark
+
+def best(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        t_start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - t_start)
+    return min(timings)
+
+
+def groupby_features(gw_df, features=pp.form_features):
+    '''
+    The features computed with groupby rolling and ewm, one feature at a time.
+    '''
+    players = gw_df.groupby('id')
+    for name, (kind, column, parameter) in features.items():
+        if kind == 'mean':
+            players[column].rolling(parameter, min_periods=1).mean()
+        elif kind == 'ewm':
+            players[column].transform(lambda values: values.ewm(alpha=parameter, adjust=False).mean())
+        else:
+            90 * players[column].rolling(parameter, min_periods=1).sum() / players['minutes'].rolling(parameter, min_periods=1).sum()
+
+
+def bench(n_players, n_gameweeks=38, repeats=3):
+    '''
+    Returns seconds for the groupby features, a full fit and an update with the last gameweek.
+    '''
+    hist_data = synthetic.element_summary(n_players, n_gameweeks)
+    gw_df = pp.sort_gameweeks(pp.process_gw_data(synthetic.players(hist_data), hist_data))
+    index = pp.GameweekIndex(gw_df)
+    before, last = gw_df[gw_df.index < n_gameweeks], index.gameweek(n_gameweeks)
+
+    def update():
+        engine = pp.FormFeatures()
+        engine.fit(before)
+        t_start = time.perf_counter()
+        engine.update(last)
+        return time.perf_counter() - t_start
+
+    return {'groupby': best(lambda: groupby_features(gw_df), repeats),
+            'fit': best(lambda: pp.FormFeatures().fit(index), repeats),
+            'update': min(update() for _ in range(repeats))}
+
+
+#%% If name main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, nargs='+', default=[600, 6000])
+    parser.add_argument('--gameweeks', type=int, default=38)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for n_players in args.players:
+        timings = bench(n_players, args.gameweeks, args.repeats)
+        print(f"{n_players:>6} players: groupby {timings['groupby']:.3f}s, full fit {timings['fit']:.3f}s, "
+              f"one gameweek update {1000 * timings['update']:.2f}ms")
@@ -0,0 +1,62 @@
+'''
+Benchmark of GameweekIndex lookups against boolean masks over gw_df.
+
+    python -m benchmarks.bench_gameweek_index --players 600 6000
+'''
+#%% Imports
+import time
+import logging
+import argparse
+import numpy as np
+from benchmarks import synthetic
+from src import pre_process as pp
+from src.gameweek_index import GameweekIndex
+
+logger = logging.getLogger(__name__)
+
+#%% Benchmark
+
+def best(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        t_start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - t_start)
+    return min(timings)
+
+
+def bench(n_players, n_gameweeks=38, repeats=20, seed=0):
+    '''
+    Returns {query: (mask seconds, index seconds)} for single lookups, and the seconds to build the index.
+    '''
+    hist_data = synthetic.element_summary(n_players, n_gameweeks, seed)
+    gw_df = pp.process_gw_data(synthetic.players(hist_data), hist_data)
+    t_start = time.perf_counter()
+    index = GameweekIndex(gw_df)
+    build = time.perf_counter() - t_start
+
+    rng = np.random.default_rng(seed)
+    id, ids = int(rng.choice(index.ids)), rng.choice(index.ids, size=50, replace=False)
+    queries = {'player gameweeks 10-20': (lambda: gw_df[(gw_df['id'] == id) & (gw_df.index >= 10) & (gw_df.index <= 20)],
+                                          lambda: index.player(id, 10, 20)),
+               '50 players at gameweek 20': (lambda: gw_df[gw_df['id'].isin(ids) & (gw_df.index == 20)],
+                                             lambda: index.gameweek(20, ids)),
+               'latest 5 of every player': (lambda: gw_df.groupby('id').tail(5),
+                                            lambda: index.latest(5))}
+    return {query: (best(mask, repeats), best(lookup, repeats)) for query, (mask, lookup) in queries.items()}, build
+
+
+#%% If name main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, nargs='+', default=[600, 6000])
+    parser.add_argument('--gameweeks', type=int, default=38)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for n_players in args.players:
+        timings, build = bench(n_players, args.gameweeks, args.repeats)
+        print(f"{n_players:>6} players, index built in {1000 * build:.2f}ms:")
+        for query, (mask, lookup) in timings.items():
+            print(f"    {query:<28} mask {1000 * mask:8.3f}ms, index {1000 * lookup:8.3f}ms, speedup {mask / lookup:.0f}x")
@@ -0,0 +1,50 @@
+'''
+Benchmark of the batch process_gw_data against the original per-player loop.
+
+    python -m benchmarks.bench_gw_data --players 600 6000
+'''
+#%% Imports
+import time
+import logging
+import argparse
+from benchmarks import synthetic, reference
+from src import pre_process as pp
+
+logger = logging.getLogger(__name__)
+
+#%% Benchmark
+
+def bench(n_players, n_gameweeks=28, repeats=3, include_reference=True):
+    '''
+    Returns the best of repeats wall times in seconds for each implementation.
+    '''
+    hist_data = synthetic.element_summary(n_players, n_gameweeks)
+    df = synthetic.players(hist_data)
+    implementations = {'batch': pp.process_gw_data}
+    if include_reference:
+        implementations['loop'] = reference.process_gw_data
+
+    timings = {}
+    for name, function in implementations.items():
+        best = float('inf')
+        for _ in range(repeats):
+            t_start = time.perf_counter()
+            function(df, hist_data)
+            best = min(best, time.perf_counter() - t_start)
+        timings[name] = best
+    return timings
+
+
+#%% If name main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, nargs='+', default=[600, 6000])
+    parser.add_argument('--gameweeks', type=int, default=28)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for n_players in args.players:
+        timings = bench(n_players, args.gameweeks, args.repeats)
+        print(f"{n_players:>6} players: loop {timings['loop']:.3f}s, batch {timings['batch']:.3f}s, "
+              f"speedup {timings['loop'] / timings['batch']:.1f}x")
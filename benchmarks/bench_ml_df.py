@@ -0,0 +1,55 @@
+'''
+Benchmark of the strided create_ml_df against the original per-slice loop.
+
+    python -m benchmarks.bench_ml_df --players 600 --weeks 3 5 8
+'''
+#%% Imports
+import time
+import logging
+import argparse
+from benchmarks import synthetic, reference
+from src import pre_process as pp
+
+logger = logging.getLogger(__name__)
+
+#%% Benchmark
+
+def bench(n_players, weeks=(3, 5, 8), n_gameweeks=28, include_reference=True):
+    '''
+    Returns wall times in seconds for all weeks built together by the strided generator,
+    and for the first weeks value built by the reference loop.
+    '''
+    hist_data = synthetic.element_summary(n_players, n_gameweeks)
+    gw_df = pp.process_gw_data(synthetic.players(hist_data), hist_data)
+    # The reference loop needs every player to have every gameweek
+    last_round = gw_df.reset_index().groupby('id')['round'].transform('max').to_numpy()
+    gw_df = gw_df[last_round == n_gameweeks]
+
+    timings = {}
+    t_start = time.perf_counter()
+    pp.create_ml_df(gw_df, weeks=list(weeks))
+    timings['strided'] = time.perf_counter() - t_start
+
+    if include_reference:
+        t_start = time.perf_counter()
+        reference.create_ml_df(gw_df, weeks=weeks[0])
+        timings['loop'] = time.perf_counter() - t_start
+    return timings
+
+
+#%% If name main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, nargs='+', default=[600])
+    parser.add_argument('--weeks', type=int, nargs='+', default=[3, 5, 8])
+    parser.add_argument('--gameweeks', type=int, default=28)
+    parser.add_argument('--no-reference', action='store_true', help='Skip the slow reference loop.')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for n_players in args.players:
+        timings = bench(n_players, args.weeks, args.gameweeks, not args.no_reference)
+        line = f"{n_players:>6} players: strided weeks={args.weeks} {timings['strided']:.3f}s"
+        if 'loop' in timings:
+            line += f", loop weeks={args.weeks[0]} {timings['loop']:.3f}s"
+        print(line)
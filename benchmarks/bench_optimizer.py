@@ -0,0 +1,72 @@
+'''
+Benchmark of SquadOptimizer: picking a squad for one gameweek over the candidates and over every player, and
+planning transfers over several gameweeks. Points rise with cost, as real projections do, so the budget binds.
+
+    python -m benchmarks.bench_optimizer --players 700 2000 --gameweeks 3
+'''
+#%% Imports
+import time
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from benchmarks import synthetic
+from src.optimizer import SquadOptimizer
+
+logger = logging.getLogger(__name__)
+
+#%% Benchmark
+
+def player_pool(n_players, seed=0):
+    df = synthetic.player_stats(n_players, seed)
+    rng = np.random.default_rng(seed + 1)
+    df['now_cost'] = rng.integers(40, 130, n_players)
+    df['xp'] = rng.gamma(2, 2, n_players) * df['now_cost'] / 80
+    return df
+
+
+def bench(n_players, n_gameweeks=3, repeats=3, seed=0):
+    '''
+    Returns seconds for a pick over the candidates, a pick over every player and a plan of n_gameweeks,
+    each the mean of repeats solves with the points perturbed by up to 5%.
+    '''
+    df = player_pool(n_players, seed)
+    rng = np.random.default_rng(seed + 2)
+    optimizer = SquadOptimizer(df)
+    squad = optimizer.pick('xp')['squad']
+    timings = {'pick': [], 'candidates': [], 'pick_all': [], 'plan': []}
+
+    for _ in range(repeats):
+        points = df['xp'] * rng.uniform(0.95, 1.05, n_players)
+        t_start = time.perf_counter()
+        pick = optimizer.pick(points)
+        timings['pick'].append(time.perf_counter() - t_start)
+        timings['candidates'].append(optimizer.stats['candidates'])
+
+        everyone = SquadOptimizer(df)
+        everyone.candidates = lambda projection: np.arange(n_players)
+        t_start = time.perf_counter()
+        assert abs(everyone.pick(points)['points'] - pick['points']) < 1e-6
+        timings['pick_all'].append(time.perf_counter() - t_start)
+
+        projections = pd.DataFrame({gameweek: points * rng.uniform(0.5, 1.5, n_players)
+                                    for gameweek in range(1, n_gameweeks + 1)})
+        t_start = time.perf_counter()
+        optimizer.plan(projections, squad, bank=10)
+        timings['plan'].append(time.perf_counter() - t_start)
+    return {name: float(np.mean(values)) for name, values in timings.items()}
+
+
+#%% If name main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, nargs='+', default=[700, 2000])
+    parser.add_argument('--gameweeks', type=int, default=3)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for n_players in args.players:
+        timings = bench(n_players, args.gameweeks, args.repeats)
+        print(f"{n_players:>6} players: pick {timings['pick']:.3f}s over {timings['candidates']:.0f} candidates, "
+              f"over every player {timings['pick_all']:.3f}s, {args.gameweeks} gameweek plan {timings['plan']:.3f}s")
@@ -0,0 +1,73 @@
+'''
+Scaling benchmark of process_gw_data and create_ml_df across worker counts.
+
+A rebuild of --seasons seasons is simulated as --players x --seasons player histories of --gameweeks gameweeks,
+each season's history of a player processed as a player of its own. Every worker count is checked against the
+serial result, and the speedup is relative to workers=1. Results are written to --output as json.
+
+    python -m benchmarks.bench_parallel --players 600 --seasons 10 --workers 1 2 4 8 16 32
+'''
+#%% Imports
+import os
+import json
+import time
+import logging
+import argparse
+import platform
+import pandas as pd
+from benchmarks import synthetic
+from src import pre_process as pp
+
+logger = logging.getLogger(__name__)
+
+#%% Benchmark
+
+def bench(n_players, n_seasons=10, n_gameweeks=38, workers=(1, 2, 4), weeks=3, repeats=1):
+    '''
+    Returns {stage: {workers: best of repeats seconds}}.
+    '''
+    hist_data = synthetic.element_summary(n_players * n_seasons, n_gameweeks)
+    df = synthetic.players(hist_data)
+    serial = {}
+    timings = {'process_gw_data': {}, 'create_ml_df': {}}
+
+    for n_workers in workers:
+        for stage, function, args in [('process_gw_data', pp.process_gw_data, lambda: (df, hist_data)),
+                                      ('create_ml_df', pp.create_ml_df, lambda: (serial['process_gw_data'], weeks))]:
+            best = float('inf')
+            for _ in range(repeats):
+                t_start = time.perf_counter()
+                result = function(*args(), workers=n_workers)
+                best = min(best, time.perf_counter() - t_start)
+            timings[stage][n_workers] = best
+
+            if stage not in serial:
+                serial[stage] = result
+            else:
+                pd.testing.assert_frame_equal(result, serial[stage])
+    return timings
+
+
+#%% If name main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, default=600)
+    parser.add_argument('--seasons', type=int, default=10)
+    parser.add_argument('--gameweeks', type=int, default=38)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    workers = sorted(set([1] + args.workers))
+    timings = bench(args.players, args.seasons, args.gameweeks, workers, repeats=args.repeats)
+    for stage, results in timings.items():
+        print(f"{stage}, {args.players} players x {args.seasons} seasons:")
+        for n_workers, seconds in results.items():
+            print(f"    {n_workers:>3} workers {seconds:.3f}s, speedup {results[1] / seconds:.2f}x")
+
+    if args.output:
+        with open(args.output, 'w') as outf:
+            json.dump({'players': args.players, 'seasons': args.seasons, 'gameweeks': args.gameweeks,
+                       'cpu_count': os.cpu_count(), 'platform': platform.platform(), 'timings': timings}, outf, indent=1)
@@ -0,0 +1,160 @@
+'''
+Benchmark of every pre_process stage, one by one and end to end, on synthetic payloads so it runs offline.
+
+Each stage is timed on the output of the stage before it, taking the best of --repeat runs. end_to_end is a cold
+run of pre_process.main, through its Pipeline with an empty stage cache, on the same payloads and a season of
+fixtures. Results are written to --output as json and, with --baseline, compared with an earlier results file: the
+run fails if any stage is more than --tolerance slower than the baseline, ignoring differences under --min-seconds.
+match_names and update_crosswalk build a dense score matrix, so above --match-limit players they and end_to_end
+are skipped and merge uses a crosswalk of exact name matches instead.
+
+    python -m benchmarks.bench_pipeline --players 600 6000 60000 --output benchmarks/results/pipeline.json
+    python -m benchmarks.bench_pipeline --players 600 6000 --baseline benchmarks/results/pipeline_baseline.json
+'''
+#%% Imports
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import pandas as pd
+from benchmarks import synthetic
+from tests.test_fixtures import season
+from src import pre_process as pp
+
+logger = logging.getLogger(__name__)
+
+#%% Benchmark
+
+def payloads(n_players, n_gameweeks=38, n_seasons=1, seed=0):
+    '''
+    Synthetic bootstrap-static, element-summary and understat payloads for n_players.
+    '''
+    player_data = synthetic.bootstrap_static(n_players, seed)
+    return {'player_data': player_data,
+            'hist_data': synthetic.element_summary(n_players, n_gameweeks, seed, n_seasons),
+            'understat': synthetic.understat(player_data, seed),
+            'fixtures': season(n_teams=20, n_gameweeks=n_gameweeks)}
+
+
+def exact_crosswalk(names, understat):
+    '''
+    Crosswalk of the players whose FPL and understat names are the same and unique.
+    '''
+    fpl = names['player_name'].drop_duplicates(keep=False)
+    understat = understat.drop_duplicates('player_name', keep=False).set_index('player_name')['id']
+    fpl = fpl[fpl.isin(understat.index)]
+    return pd.DataFrame({'understat_id': understat[fpl].to_numpy(), 'player_name': fpl.to_numpy()}, index=fpl.index)
+
+
+def end_to_end(data):
+    '''
+    Seconds pre_process.main takes on data with an empty stage cache, run in a temporary directory with the loaders
+    returning data instead of reading .data and downloading.
+    '''
+    directory, cwd = tempfile.mkdtemp(), os.getcwd()
+    loaders = pp.load_data, pp.load_fixtures
+    pp.load_data = lambda: (data['player_data'], data['hist_data'], data['understat'])
+    pp.load_fixtures = lambda: data['fixtures']
+    try:
+        os.chdir(directory)
+        os.mkdir('.data')
+        t_start = time.perf_counter()
+        pp.main(save_to_file=False, cache=os.path.join(directory, 'stages'))
+        return time.perf_counter() - t_start
+    finally:
+        pp.load_data, pp.load_fixtures = loaders
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+
+def stages(data, match_limit=6000):
+    '''
+    Seconds each stage takes, run in pipeline order on the output of the stage before.
+    '''
+    results = {}
+    directory = tempfile.mkdtemp()
+
+    def timed(stage, function, *args, **kwargs):
+        t_start = time.perf_counter()
+        output = function(*args, **kwargs)
+        results[stage] = time.perf_counter() - t_start
+        return output
+
+    try:
+        fpl, names = timed('process_raw_fpl', pp.process_raw_fpl, data['player_data'])
+        understat = timed('process_raw_understat', pp.process_raw_understat, data['understat'])
+        if len(names) <= match_limit:
+            timed('match_names', pp.match_names, names, understat['player_name'], save_to_file=False)
+            crosswalk = timed('update_crosswalk', pp.update_crosswalk, names, understat,
+                              filename=os.path.join(directory, 'crosswalk.json'), save_to_file=False)
+        else:
+            crosswalk = exact_crosswalk(names, understat)
+        merged = timed('merge', pp.merge, fpl, understat, crosswalk)
+        df = timed('prune_data', pp.prune_data, merged)
+        gw_df = timed('process_gw_data', pp.process_gw_data, df, data['hist_data'])
+        timed('create_ml_df', pp.create_ml_df, gw_df)
+    finally:
+        shutil.rmtree(directory)
+
+    if len(names) <= match_limit:
+        results['end_to_end'] = end_to_end(data)
+    return results
+
+
+def bench(n_players, n_gameweeks=38, n_seasons=1, repeat=3, match_limit=6000):
+    data = payloads(n_players, n_gameweeks, n_seasons)
+    runs = [stages(data, match_limit) for _ in range(repeat)]
+    return {stage: round(min(run[stage] for run in runs), 4) for stage in runs[0]}
+
+
+def regressions(results, baseline, tolerance=0.5, min_seconds=0.05):
+    '''
+    Stages of results more than tolerance slower than the same stage and size in baseline.
+    '''
+    slower = []
+    for n_players, timings in results.items():
+        for stage, seconds in timings.items():
+            before = baseline.get(n_players, {}).get(stage)
+            if before is not None and seconds > before * (1 + tolerance) and seconds - before > min_seconds:
+                slower.append(f"{stage} at {n_players} players took {seconds:.3f}s, baseline {before:.3f}s")
+    return slower
+
+
+#%% If name main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--players', type=int, nargs='+', default=[600, 6000])
+    parser.add_argument('--gameweeks', type=int, default=38)
+    parser.add_argument('--seasons', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--match-limit', type=int, default=6000)
+    parser.add_argument('--output', help='json file to write the results to')
+    parser.add_argument('--baseline', help='json results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown, 0.5 is 50%% slower')
+    parser.add_argument('--min-seconds', type=float, default=0.05, help='slowdowns smaller than this are ignored')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = {}
+    for n_players in args.players:
+        results[str(n_players)] = bench(n_players, args.gameweeks, args.seasons, args.repeat, args.match_limit)
+        print(f"{n_players:>6} players: " + ', '.join(f"{stage} {seconds:.3f}s" for stage, seconds in results[str(n_players)].items()))
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as outf:
+            json.dump(dict(results, meta={'gameweeks': args.gameweeks, 'seasons': args.seasons, 'repeat': args.repeat,
+                                          'python': platform.python_version(), 'pandas': pd.__version__,
+                                          'date': time.strftime('%Y-%m-%d')}), outf, indent=1)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            slower = regressions(results, json.load(file), args.tolerance, args.min_seconds)
+        if slower:
+            sys.exit("Slower than the baseline:\n" + '\n'.join(slower))
+        print(f"No stage is more than {args.tolerance:.0%} slower than {args.baseline}.")
@@ -0,0 +1,85 @@
+'''
+Memory of n dashboard workers each loading their own copy of the data from the store, against n workers attached
+to one SharedDataset generation. Reports the proportional set size (Pss) the data adds to each worker, summed
+over the workers, so pages shared between them are only counted once. Linux only.
+
+    python -m benchmarks.bench_shared_dataset --players 6000 --workers 1 2 4 8
+'''
+#%% Imports
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+from benchmarks import bench_app_startup
+from src import storage
+
+logger = logging.getLogger(__name__)
+
+worker = '''
+import sys
+# Imported before measuring so only the data is counted
+import pre_process, pyarrow.dataset
+from dataset import Dataset, SharedDataset
+
+def pss():
+    with open('/proc/self/smaps_rollup') as file:
+        return next(int(line.split()[1]) for line in file if line.startswith('Pss:'))
+
+dataset = (SharedDataset if sys.argv[1] == 'shared' else Dataset)()
+before = pss()
+dataset.load()
+# Touch every numeric column, as the callbacks would
+sum(float(dataset.gw_df[column].sum()) for column in dataset.gw_df.select_dtypes('number').columns)
+print('ready', flush=True)
+sys.stdin.readline()
+print(pss() - before, flush=True)
+'''
+
+#%% Benchmark
+
+def workers_pss(directory, mode, n_workers):
+    '''
+    Summed Pss in MB that loading the data adds to n_workers processes running at the same time.
+    '''
+    processes = [subprocess.Popen([sys.executable, '-c', worker, mode], cwd=directory, text=True,
+                                  env=dict(os.environ, PYTHONPATH=bench_app_startup.src),
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                 for _ in range(n_workers)]
+    for process in processes:
+        assert process.stdout.readline().strip() == 'ready'
+    # Pss is read once every worker holds the data, so shared pages are split between all of them
+    for process in processes:
+        process.stdin.write('\n')
+        process.stdin.flush()
+    total = sum(int(process.stdout.readline()) for process in processes)
+    for process in processes:
+        process.wait()
+    return total / 1024
+
+
+def bench(n_players, workers):
+    directory = tempfile.mkdtemp()
+    try:
+        bench_app_startup.write_snapshot(directory, n_players, n_gameweeks=38)
+        # Publish the first generation so every measured shared worker only attaches
+        workers_pss(directory, 'shared', 1)
+        return {n_workers: {mode: workers_pss(directory, mode, n_workers) for mode in ['store', 'shared']}
+                for n_workers in workers}
+    finally:
+        shutil.rmtree(directory)
+
+
+#%% If name main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, default=6000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for n_workers, result in bench(args.players, args.workers).items():
+        print(f"{n_workers} workers: " + ', '.join(f"{mode} {mb:.1f}MB" for mode, mb in result.items()))
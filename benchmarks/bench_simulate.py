@@ -0,0 +1,53 @@
+'''
+Benchmark of PointsSimulator: seconds and peak memory of simulating --sims gameweeks for every player, across
+chunk sizes.
+
+    python -m benchmarks.bench_simulate --players 700 --sims 100000 --chunks 1000 5000 20000
+'''
+#%% Imports
+import time
+import logging
+import argparse
+import tracemalloc
+from benchmarks import synthetic
+from src import pre_process as pp
+from src.simulate import PointsSimulator
+
+logger = logging.getLogger(__name__)
+
+#%% Benchmark
+
+def bench(n_players, n_sims=100_000, chunk_sizes=(1000, 5000, 20000), n_gameweeks=10):
+    '''
+    Returns {chunk_size: (seconds, peak MB)}.
+    '''
+    hist_data = synthetic.element_summary(n_players, n_gameweeks)
+    players = synthetic.players(hist_data)
+    simulator = PointsSimulator(seed=0).fit(players.set_index('index'), pp.process_gw_data(players, hist_data),
+                                            synthetic.fixtures(n_gameweeks=n_gameweeks))
+
+    timings = {}
+    for chunk_size in chunk_sizes:
+        simulator.chunk_size = chunk_size
+        tracemalloc.start()
+        t_start = time.perf_counter()
+        simulator.simulate(n_sims)
+        seconds = time.perf_counter() - t_start
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+        timings[chunk_size] = (seconds, peak)
+    return timings
+
+
+#%% If name main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, default=700)
+    parser.add_argument('--sims', type=int, default=100_000)
+    parser.add_argument('--chunks', type=int, nargs='+', default=[1000, 5000, 20000])
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for chunk_size, (seconds, peak) in bench(args.players, args.sims, args.chunks).items():
+        print(f"{args.players} players x {args.sims} gameweeks, chunks of {chunk_size:>6}: {seconds:.2f}s, "
+              f"peak {peak:.0f}MB")
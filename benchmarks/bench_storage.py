@@ -0,0 +1,93 @@
+'''
+Benchmark of the parquet store against the JSON and pickle files pre_process.main used to write.
+
+    python -m benchmarks.bench_storage --players 600 6000
+'''
+#%% Imports
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import pandas as pd
+from benchmarks import synthetic
+from src import pre_process as pp
+from src import storage
+
+logger = logging.getLogger(__name__)
+
+#%% Benchmark
+
+def size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+
+
+def timed(function):
+    t_start = time.perf_counter()
+    function()
+    return time.perf_counter() - t_start
+
+
+def bench(n_players, n_gameweeks=28):
+    '''
+    Returns {format: {'write_s', 'read_s', 'read_projected_s', 'mb'}}. The projected read is what the
+    dashboard and notebooks now ask for, a few columns of the gameweek frame for the last three rounds.
+    '''
+    hist_data = synthetic.element_summary(n_players, n_gameweeks)
+    gw_df = pp.process_gw_data(synthetic.players(hist_data), hist_data)
+    df = synthetic.players(hist_data).set_index('index').join(
+        gw_df.groupby('id').sum(numeric_only=True).drop(columns=['team', 'points_cumsum'] + pp.gw_mean_cols))
+    directory = tempfile.mkdtemp()
+    files = {name: os.path.join(directory, name) for name in ['joined.json', 'gw.json', 'df.pkl', 'gw_df.pkl', 'store']}
+    rounds = range(n_gameweeks - 2, n_gameweeks + 1)
+
+    def write_legacy():
+        for frame, filename in [(df.reset_index(), files['joined.json']), (gw_df, files['gw.json'])]:
+            with open(filename, 'w') as file:
+                json.dump(frame.to_dict('records'), file)
+        df.to_pickle(files['df.pkl'])
+        gw_df.to_pickle(files['gw_df.pkl'])
+
+    def read_legacy():
+        return pd.read_pickle(files['df.pkl']), pd.read_pickle(files['gw_df.pkl'])
+
+    def read_json():
+        with open(files['gw.json'], 'r') as file:
+            return pd.DataFrame(json.load(file))
+
+    def write_store():
+        storage.write_players(df, gameweek=n_gameweeks, directory=files['store'])
+        storage.write_gameweeks(gw_df, directory=files['store'])
+
+    def read_store():
+        return storage.read_players(directory=files['store']), storage.read_gameweeks(directory=files['store'])
+
+    try:
+        results = {'json+pickle': {'write_s': timed(write_legacy), 'read_s': timed(read_legacy),
+                                   'read_json_s': timed(read_json),
+                                   'read_projected_s': timed(lambda: read_legacy()[1].loc[lambda gw: gw.index.isin(rounds), ['id', 'total_points']]),
+                                   'mb': sum(size(files[name]) for name in ['joined.json', 'gw.json', 'df.pkl', 'gw_df.pkl']) / 2**20},
+                   'parquet': {'write_s': timed(write_store), 'read_s': timed(read_store),
+                               'read_projected_s': timed(lambda: storage.read_gameweeks(columns=['id', 'total_points'], rounds=rounds,
+                                                                                        directory=files['store'])),
+                               'mb': size(files['store']) / 2**20}}
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+#%% If name main
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--players', type=int, nargs='+', default=[600, 6000])
+    parser.add_argument('--gameweeks', type=int, default=28)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for n_players in args.players:
+        for name, result in bench(n_players, args.gameweeks).items():
+            print(f"{n_players:>6} players {name:>12}: " + ', '.join(f"{key} {value:.3f}" for key, value in result.items()))
@@ -0,0 +1,104 @@
+'''
+The original implementations of the pre_process stages and the dashboard callback.
+They are kept as a correctness reference for the tests and as the baseline for the benchmarks.
+'''
+#%% Imports
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+#%% Process GW data
+
+def process_gw_data(df, hist_data):
+    '''
+    Per-player loop that process_gw_data replaced.
+    numeric_only=True reproduces the pinned pandas behaviour of dropping string columns from groupby sums.
+    '''
+    detailed_df = pd.DataFrame()
+    df = df.set_index('index')
+
+    for id in df.index:
+
+        history = pd.DataFrame(hist_data[id]['history'])
+
+        # Goals for and against
+        history['goals_for'] = history['team_h_score'].where(history['was_home'], history['team_a_score'])
+        history['goals_against'] = history['team_a_score'].where(history['was_home'], history['team_h_score'])
+
+        # Drop irrelevant columns
+        history = history.drop(columns=['team_h_score','team_a_score','element','fixture','kickoff_time','opponent_team'])
+
+        # groupBY sum gameweeks
+        mean_cols =['value', 'transfers_balance', 'selected', 'transfers_in','transfers_out']
+        history = pd.concat([history.groupby('round').sum(numeric_only=True).drop(columns=mean_cols),
+                             history.groupby('round')[mean_cols].mean()], axis=1)
+
+        # Finding empty gameweeks
+        for empty_gw in np.arange(1,max(history.index)):
+            if empty_gw not in history.index:
+                history.loc[empty_gw] = None
+        history = history.sort_index()
+
+        # filling interpolated transfer data or zeros for gw data
+        history[mean_cols] = history[mean_cols].interpolate(method='linear')
+        history = history.fillna(0)
+
+        # Adding a cumulative sum of points
+        history['points_cumsum'] = history['total_points'].cumsum()
+
+        # Adding player ID to df
+        history['id'] = id
+
+        # Adding general player data
+        player_df = pd.merge(history, df[['team', 'element_type', 'player_name']], left_on='id', right_index=True,)
+
+        detailed_df = pd.concat([detailed_df, player_df], axis=0)
+
+    return detailed_df
+
+
+#%% Create slices for machine learning
+
+def create_ml_df(gw_df, weeks=3):
+    '''
+    Per-player, per-slice loop that create_ml_df replaced.
+    '''
+    gw = max(gw_df.index)
+    slices = [np.arange(i-(weeks-1),i+1) for i in range(weeks, gw)]
+
+    df = pd.DataFrame()
+    for id in gw_df['id'].unique():
+        player_df = gw_df[gw_df['id'] == id]
+
+        for slice in slices:
+            df_slice = player_df.loc[slice,:].iloc[::-1].reset_index(drop=True)
+
+            unstacked = df_slice.drop(columns=['element_type', 'player_name', 'team', 'id']).unstack().to_frame().T
+            unstacked.columns = unstacked.columns.map(lambda x: x[0] + '_' + str(1+x[1])+'_weeks_ago')
+
+            unstacked['target'] = player_df.loc[max(slice)+1,:]['total_points']
+            unstacked['player_name'] = player_df.loc[1,'player_name']
+            unstacked['id'] = player_df.loc[1,'id']
+            unstacked['team'] = player_df.loc[1,'team']
+            unstacked['element_type'] = player_df.loc[1,'element_type']
+            df = pd.concat([df, unstacked], axis=0)
+
+    return df.reset_index(drop=True)
+
+
+#%% Dashboard callback
+
+def update_graph(df, x_axis, y_axis, filter_by, team, color_map=None):
+    '''
+    The app's scatter callback before FigureCache: a copy of the frame, two isin scans and a new figure per call.
+    '''
+    dfc = df.copy()
+    dfc = dfc[dfc['element_type'].isin(filter_by)]
+    dfc = dfc[dfc['team'].isin(team)]
+    return [px.scatter(dfc,
+                       x=x_axis,
+                       y=y_axis,
+                       color='element_type',
+                       color_discrete_map=color_map,
+                       hover_data=['player_name'],
+                       title=f"{y_axis} vs {x_axis}")]
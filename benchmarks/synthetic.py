@@ -0,0 +1,227 @@
+'''
+Synthetic FPL payloads shaped like the live API, used by the benchmarks and tests so they can run offline.
+'''
+#%% Imports
+import unicodedata
+import numpy as np
+import pandas as pd
+
+positions = {1:'Goalkeeper', 2:'Defender', 3:'Midfielder', 4:'Forward'}
+
+first_names = ['Aaron', 'Adam', 'Alex', 'Ben', 'Bernardo', 'Bruno', 'Callum', 'Conor', 'Daniel', 'David', 'Dominic',
+               'Emile', 'Eric', 'Ezri', 'Fabian', 'Gabriel', 'Harry', 'Héctor', 'Ivan', 'Jack', 'James', 'Jamie', 'João',
+               'Jordan', 'Joseph', 'Kai', 'Kevin', 'Kieran', 'Luke', 'Marcus', 'Mason', 'Mateo', 'Michael', 'Mohamed',
+               'Nathan', 'Nicolás', 'Oliver', 'Pablo', 'Patrick', 'Raúl', 'Reece', 'Rúben', 'Ryan', 'Sadio', 'Son',
+               'Thiago', 'Tomás', 'Tyrone', 'Virgil', 'Wilfried', 'Yves', 'Zack']
+last_names = ['Adams', 'Alexander-Arnold', 'Álvarez', 'Bamford', 'Bissouma', 'Bowen', 'Cancelo', 'Coady', 'Cresswell',
+              'Dallas', 'Dias', 'Doucouré', 'Eze', 'Fernandes', 'Gallagher', 'Gomes', 'Grealish', 'Hojbjerg', 'Iheanacho',
+              'James', 'Jiménez', 'Kane', 'Kilman', 'Lacazette', 'Lamptey', 'Maddison', 'Mané', 'Martínez', 'Mount',
+              "N'Dri", 'Nketiah', 'Núñez', 'Ødegaard', 'Pogba', 'Pukki', 'Ramsdale', 'Rashford', 'Rodrigo', 'Saint-Maximin',
+              'Salah', 'Sánchez', 'Smith Rowe', 'Soucek', 'Tierney', 'Toney', 'Van Dijk', 'Vardy', 'Ward-Prowse',
+              'White', 'Williams', 'Wilson', 'Zaha']
+
+#%% Element summary
+
+def element_summary(n_players=600, n_gameweeks=28, seed=0, n_seasons=1):
+    '''
+    Returns hist_data in the same shape as get_player_hist, {id: {'history': [...], 'history_past': [...], 'fixtures': []}}.
+    Around 5% of gameweeks are blanks or doubles and 10% of players join part way through the season.
+    history_past has a season total for each of the n_seasons - 1 seasons before this one.
+    '''
+    rng = np.random.default_rng(seed)
+    past_rng = np.random.default_rng(seed + 1)
+    hist_data = {}
+    fixture = 0
+    for id in range(1, n_players + 1):
+        first_round = 1 if rng.random() > 0.1 else int(rng.integers(2, n_gameweeks + 1))
+        value = int(rng.integers(40, 130))
+        selected = int(rng.integers(1000, 1000000))
+        history = []
+
+        for round in range(first_round, n_gameweeks + 1):
+            for _ in range(rng.choice([0, 1, 2], p=[0.05, 0.9, 0.05]) if round > first_round else 1):
+                fixture += 1
+                minutes = int(rng.choice([0, 90, int(rng.integers(1, 90))], p=[0.3, 0.5, 0.2]))
+                transfers_in, transfers_out = (int(i) for i in rng.integers(0, 50000, size=2))
+                selected = max(selected + transfers_in - transfers_out, 0)
+                history.append({
+                    'element': id, 'fixture': fixture, 'opponent_team': int(rng.integers(1, 21)),
+                    'total_points': int(rng.poisson(2)) if minutes else 0, 'was_home': bool(rng.random() > 0.5),
+                    'kickoff_time': f'2021-08-13T19:00:00Z', 'team_h_score': int(rng.poisson(1.4)),
+                    'team_a_score': int(rng.poisson(1.1)), 'round': round, 'minutes': minutes,
+                    'goals_scored': int(rng.poisson(0.1)), 'assists': int(rng.poisson(0.1)),
+                    'clean_sheets': int(rng.random() > 0.7), 'goals_conceded': int(rng.poisson(1.2)),
+                    'own_goals': 0, 'penalties_saved': 0, 'penalties_missed': 0,
+                    'yellow_cards': int(rng.random() > 0.9), 'red_cards': 0, 'saves': int(rng.poisson(0.5)),
+                    'bonus': int(rng.choice([0, 1, 2, 3], p=[0.85, 0.05, 0.05, 0.05])), 'bps': int(rng.integers(0, 40)),
+                    'influence': f'{rng.random()*50:.1f}', 'creativity': f'{rng.random()*50:.1f}',
+                    'threat': f'{rng.random()*50:.1f}', 'ict_index': f'{rng.random()*15:.1f}',
+                    'value': value, 'transfers_balance': transfers_in - transfers_out, 'selected': selected,
+                    'transfers_in': transfers_in, 'transfers_out': transfers_out,
+                    })
+
+        history_past = [{'season_name': f'{2020 - n_seasons + season}/{2021 - n_seasons + season - 2000}',
+                         'element_code': id, 'start_cost': value, 'end_cost': value,
+                         'total_points': int(past_rng.poisson(80)), 'minutes': int(past_rng.integers(0, 3420)),
+                         'goals_scored': int(past_rng.poisson(3)), 'assists': int(past_rng.poisson(3)),
+                         'clean_sheets': int(past_rng.poisson(5)), 'bonus': int(past_rng.poisson(6)),
+                         'bps': int(past_rng.integers(0, 800))}
+                        for season in range(1, n_seasons)]
+        hist_data[id] = {'fixtures': [], 'history': history, 'history_past': history_past}
+
+    return hist_data
+
+
+def players(hist_data, seed=0):
+    '''
+    Returns a processed player frame (as returned by prune_data) for the players in hist_data.
+    '''
+    rng = np.random.default_rng(seed)
+    ids = list(hist_data.keys())
+    return pd.DataFrame({'index': ids,
+                         'team': [(int(id) % 20) + 1 for id in ids],
+                         'element_type': [positions[i] for i in rng.integers(1, 5, size=len(ids))],
+                         'player_name': [f'Player {id}' for id in ids]})
+
+
+def player_stats(n_players=600, seed=0):
+    '''
+    Returns a player frame as pre_process.main returns it, indexed by id, with every column of the stored player schema.
+    '''
+    from src import storage
+
+    rng = np.random.default_rng(seed)
+    df = players({id: None for id in range(1, n_players + 1)}, seed).set_index('index')
+    for field in storage.player_schema:
+        if field.name in df.columns or field.name == 'index':
+            continue
+        if field.type == 'bool':
+            df[field.name] = rng.random(n_players) < 0.05
+        elif field.type == 'double':
+            df[field.name] = rng.random(n_players).round(2) * 10
+        else:
+            df[field.name] = rng.integers(0, 200, size=n_players)
+    return df
+
+
+#%% Bootstrap static and understat
+
+def name(rng):
+    first, last = rng.choice(first_names), rng.choice(last_names)
+    return str(first), str(last)
+
+
+def unique_names(n_players, rng):
+    '''
+    n_players distinct (first, last) names. Once every single surname is used surnames are double barrelled.
+    '''
+    singles = [(first, last) for first in first_names for last in last_names]
+    names = [singles[i] for i in rng.permutation(len(singles))[:n_players]]
+    if n_players > len(singles):
+        doubles = len(first_names) * len(last_names) ** 2
+        for i in rng.choice(doubles, size=n_players - len(singles), replace=False):
+            first, i = divmod(int(i), len(last_names) ** 2)
+            names.append((first_names[first], last_names[i // len(last_names)] + '-' + last_names[i % len(last_names)]))
+    return names
+
+
+def bootstrap_static(n_players=600, seed=0):
+    '''
+    Returns player_data in the same shape as get_data, {id: {...}} with the 66 bootstrap-static element fields.
+    Names are unique. About 15% of players have not played, and 5% are flagged with a 0% chance of playing and a news item.
+    '''
+    rng = np.random.default_rng(seed)
+    player_data = {}
+    names = unique_names(n_players, rng)
+    for id in range(1, n_players + 1):
+        first, last = names[id - 1]
+        minutes = int(rng.integers(1, 3000)) if rng.random() > 0.15 else 0
+        total_points = int(minutes / 90 * rng.random() * 6)
+        flagged = rng.random() < 0.05
+        news = str(rng.choice(['Knee injury - Expected back 12 Mar', 'Suspended until 19 Mar', 'Has joined another club',
+                               'Unknown return date'])) if flagged else ''
+        player = {
+            'chance_of_playing_next_round': 0 if flagged else None, 'chance_of_playing_this_round': 0 if flagged else None,
+            'code': 100000 + id, 'cost_change_event': 0, 'cost_change_event_fall': 0, 'cost_change_start': 0,
+            'cost_change_start_fall': 0, 'dreamteam_count': int(rng.poisson(0.3)), 'element_type': int(rng.integers(1, 5)),
+            'ep_next': f'{rng.random()*5:.1f}', 'ep_this': f'{rng.random()*5:.1f}', 'event_points': int(rng.poisson(2)),
+            'first_name': first, 'form': f'{rng.random()*8:.1f}', 'in_dreamteam': bool(rng.random() < 0.02),
+            'news': news, 'news_added': '2022-03-10T12:00:00.000000Z' if flagged else None,
+            'now_cost': int(rng.integers(40, 130)), 'photo': f'{100000 + id}.jpg',
+            'points_per_game': f'{total_points / max(minutes / 90, 1):.1f}', 'second_name': last,
+            'selected_by_percent': f'{rng.random()*40:.1f}', 'special': False, 'squad_number': None,
+            'status': 'i' if flagged else 'a', 'team': (id % 20) + 1, 'team_code': (id % 20) + 1,
+            'total_points': total_points, 'transfers_in': int(rng.integers(0, 2000000)), 'transfers_in_event': 0,
+            'transfers_out': int(rng.integers(0, 2000000)), 'transfers_out_event': 0,
+            'value_form': f'{rng.random():.1f}', 'value_season': f'{rng.random()*20:.1f}', 'web_name': last,
+            'minutes': minutes, 'goals_scored': int(rng.poisson(2)), 'assists': int(rng.poisson(2)),
+            'clean_sheets': int(rng.poisson(3)), 'goals_conceded': int(rng.poisson(20)), 'own_goals': 0,
+            'penalties_saved': 0, 'penalties_missed': 0, 'yellow_cards': int(rng.poisson(2)), 'red_cards': 0,
+            'saves': int(rng.poisson(5)), 'bonus': int(rng.poisson(4)), 'bps': int(rng.integers(0, 600)),
+            'influence': f'{rng.random()*500:.1f}', 'creativity': f'{rng.random()*500:.1f}',
+            'threat': f'{rng.random()*500:.1f}', 'ict_index': f'{rng.random()*150:.1f}'}
+        for rank in ['influence', 'creativity', 'threat', 'ict_index']:
+            player[rank + '_rank'] = int(rng.integers(1, n_players + 1))
+            player[rank + '_rank_type'] = int(rng.integers(1, n_players + 1))
+        for order in ['corners_and_indirect_freekicks', 'direct_freekicks', 'penalties']:
+            player[order + '_order'] = None
+            player[order + '_text'] = ''
+        player_data[id] = player
+
+    return player_data
+
+
+def understat(player_data, seed=0):
+    '''
+    Returns understat league players, as get_understat does, for the players in player_data who have played.
+    Names are mostly the FPL full name, some drop their accents, some use only the web name and some have a middle name.
+    5% of FPL players are missing and as many understat players are not in FPL.
+    '''
+    rng = np.random.default_rng(seed)
+    players = []
+    played = [(id, player) for id, player in player_data.items() if player['minutes'] > 0]
+    extra = [(None, dict(zip(['first_name', 'second_name'], name(rng)), minutes=int(rng.integers(1, 3000)),
+                         web_name=None)) for _ in range(len(played) // 20)]
+
+    for id, player in played + extra:
+        if id is not None and rng.random() < 0.05:
+            continue
+        full_name = player['first_name'] + ' ' + player['second_name']
+        variant = rng.random()
+        if variant < 0.1:
+            full_name = unicodedata.normalize('NFKD', full_name).encode('ascii', 'ignore').decode()
+        elif variant < 0.15:
+            full_name = player['second_name']
+        elif variant < 0.2:
+            full_name = player['first_name'] + ' ' + str(rng.choice(first_names)) + ' ' + player['second_name']
+
+        games = max(player['minutes'] // 80, 1)
+        xG, xA = rng.random() * games * 0.4, rng.random() * games * 0.3
+        players.append({'id': str(len(players) + 1000), 'player_name': full_name, 'games': str(games),
+                        'time': str(player['minutes']), 'goals': str(int(rng.poisson(xG))), 'xG': f'{xG:.6f}',
+                        'assists': str(int(rng.poisson(xA))), 'xA': f'{xA:.6f}', 'shots': str(int(rng.poisson(games))),
+                        'key_passes': str(int(rng.poisson(games))), 'yellow_cards': '0', 'red_cards': '0',
+                        'position': 'M S', 'team_title': 'Arsenal', 'npg': str(int(rng.poisson(xG * 0.9))),
+                        'npxG': f'{xG * 0.9:.6f}', 'xGChain': f'{rng.random() * games:.6f}',
+                        'xGBuildup': f'{rng.random() * games * 0.5:.6f}'})
+    return players
+
+
+#%% Fixtures
+
+def fixtures(n_teams=20, n_gameweeks=10, seed=0):
+    '''
+    Returns fixtures in the same shape as the FPL fixtures endpoint: every team plays once in each of gameweeks 1 to
+    n_gameweeks, which have results, and in gameweek n_gameweeks + 1, which has not been played yet.
+    '''
+    rng = np.random.default_rng(seed)
+    records = []
+    for event in range(1, n_gameweeks + 2):
+        played = event <= n_gameweeks
+        order = rng.permutation(np.arange(1, n_teams + 1))
+        for home, away in zip(order[::2], order[1::2]):
+            records.append({'id': len(records) + 1, 'event': event, 'team_h': int(home), 'team_a': int(away),
+                            'team_h_score': int(rng.poisson(1.5)) if played else None,
+                            'team_a_score': int(rng.poisson(1.2)) if played else None, 'finished': played,
+                            'team_h_difficulty': int(rng.integers(2, 6)), 'team_a_difficulty': int(rng.integers(2, 6))})
+    return records
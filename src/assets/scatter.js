@@ -0,0 +1,40 @@
+/*
+Clientside callbacks for the dashboard. The player columns are sent once to the player_columns store, every
+change of axis, position or team is then filtered and drawn in the browser with WebGL.
+*/
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    fpl: {
+        scatter: function(x_axis, y_axis, filter_by, team, data) {
+            if (!data) {
+                return [window.dash_clientside.no_update];
+            }
+            const positions = new Set(filter_by || []);
+            const teams = new Set(team || []);
+            const xs = data.columns[x_axis], ys = data.columns[y_axis];
+
+            const traces = data.positions.map(function(position, code) {
+                const trace = {type: 'scattergl', mode: 'markers', name: position, legendgroup: position,
+                               x: [], y: [], customdata: [], marker: {color: data.colors[position]},
+                               hovertemplate: 'element_type=' + position + '<br>' + x_axis + '=%{x}<br>' + y_axis +
+                                              '=%{y}<br>player_name=%{customdata}<extra></extra>'};
+                if (!positions.has(position)) {
+                    return trace;
+                }
+                for (let i = 0; i < data.position.length; i++) {
+                    if (data.position[i] === code && teams.has(data.team[i])) {
+                        trace.x.push(xs[i]);
+                        trace.y.push(ys[i]);
+                        trace.customdata.push(data.player_name[i]);
+                    }
+                }
+                return trace;
+            }).filter(function(trace) { return trace.x.length; });
+
+            return [{data: traces,
+                     layout: {title: {text: y_axis + ' vs ' + x_axis},
+                              xaxis: {title: {text: x_axis}},
+                              yaxis: {title: {text: y_axis}},
+                              legend: {title: {text: 'element_type'}}}}];
+        }
+    }
+});
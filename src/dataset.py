@@ -0,0 +1,298 @@
+'''
+The player and gameweek frames served by the dashboard, with a background refresh.
+
+SharedDataset is the mode for several worker processes: the frames are published once as uncompressed arrow files
+that every worker memory maps, and a file lock lets only one process rebuild them.
+'''
+#%% Imports
+import os
+import json
+import time
+import fcntl
+import shutil
+import asyncio
+import threading
+import logging
+import pandas as pd
+import pyarrow as pa
+import storage
+import instrument
+
+logger = logging.basicConfig(format='[%(levelname)s %(module)s] %(asctime)s - %(message)s', level = logging.INFO)
+logger = logging.getLogger(__name__)
+
+#%% Dataset
+
+class Dataset:
+    '''
+    Holds the latest df and gw_df and rebuilds them in a background thread.
+
+    load() reads the most recent snapshot in the store, whatever its date, so the dashboard can start serving straight
+    away. refresh() runs build (pre_process.main by default) in a thread and swaps the new frames in when it
+    finishes. Both frames are replaced together as one tuple, so readers of frames never see a df from one build
+    and a gw_df from another. Callables in listeners are called with the new df after every swap.
+    The stage timings of each rebuild are written to metrics + '.json' and '.prom' if metrics is given.
+    '''
+    def __init__(self, columns=None, build=None, directory=storage.store, metrics=None):
+        self.columns = columns
+        self.metrics = metrics
+        self.build = build or default_build
+        self.directory = directory
+        self.listeners = []
+        self.frames = (pd.DataFrame(columns=columns or []), pd.DataFrame())
+        self.updated = None
+        self.status = 'empty'
+        self.error = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    @property
+    def df(self):
+        return self.frames[0]
+
+    @property
+    def gw_df(self):
+        return self.frames[1]
+
+    def swap(self, df, gw_df, updated=None):
+        self.frames = (df, gw_df)
+        self.updated = updated or time.time()
+        for listener in self.listeners:
+            listener(df)
+
+    def load(self):
+        '''
+        Loads the latest stored snapshot, returns False if the store is empty.
+        '''
+        manifest = storage.read_manifest(self.directory)
+        if 'players' not in manifest or 'gameweeks' not in manifest:
+            logger.info(f"No snapshot found in {self.directory}.")
+            return False
+
+        from pre_process import compact_dtypes
+        df = storage.read_players(columns=self.columns, directory=self.directory)
+        gw_df = storage.read_gameweeks(directory=self.directory)
+        self.swap(compact_dtypes(df, 'df'), compact_dtypes(gw_df, 'gw_df'), manifest['players'].get('written'))
+        self.status = 'loaded'
+        logger.info(f"Loaded the snapshot of {manifest['players']['date']} from {self.directory}.")
+        return True
+
+    def is_current(self):
+        '''
+        True if the stored snapshot was written today.
+        '''
+        return storage.read_manifest(self.directory).get('players', {}).get('date') == storage.today()
+
+    def refresh(self):
+        '''
+        Starts a background rebuild unless one is already running. Returns the thread.
+        '''
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return self.thread
+            self.status = 'refreshing'
+            self.thread = threading.Thread(target=self._refresh, name='dataset-refresh', daemon=True)
+            self.thread.start()
+            return self.thread
+
+    def _refresh(self):
+        t_start = time.perf_counter()
+        # pre_process runs its downloads on the thread's event loop, closed when the refresh ends
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            df, gw_df = self.build()
+            self.update(df[self.columns] if self.columns else df, gw_df)
+            self.status, self.error = 'current', None
+            logger.info(f"Dataset refreshed in {time.perf_counter() - t_start:.1f}s.")
+        except Exception as error:
+            self.status, self.error = 'failed', repr(error)
+            logger.exception("Dataset refresh failed, still serving the previous snapshot.")
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+            if self.metrics:
+                instrument.recorder.to_json(self.metrics + '.json')
+                instrument.recorder.to_prometheus(self.metrics + '.prom')
+
+    def update(self, df, gw_df):
+        '''
+        Serves newly built frames.
+        '''
+        self.swap(df, gw_df)
+
+    def summary(self):
+        '''
+        Age of the data being served and the refresh status.
+        '''
+        return {'status': self.status,
+                'players': len(self.df),
+                'updated': self.updated,
+                'age_seconds': round(time.time() - self.updated, 1) if self.updated else None,
+                'error': self.error}
+
+
+#%% Shared dataset
+
+shared_directory = '.data/shared'
+
+def read_pointer(directory=shared_directory):
+    '''
+    The published generation, {'generation', 'date', 'written'}, or {} if nothing has been published.
+    '''
+    try:
+        with open(os.path.join(directory, 'current.json'), 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def publish(df, gw_df, directory=shared_directory):
+    '''
+    Writes df and gw_df as arrow files of a new generation and points current.json at it. Older generations are
+    removed, processes that still map them keep their pages until they attach to the new one.
+    '''
+    generation = read_pointer(directory).get('generation', 0) + 1
+    path = os.path.join(directory, f'generation={generation}')
+    os.makedirs(path, exist_ok=True)
+    for name, frame in [('df', df), ('gw_df', gw_df)]:
+        table = pa.Table.from_pandas(frame)
+        with pa.OSFile(os.path.join(path, name + '.arrow'), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    pointer = {'generation': generation, 'date': storage.today(), 'written': time.time()}
+    with open(os.path.join(directory, 'current.json.tmp'), 'w') as outf:
+        json.dump(pointer, outf)
+    os.replace(os.path.join(directory, 'current.json.tmp'), os.path.join(directory, 'current.json'))
+
+    for old in os.listdir(directory):
+        if old.startswith('generation=') and old != f'generation={generation}':
+            shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    logger.info(f"Published generation {generation} to {path}.")
+    return pointer
+
+
+def attach(directory=shared_directory):
+    '''
+    Memory maps the published generation, returns (df, gw_df, pointer). Numeric columns without missing values are
+    views of the mapped files, so every process attached to a generation shares one copy of them.
+    '''
+    for attempt in range(3):
+        pointer = read_pointer(directory)
+        path = os.path.join(directory, f"generation={pointer['generation']}")
+        try:
+            frames = [pa.ipc.open_file(pa.memory_map(os.path.join(path, name + '.arrow'), 'r')).read_all()
+                      .to_pandas(split_blocks=True) for name in ['df', 'gw_df']]
+            return (*frames, pointer)
+        except FileNotFoundError:
+            # The generation was replaced between reading the pointer and opening its files
+            if attempt == 2:
+                raise
+
+
+class SharedDataset(Dataset):
+    '''
+    Dataset shared by the worker processes of one deployment through the arrow files in directory.
+
+    Workers attach to the published generation instead of loading the store themselves. Rebuilds take the lock
+    file in directory without waiting, so when several workers find the data out of date only one downloads and
+    processes it, the rest keep serving the current generation. watch() polls current.json and attaches each
+    worker to new generations as they are published.
+    '''
+    def __init__(self, columns=None, build=None, directory=storage.store, metrics=None, shared=shared_directory):
+        super().__init__(columns, build, directory, metrics)
+        self.shared = shared
+        self.generation = None
+        self.watcher = None
+        os.makedirs(shared, exist_ok=True)
+
+    def file_lock(self, blocking=True):
+        '''
+        Open lock file held with an exclusive flock, or None if another process holds it and blocking is False.
+        '''
+        file = open(os.path.join(self.shared, 'refresh.lock'), 'a')
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            file.close()
+            return None
+        return file
+
+    def update(self, df, gw_df):
+        '''
+        Publishes newly built frames as a new generation and attaches to it.
+        '''
+        publish(df, gw_df, self.shared)
+        self.attach()
+
+    def attach(self):
+        df, gw_df, pointer = attach(self.shared)
+        self.generation = pointer['generation']
+        self.swap(df, gw_df, pointer['written'])
+
+    def load(self):
+        '''
+        Attaches to the published generation. If there is none the first worker to take the lock publishes the stored
+        snapshot and the others wait for it. Returns False if there is nothing to publish.
+        '''
+        if not read_pointer(self.shared):
+            lock = self.file_lock()
+            try:
+                if not read_pointer(self.shared):
+                    if not super().load():
+                        return False
+                    publish(self.df, self.gw_df, self.shared)
+            finally:
+                lock.close()
+
+        self.attach()
+        self.status = 'loaded'
+        logger.info(f"Attached to generation {self.generation} in {self.shared}.")
+        return True
+
+    def is_current(self):
+        return read_pointer(self.shared).get('date') == storage.today()
+
+    def _refresh(self):
+        lock = self.file_lock(blocking=False)
+        if lock is None:
+            self.status = 'refreshing in another worker'
+            logger.info("Another worker is refreshing the dataset.")
+            return
+        try:
+            # Another worker may have published while this one was waiting to refresh
+            if self.is_current():
+                self.attach()
+                self.status = 'current'
+                return
+            super()._refresh()
+        finally:
+            lock.close()
+
+    def watch(self, interval=30):
+        '''
+        Starts a thread that attaches to new generations published by other workers, checking every interval seconds.
+        A check that fails is logged and the next one tried, the worker serving its current generation meanwhile.
+        '''
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    generation = read_pointer(self.shared).get('generation')
+                    if generation is not None and generation != self.generation:
+                        self.attach()
+                        self.status = 'current' if self.is_current() else 'loaded'
+                        logger.info(f"Attached to generation {generation}.")
+                except Exception:
+                    logger.exception(f"Could not attach to the generation published in {self.shared}.")
+
+        self.watcher = self.watcher or threading.Thread(target=poll, name='dataset-watch', daemon=True)
+        if not self.watcher.is_alive():
+            self.watcher.start()
+        return self.watcher
+
+
+def default_build():
+    import pre_process as pp
+    return pp.main(save_to_file=True, incremental=True)
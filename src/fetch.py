@@ -0,0 +1,198 @@
+#%% Imports
+import json
+import time
+import random
+import asyncio
+import logging
+import numpy as np
+import httpx
+
+logger = logging.basicConfig(format='[%(levelname)s %(module)s] %(asctime)s - %(message)s', level = logging.INFO)
+logger = logging.getLogger(__name__)
+
+#%% Errors
+
+class FetchError(Exception):
+    '''
+    Raised when requests still fail after all retries. failed maps each key to its last error.
+    '''
+    def __init__(self, failed):
+        self.failed = failed
+        super().__init__(f"{len(failed)} requests failed after retrying, e.g. {next(iter(failed.items()))}")
+
+
+class RetryableError(Exception):
+    pass
+
+
+#%% Rate limiting
+
+class TokenBucket:
+    '''
+    Token bucket rate limiter, allows bursts of up to capacity requests and rate requests per second on average.
+    '''
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = None
+
+    async def acquire(self):
+        # The lock is created on first use so the bucket binds to the running event loop
+        self.lock = self.lock or asyncio.Lock()
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+#%% Stats
+
+class FetchStats:
+    '''
+    Latency, retry and throughput statistics for one batch of requests.
+    '''
+    def __init__(self):
+        self.latencies = []
+        self.retries = 0
+        self.failures = 0
+        self.cached = 0
+        self.not_modified = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        latencies = np.array(self.latencies) * 1000
+        return {'requests': len(self.latencies),
+                'failures': self.failures,
+                'retries': self.retries,
+                'cached': self.cached,
+                'not_modified': self.not_modified,
+                'seconds': round(elapsed, 3),
+                'requests_per_second': round(len(self.latencies) / elapsed, 2) if elapsed else None,
+                'p50_ms': round(float(np.percentile(latencies, 50)), 2) if len(latencies) else None,
+                'p99_ms': round(float(np.percentile(latencies, 99)), 2) if len(latencies) else None}
+
+
+#%% Fetcher
+
+class Fetcher:
+    '''
+    Fetches many JSON documents with bounded concurrency.
+
+    concurrency caps requests in flight and max_connections caps the connection pool (all FPL requests go to one host).
+    Transport errors, 429/5xx responses and bodies that are not valid JSON are retried up to retries times with
+    exponential backoff and full jitter. rate, if given, limits requests per second with a token bucket.
+    cache, an HttpCache, serves fresh urls without a request and revalidates stale ones with conditional requests.
+    '''
+    def __init__(self, concurrency=20, max_connections=20, max_keepalive_connections=10, retries=4, backoff=0.5,
+                 max_backoff=10, timeout=10, rate=None, burst=None, cache=None):
+        self.concurrency = concurrency
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections)
+        self.timeout = httpx.Timeout(timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate = rate
+        self.burst = burst
+        self.cache = cache
+        self.stats = FetchStats()
+
+    async def get_json(self, urls):
+        '''
+        Fetches {key: url} and returns {key: parsed json} in the same order.
+        Raises FetchError once every request has finished if any of them failed.
+        '''
+        results = {key: data async for key, data in self.stream_json(urls)}
+        return {key: results[key] for key in urls}
+
+    async def stream_json(self, urls):
+        '''
+        Fetches {key: url} and yields (key, parsed json) as each response arrives, so callers can write results out
+        without holding all of them. Raises FetchError after the last result if any request failed.
+        '''
+        self.stats = FetchStats()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        bucket = TokenBucket(self.rate, self.burst) if self.rate else None
+        failed = {}
+
+        async def get(key, url):
+            try:
+                return key, await self._get(client, url, semaphore, bucket)
+            except Exception as error:
+                return key, error
+
+        async with httpx.AsyncClient(limits=self.limits, timeout=self.timeout) as client:
+            # Finished tasks are dropped from the set so a result is only referenced until it has been yielded
+            tasks = set()
+            for key, url in urls.items():
+                task = asyncio.ensure_future(get(key, url))
+                task.add_done_callback(tasks.discard)
+                tasks.add(task)
+            try:
+                for task in asyncio.as_completed(tasks):
+                    key, result = await task
+                    if isinstance(result, Exception):
+                        failed[key] = result
+                    else:
+                        yield key, result
+            finally:
+                for task in list(tasks):
+                    task.cancel()
+
+        self.stats.finished = time.perf_counter()
+        if self.cache:
+            self.cache.save()
+        logger.info(f"Fetched {len(urls)} urls - {self.stats.summary()}")
+
+        if failed:
+            raise FetchError({key: failed[key] for key in urls if key in failed})
+
+    async def _get(self, client, url, semaphore, bucket):
+        if self.cache and self.cache.is_fresh(url):
+            self.stats.cached += 1
+            return json.loads(self.cache.body(url))
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with semaphore:
+                    if bucket:
+                        await bucket.acquire()
+                    t_start = time.perf_counter()
+                    response = await client.get(url, headers=self.cache.validators(url) if self.cache else None)
+                    if response.status_code == 304 and self.cache and self.cache.stored(url):
+                        self.stats.not_modified += 1
+                        self.stats.latencies.append(time.perf_counter() - t_start)
+                        return json.loads(self.cache.revalidated(url))
+
+                    if response.status_code == 429 or response.status_code >= 500:
+                        raise RetryableError(f"{url} returned {response.status_code}")
+                    response.raise_for_status()
+                    try:
+                        data = response.json()
+                    except json.decoder.JSONDecodeError as error:
+                        raise RetryableError(f"{url} returned invalid json") from error
+                    self.stats.latencies.append(time.perf_counter() - t_start)
+                    if self.cache:
+                        self.cache.store(url, response.headers, response.content)
+                    return data
+
+            except (RetryableError, httpx.TransportError) as error:
+                if attempt == self.retries:
+                    self.stats.failures += 1
+                    raise
+                self.stats.retries += 1
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+                logger.debug(f"{error!r}, retrying in {delay:.2f}s.")
+                await asyncio.sleep(delay)
+
+            except httpx.HTTPStatusError:
+                self.stats.failures += 1
+                raise
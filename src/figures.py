@@ -0,0 +1,114 @@
+'''
+Server-side figure cache for the dashboard callbacks.
+'''
+#%% Imports
+import threading
+import logging
+import numpy as np
+import pandas as pd
+import plotly.express as px
+from collections import OrderedDict
+
+logger = logging.basicConfig(format='[%(levelname)s %(module)s] %(asctime)s - %(message)s', level = logging.INFO)
+logger = logging.getLogger(__name__)
+build_lock = threading.Lock()
+
+#%% Figure cache
+
+class FigureCache:
+    '''
+    Scatter figures of the player frame keyed on (x_axis, y_axis, positions, teams), with LRU eviction.
+
+    render_mode is passed to px.scatter, 'webgl' draws with scattergl.
+    Positions and teams are held as one bit per row, so a selection is two bitwise ands over arrays instead of
+    a copy of the frame and two isin scans. The selections are keyed by their bitmasks, so the same positions
+    and teams picked in any order share an entry. reload swaps in a new frame and clears the cache.
+    '''
+    def __init__(self, df, positions, color_map=None, max_size=256, render_mode='auto'):
+        self.positions = list(positions)
+        self.color_map = color_map
+        self.render_mode = render_mode
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+        self.reload(df)
+
+    def reload(self, df):
+        '''
+        Replaces the frame the figures are drawn from and drops every cached figure.
+        '''
+        codes = pd.Categorical(df['element_type'], categories=self.positions).codes.astype(np.int64)
+        # Positions outside self.positions have code -1 and are never selected
+        position_bits = np.where(codes >= 0, np.left_shift(1, np.maximum(codes, 0)), 0)
+        team_bits = np.left_shift(1, df['team'].to_numpy(dtype=np.int64))
+        with self.lock:
+            self.df = df
+            self.position_bits = position_bits
+            self.team_bits = team_bits
+            self.figures = OrderedDict()
+        logger.info(f"Figure cache reloaded with {len(df)} players.")
+
+    def mask(self, filter_by, team):
+        '''
+        Bitmasks of the selected positions and teams.
+        '''
+        positions = sum(1 << self.positions.index(position) for position in set(filter_by or []) if position in self.positions)
+        teams = sum(1 << int(id) for id in set(team or []))
+        return positions, teams
+
+    def rows(self, positions, teams):
+        return np.flatnonzero((self.position_bits & positions).astype(bool) & (self.team_bits & teams).astype(bool))
+
+    def scatter(self, x_axis, y_axis, filter_by, team):
+        '''
+        Figure of y_axis against x_axis for the players in the selected positions and teams, as a plotly dict.
+        '''
+        key = (x_axis, y_axis, *self.mask(filter_by, team))
+        with self.lock:
+            figure = self.figures.get(key)
+            if figure is not None:
+                self.figures.move_to_end(key)
+                self.hits += 1
+                return figure
+            self.misses += 1
+            df, rows = self.df, self.rows(*key[2:])
+
+        columns = list(dict.fromkeys([x_axis, y_axis, 'element_type', 'player_name']))
+        selected = pd.DataFrame({column: df[column].to_numpy()[rows] for column in columns})
+        # plotly express shares template objects between calls and fails when figures are built concurrently
+        with build_lock:
+            figure = px.scatter(selected,
+                                x=x_axis,
+                                y=y_axis,
+                                color='element_type',
+                                color_discrete_map=self.color_map,
+                                hover_data=['player_name'],
+                                render_mode=self.render_mode,
+                                title=f"{y_axis} vs {x_axis}").to_plotly_json()
+
+        with self.lock:
+            # Only cache figures drawn from the current frame
+            if df is self.df:
+                self.figures[key] = figure
+                if len(self.figures) > self.max_size:
+                    self.figures.popitem(last=False)
+        return figure
+
+
+#%% Clientside data
+
+def column_data(df, columns, positions, color_map=None):
+    '''
+    The player frame in the compact column form the clientside scatter callback (assets/scatter.js) draws from.
+    Positions are sent as codes into positions, values as floats and missing values as nulls.
+    '''
+    def values(column):
+        # Rounding drops the float32 noise of compacted columns
+        return [None if np.isnan(value) else value for value in df[column].astype('float64').round(6).tolist()]
+
+    return {'positions': list(positions),
+            'colors': color_map or {},
+            'position': pd.Categorical(df['element_type'], categories=positions).codes.tolist(),
+            'team': df['team'].astype(int).tolist(),
+            'player_name': df['player_name'].astype(str).tolist(),
+            'columns': {column: values(column) for column in columns}}
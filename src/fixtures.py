@@ -0,0 +1,184 @@
+'''
+Fixtures and fixture difficulty as dense arrays indexed by (team, gameweek).
+
+    fixtures, teams = get_fixtures()
+    matrix = FixtureMatrix(fixtures, teams)
+    matrix.ahead('difficulty', gameweek=20, n=5)[df['team']]   # difficulty of every player's next 5 fixtures
+    gw_df = matrix.join(gw_df)                                 # difficulty of each player-gameweek row's fixtures
+
+fixtures are the records of the FPL fixtures endpoint and teams those of bootstrap-static, with their strengths.
+Arrays are indexed by team id and gameweek directly, so a team's season is a row and the next n gameweeks of every
+team are a column slice. Teams play up to slots fixtures in a gameweek (double gameweeks), and none in a blank one.
+'''
+#%% Imports
+import logging
+import numpy as np
+import pandas as pd
+from http_cache import HttpCache
+
+logger = logging.basicConfig(format='[%(levelname)s %(module)s] %(asctime)s - %(message)s', level = logging.INFO)
+logger = logging.getLogger(__name__)
+
+#%% Get fixtures
+
+def get_fixtures(url='https://fantasy.premierleague.com/api/', cache=None):
+    '''
+    (fixtures, teams) from the fixtures endpoint and bootstrap-static, each requested once through the HttpCache.
+    '''
+    cache = HttpCache() if cache is None else cache
+    documents = {}
+    for name in ['fixtures/', 'bootstrap-static/']:
+        status_code, documents[name] = cache.get_json(url + name)
+        if status_code != 200:
+            raise Exception("Response was code " + str(status_code))
+    return documents['fixtures/'], documents['bootstrap-static/']['teams']
+
+
+#%% Fixture matrix
+# Per fixture values, each from the team's point of view: the FPL difficulty rating, and the team's strength less
+# its opponent's for attack against defence, defence against attack and overall, at their venues
+fields = ['difficulty', 'attack', 'defence', 'overall']
+
+def joined_columns(ahead=5, behind=5):
+    '''
+    Names of the columns FixtureMatrix.join adds.
+    '''
+    return ['fixtures'] + fields + [f'{field}_{name}_{n}' for name, n in [('next', ahead), ('last', behind)]
+                                    for field in ['difficulty', 'fixtures']]
+
+
+class FixtureMatrix:
+    '''
+    Fixtures as arrays of shape (teams, gameweeks, slots): opponent (0 for none), home and each of fields (NaN for
+    none), with row 0 and gameweek 0 left empty so team ids and gameweeks index them. counts is the number of
+    fixtures of each team and gameweek and totals[field] the sum of field over them, with cumulative sums along
+    the gameweeks so any window of gameweeks is a difference of two columns.
+    Fixtures without a gameweek (not scheduled yet) are left out. sides holds the home and away team of each
+    fixture id, (0, 0) for ids that are not fixtures.
+    '''
+    def __init__(self, fixtures, teams):
+        fixtures = pd.DataFrame.from_records(fixtures, columns=['id', 'event', 'team_h', 'team_a', 'team_h_difficulty',
+                                                                 'team_a_difficulty'])
+        self.sides = np.zeros((int(fixtures['id'].max()) + 1 if len(fixtures) else 1, 2), dtype=np.int16)
+        self.sides[fixtures['id'].to_numpy(dtype=np.int64)] = fixtures[['team_h', 'team_a']]
+        fixtures = fixtures.dropna(subset=['event']).astype(int)
+        teams = pd.DataFrame.from_records(teams).set_index('id')
+
+        # One row per team and fixture
+        home = fixtures.rename(columns={'team_h': 'team', 'team_a': 'opponent', 'team_h_difficulty': 'difficulty'})
+        away = fixtures.rename(columns={'team_a': 'team', 'team_h': 'opponent', 'team_a_difficulty': 'difficulty'})
+        sides = pd.concat([home.assign(home=True), away.assign(home=False)], ignore_index=True)
+        sides = sides.sort_values(['team', 'event'], kind='stable')
+        strengths = teams[[f'strength_{kind}_{side}' for kind in ['attack', 'defence', 'overall']
+                           for side in ['home', 'away']]].to_numpy(dtype=float)
+        positions = pd.Index(teams.index)
+        def strength(kind, column, away):
+            # The team's strength_<kind>_home, or _away when away
+            offset = 2 * ['attack', 'defence', 'overall'].index(kind)
+            return strengths[positions.get_indexer(sides[column]), offset + away]
+        own = lambda kind: strength(kind, 'team', ~sides['home'].to_numpy())
+        theirs = lambda kind: strength(kind, 'opponent', sides['home'].to_numpy())
+        sides['attack'] = own('attack') - theirs('defence')
+        sides['defence'] = own('defence') - theirs('attack')
+        sides['overall'] = own('overall') - theirs('overall')
+
+        self.teams = teams.index.to_numpy()
+        self.n_teams = int(max(self.teams.max(initial=0), sides['team'].max() if len(sides) else 0)) + 1
+        self.n_gameweeks = int(sides['event'].max() if len(sides) else 0) + 1
+        team, event = sides['team'].to_numpy(), sides['event'].to_numpy()
+        # Slot of each fixture among its team's fixtures in the gameweek
+        first = np.r_[True, (team[1:] != team[:-1]) | (event[1:] != event[:-1])]
+        starts = np.flatnonzero(first)
+        slot = np.arange(len(sides)) - np.repeat(starts, np.diff(np.r_[starts, len(sides)]))
+        self.slots = int(slot.max(initial=0)) + 1
+
+        shape = (self.n_teams, self.n_gameweeks, self.slots)
+        self.opponent = np.zeros(shape, dtype=np.int16)
+        self.opponent[team, event, slot] = sides['opponent']
+        self.home = np.zeros(shape, dtype=bool)
+        self.home[team, event, slot] = sides['home']
+        self.values = {}
+        for field in fields:
+            self.values[field] = np.full(shape, np.nan, dtype=np.float32)
+            self.values[field][team, event, slot] = sides[field]
+
+        self.counts = (self.opponent > 0).sum(axis=2)
+        self.totals = {field: np.nansum(values, axis=2) for field, values in self.values.items()}
+        self.cumulative = {field: np.concatenate([np.zeros((self.n_teams, 1)), np.cumsum(totals, axis=1)], axis=1)
+                           for field, totals in dict(self.totals, fixtures=self.counts).items()}
+
+    def window(self, field, first, n):
+        '''
+        Sum of field (or the number of fixtures, field='fixtures') over gameweeks first to first + n - 1 of every
+        team, as an array indexed by team id. Gameweeks outside the season count as having no fixtures.
+        '''
+        cumulative = self.cumulative[field]
+        return cumulative[:, np.clip(first + n, 0, self.n_gameweeks)] - cumulative[:, np.clip(first, 0, self.n_gameweeks)]
+
+    def ahead(self, field, gameweek, n):
+        '''
+        Total of field over the n gameweeks after gameweek, indexed by team id.
+        '''
+        return self.window(field, gameweek + 1, n)
+
+    def upcoming(self, gameweek, n):
+        '''
+        The fixtures of the n gameweeks after gameweek as {'opponent', 'home', field: (teams, n, slots) array}.
+        '''
+        window = slice(gameweek + 1, gameweek + 1 + n)
+        return dict({'opponent': self.opponent[:, window], 'home': self.home[:, window]},
+                    **{field: values[:, window] for field, values in self.values.items()})
+
+    def rows(self, teams, rounds):
+        '''
+        Flat positions in the (teams, gameweeks) arrays of each (team, round), -1 for teams or rounds outside them.
+        '''
+        teams, rounds = np.asarray(teams, dtype=np.int64), np.asarray(rounds, dtype=np.int64)
+        inside = (teams >= 0) & (teams < self.n_teams) & (rounds >= 0) & (rounds < self.n_gameweeks)
+        return np.where(inside, teams * self.n_gameweeks + rounds, -1)
+
+    def teams_of(self, fixture, opponent):
+        '''
+        Team that played each fixture id against opponent, the side of the fixture that is not the opponent, and 0
+        for ids that are not fixtures.
+        '''
+        fixture = np.asarray(fixture, dtype=np.int64)
+        known = (fixture > 0) & (fixture < len(self.sides))
+        home, away = self.sides[np.where(known, fixture, 0)].T
+        return np.where(known, np.where(home == np.asarray(opponent), away, home), 0)
+
+    def columns(self, ahead=5, behind=5):
+        '''
+        {column: (teams, gameweeks) array} of the columns join adds, for every team and gameweek.
+        '''
+        gameweeks = np.arange(self.n_gameweeks)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            columns = {'fixtures': self.counts.astype(float)}
+            columns.update({field: self.totals[field] / np.where(self.counts > 0, self.counts, np.nan) for field in fields})
+        for name, first, n in [('next', gameweeks + 1, ahead), ('last', gameweeks - behind + 1, behind)]:
+            for field in ['difficulty', 'fixtures']:
+                columns[f'{field}_{name}_{n}'] = self.window(field, first, n)
+        return columns
+
+    def join(self, gw_df, ahead=5, behind=5):
+        '''
+        gw_df with the fixtures of the team each row's player played for in its round (fixtures, and the mean of
+        each of fields, NaN in a blank gameweek), the total difficulty and number of fixtures in the ahead rounds
+        after it (difficulty_next_<ahead>, fixtures_next_<ahead>) and in the behind rounds up to and including it
+        (difficulty_last_<behind>, fixtures_last_<behind>). That team is found from the row's fixture and
+        opponent_team, as process_gw_data keeps them, so a player who moved club gets the fixtures of the club
+        they played for. Rows without a known fixture, such as blank gameweeks, take the player's current team
+        from the team column. Rows of teams or rounds without fixture data get no fixtures and NaN. The columns
+        are worked out per team and gameweek by columns, then gathered for every row at once.
+        '''
+        teams = gw_df['team'].to_numpy(dtype=np.int64)
+        if {'fixture', 'opponent_team'} <= set(gw_df.columns):
+            played = self.teams_of(gw_df['fixture'].to_numpy(), gw_df['opponent_team'].to_numpy())
+            teams = np.where(played > 0, played, teams)
+        # Rows of teams or rounds outside the arrays take the NaN appended to each column
+        rows = self.rows(teams, gw_df.index.to_numpy(dtype=np.int64))
+        gw_df = gw_df.copy()
+        for name, values in self.columns(ahead, behind).items():
+            gathered = np.append(values.ravel(), np.nan)[rows]
+            gw_df[name] = np.nan_to_num(gathered).astype(np.int16) if name == 'fixtures' else gathered
+        return gw_df
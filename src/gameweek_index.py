@@ -0,0 +1,115 @@
+'''
+(id, round) index of the gameweek frame.
+
+gw_df holds one row per player and gameweek, indexed by round. GameweekIndex keeps it sorted by (id, round) with an
+offsets table of where each player's rows start and stop, so queries slice rows instead of scanning the frame:
+
+    index = GameweekIndex(gw_df)
+    index.player(233, first=10, last=15)   # one player's gameweeks, O(log n)
+    index.gameweek(20, ids=[233, 359])     # many players at one gameweek, O(1) per player
+    index.latest(5)                        # the last 5 gameweeks of every player
+'''
+#%% Imports
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.basicConfig(format='[%(levelname)s %(module)s] %(asctime)s - %(message)s', level = logging.INFO)
+logger = logging.getLogger(__name__)
+
+#%% Sorting
+
+def sort_gameweeks(gw_df):
+    '''
+    gw_df ordered by (id, round), the order GameweekIndex and storage.read_gameweeks use.
+    '''
+    order = np.lexsort((gw_df.index.to_numpy(), pd.factorize(gw_df['id'], sort=True)[0]))
+    if (order == np.arange(len(order))).all():
+        return gw_df
+    return gw_df.iloc[order]
+
+
+#%% Index
+
+class GameweekIndex:
+    '''
+    Offsets of each player's rows in gw_df sorted by (id, round).
+
+    ids, starts and stops give the rows of the player at each position, position maps an id to it. process_gw_data
+    gives every player a row for each gameweek from 1 to their latest, and when that holds (dense) a player's row
+    for a round is found by arithmetic. Otherwise rounds are found by binary search.
+    '''
+    def __init__(self, gw_df):
+        self.gw_df = sort_gameweeks(gw_df)
+        self.rounds = self.gw_df.index.to_numpy(dtype=np.int64)
+        codes, self.ids = pd.factorize(self.gw_df['id'], sort=True)
+        counts = np.bincount(codes, minlength=len(self.ids))
+        self.stops = np.cumsum(counts)
+        self.starts = self.stops - counts
+        self.position = pd.Index(self.ids)
+        # Rows keyed by player position and round, sorted, for binary search across players
+        self.width = int(self.rounds.max(initial=0)) + 1
+        self.keys = codes.astype(np.int64) * self.width + self.rounds
+        self.dense = bool((self.rounds == np.arange(len(self.rounds)) - np.repeat(self.starts, counts) + 1).all())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, ids):
+        '''
+        Positions of ids in the offsets table, -1 for ids without gameweeks.
+        '''
+        return self.position.get_indexer(ids)
+
+    def player_rows(self, id, first=None, last=None):
+        '''
+        Row numbers of one player's gameweeks from first to last, including both.
+        '''
+        position = self.position.get_loc(id)
+        start, stop = self.starts[position], self.stops[position]
+        if first is not None:
+            start = start + np.searchsorted(self.rounds[start:stop], first, side='left')
+        if last is not None:
+            stop = self.starts[position] + np.searchsorted(self.rounds[self.starts[position]:stop], last, side='right')
+        return np.arange(start, max(start, stop))
+
+    def gameweek_rows(self, round, ids=None):
+        '''
+        Row numbers of the given players, in the order of ids or of every player by default, at one gameweek.
+        Players without it are left out.
+        '''
+        positions = np.arange(len(self.ids)) if ids is None else self.positions(ids)
+        positions = positions[positions >= 0]
+        if self.dense:
+            rows = self.starts[positions] + round - 1
+            return rows[(round >= 1) & (rows < self.stops[positions])]
+        keys = positions * self.width + round
+        rows = np.searchsorted(self.keys, keys)
+        found = rows < len(self.keys)
+        found[found] = self.keys[rows[found]] == keys[found]
+        return rows[found]
+
+    def latest_rows(self, n, ids=None):
+        '''
+        Row numbers of the last n gameweeks of the given players, in the order of ids or of every player by default.
+        '''
+        positions = np.arange(len(self.ids)) if ids is None else self.positions(ids)
+        positions = positions[positions >= 0]
+        starts = np.maximum(self.stops[positions] - n, self.starts[positions])
+        counts = self.stops[positions] - starts
+        return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    def player(self, id, first=None, last=None):
+        return self.gw_df.iloc[self.player_rows(id, first, last)]
+
+    def gameweek(self, round, ids=None):
+        return self.gw_df.iloc[self.gameweek_rows(round, ids)]
+
+    def latest(self, n, ids=None):
+        return self.gw_df.iloc[self.latest_rows(n, ids)]
+
+    def player_codes(self):
+        '''
+        Position of each row's player in ids.
+        '''
+        return np.repeat(np.arange(len(self.ids)), self.stops - self.starts)
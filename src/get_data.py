@@ -1,109 +1,311 @@
 #%% Imports
+import os
 import requests
-import time
 import json
 import logging
 import datetime
 import asyncio
 import json
 import aiohttp
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from understat import Understat
-import httpx
 from tools import timer
+import storage
+import instrument
+from fetch import Fetcher
+from http_cache import HttpCache
+from preferences import season
 
 logger = logging.basicConfig(format='[%(levelname)s %(module)s] %(asctime)s - %(message)s', level = logging.INFO)
 logger = logging.getLogger(__name__)
-today = '_'.join(str(datetime.datetime.today()).split(' ')[0].split('-'))
 #%% Get data function
 
 @timer
-def get_data(url="https://fantasy.premierleague.com/api/bootstrap-static/", save_to_file=True):
+def get_data(url="https://fantasy.premierleague.com/api/bootstrap-static/", save_to_file=True, cache=None):
     """ 
     Retrieve the player data from FPL boostrap static
+
+    Requests go through an HttpCache, the default one unless cache is given. cache=False skips caching.
     """
     logger.info(f"Getting raw fpl data from {url}.")
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception("Response was code " + str(response.status_code))
+    cache = HttpCache() if cache is None else cache
+    if cache:
+        status_code, data = cache.get_json(url)
+    else:
+        response = requests.get(url)
+        status_code = response.status_code
+    if status_code != 200:
+        raise Exception("Response was code " + str(status_code))
     
-    players = response.json()['elements']
+    players = (data if cache else response.json())['elements']
     players = {player.pop('id'):player for player in players}
 
     if save_to_file:
-        filename = ".data/" + today + "_player_data.json"
+        filename = ".data/" + storage.today() + "_player_data.json"
         with open(filename, 'w') as outf:
             json.dump(players, outf)
 
     return players
 
 
+def get_teams(url="https://fantasy.premierleague.com/api/bootstrap-static/", cache=None):
+    '''
+    {team id: name} of the current season from bootstrap-static, through the HttpCache like get_data.
+    '''
+    cache = HttpCache() if cache is None else cache
+    if cache:
+        status_code, data = cache.get_json(url)
+    else:
+        response = requests.get(url)
+        status_code, data = response.status_code, response.json()
+    if status_code != 200:
+        raise Exception("Response was code " + str(status_code))
+    return {team['id']: team['name'] for team in data['teams']}
+
+
+def bootstrap_teams(url="https://fantasy.premierleague.com/api/bootstrap-static/", cache=None):
+    '''
+    {team id: name} from the bootstrap-static response get_data or ingest stored in the HttpCache, without
+    requesting it again. None if no response is stored.
+    '''
+    cache = HttpCache() if cache is None else cache
+    data = cache.stored_json(url)
+    return data and {team['id']: team['name'] for team in data['teams']}
+
+
 #%% Get player hist
 
 @timer
-async def get_player_hist(player_ids, url='https://fantasy.premierleague.com/api/element-summary/', save_to_file=True):
+async def get_player_hist(player_ids, url='https://fantasy.premierleague.com/api/element-summary/', save_to_file=True,
+                          fetcher=None):
     ''''
     Retrive fixtures, season so far data, and historical data 
+
+    Requests are made by a Fetcher, which bounds concurrency and retries failed requests. Pass a fetcher to
+    change its limits, its stats are logged once all requests are complete. The default fetcher uses the default HttpCache.
+    With save_to_file each response is written to the history file as it arrives and a HistoryFile reading it
+    back is returned, otherwise a dict of all responses is returned.
     '''
     [TypeError("Player ID's must be ints") for id in player_ids if not isinstance(id, int)]          
     logger.info(f"Getting player history data for {len(player_ids)} player from {url}.")
 
-    async with httpx.AsyncClient() as client:
-        tasks = (client.get(url + str(player_id) + '/') for player_id in player_ids)
-        responses = await asyncio.gather(*tasks)
-
     # dict of dicts with player ID as key
+    fetcher = fetcher or Fetcher(cache=HttpCache())
+    urls = {player_id: url + str(player_id) + '/' for player_id in player_ids}
+    if not save_to_file:
+        return await fetcher.get_json(urls)
+
+    writer = BackgroundWriter(".data/" + storage.today() + "_history.ndjson")
     try:
-        data = {int((str(response.url)).split('/')[-2]):response.json() for response in responses}
-    except json.decoder.JSONDecodeError:
-        # Build a slower backup function without ASYNCIO
-        sleep_time = 10 #seconds
-        logger.info(f"JSON decode error raised. Sleeping for {sleep_time} seconds before retrying.")
-        time.sleep(sleep_time)
-        data = {int((str(response.url)).split('/')[-2]):response.json() for response in responses}
+        async for player_id, summary in fetcher.stream_json(urls):
+            writer.write(json.dumps([player_id, summary]) + '\n')
+    except BaseException:
+        await writer.close(discard=True)
+        raise
+    return HistoryFile(await writer.close())
 
-    if save_to_file:
-        filename = ".data/" + today + "_history.json"
-        with open(filename, 'w') as outf:
-            json.dump(data, outf)
 
-    return data
+class HistoryFile(Mapping):
+    '''
+    Read-only {player id: element-summary} view of a history file, one [id, element-summary] json array per line.
+    Opening it only records where each line starts, a player's line is read and parsed when they are looked up.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.offsets = {}
+        with open(filename, 'rb') as file:
+            offset = 0
+            for line in file:
+                self.offsets[int(line[1:line.index(b',')])] = offset
+                offset += len(line)
+
+    def __getitem__(self, id):
+        with open(self.filename, 'rb') as file:
+            file.seek(self.offsets[id])
+            return json.loads(file.readline())[1]
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, id):
+        return id in self.offsets
+
+    def subset(self, ids):
+        '''
+        HistoryFile of ids only, reading the same file without indexing it again.
+        '''
+        subset = HistoryFile.__new__(HistoryFile)
+        subset.filename = self.filename
+        subset.offsets = {id: self.offsets[id] for id in ids}
+        return subset
+
+
+class BackgroundWriter:
+    '''
+    Writes text to filename + '.tmp' on a thread of its own, so disk writes overlap with the event loop's network
+    I/O. Text is buffered and handed to the thread in blocks of buffer_size characters. close() waits for the
+    writes and replaces filename, or removes the temporary file with discard=True.
+    '''
+    def __init__(self, filename, buffer_size=2**16):
+        self.filename = filename
+        self.buffer_size = buffer_size
+        self.buffer, self.buffered = [], 0
+        self.file = open(filename + '.tmp', 'w')
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='writer')
+        self.pending = []
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.pending.append(self.executor.submit(self.file.write, ''.join(self.buffer)))
+            self.pending = [future for future in self.pending if not future.done() or future.exception()]
+            self.buffer, self.buffered = [], 0
+
+    async def close(self, discard=False):
+        self.flush()
+        try:
+            for future in self.pending:
+                await asyncio.wrap_future(future)
+        finally:
+            self.executor.submit(self.file.close).result()
+            self.executor.shutdown()
+        if discard:
+            os.remove(self.filename + '.tmp')
+        else:
+            os.replace(self.filename + '.tmp', self.filename)
+        return self.filename
+
+
+def write_json(filename, data):
+    with open(filename, 'w') as outf:
+        json.dump(data, outf)
+
+
+def write_history(filename, summaries):
+    '''
+    Writes (id, element-summary) pairs to a history file one line at a time, replacing filename once complete.
+    '''
+    with open(filename + '.tmp', 'w') as outf:
+        for player_id, summary in summaries:
+            outf.write(json.dumps([player_id, summary]) + '\n')
+    os.replace(filename + '.tmp', filename)
+    return HistoryFile(filename)
 
 
 #%% understat data
 
 @timer
-async def get_understat(induvidual_stats=True, save_to_file=True):
+async def get_understat(induvidual_stats=True, save_to_file=True, season=season):
     '''
-    
+    Premier League player totals of a season from understat, named by the year the season starts.
     '''
-    logger.info("Getting understat data.")
+    logger.info(f"Getting understat data for {season}.")
 
     async with aiohttp.ClientSession() as session:
         understat = Understat(session)
-        players = await understat.get_league_players('epl', 2021)
+        players = await understat.get_league_players('epl', season)
+
+    # Files are written on a thread so other downloads carry on meanwhile
+    await asyncio.to_thread(write_understat, players, induvidual_stats, save_to_file)
+    return players
+
+
+def write_understat(players, induvidual_stats=True, save_to_file=True):
+    if induvidual_stats:
+        for player in players:
+            write_json('.data/player_data/'+player['player_name']+'.json', player)
 
-        if induvidual_stats:
-            for player in players:
-                with open('.data/player_data/'+player['player_name']+'.json', 'w') as player_data:
-                    json.dump(player, player_data)
+    if save_to_file:
+        write_json(".data/" + storage.today() + "_raw_understats.json", players)
+
+
+#%% Concurrent ingestion
+# Sources each source waits for before it can start, used to find the critical path
+dependencies = {'element_summary': 'bootstrap'}
+
+@timer
+async def get_bootstrap(url="https://fantasy.premierleague.com/api/bootstrap-static/", save_to_file=True, fetcher=None):
+    '''
+    Async get_data, the players of bootstrap-static by id through a Fetcher.
+    '''
+    logger.info(f"Getting raw fpl data from {url}.")
+    fetcher = fetcher or Fetcher(cache=HttpCache())
+    data = (await fetcher.get_json({'bootstrap': url}))['bootstrap']
+    players = {player.pop('id'): player for player in data['elements']}
 
-        if save_to_file:    
-            with open(".data/" + today + "_raw_understats.json", 'w') as outf:
-                json.dump(players, outf)
-        
+    if save_to_file:
+        await asyncio.to_thread(write_json, ".data/" + storage.today() + "_player_data.json", players)
     return players
 
 
+async def ingest(player_data=None, player_history=None, understat=None, save_to_file=True, induvidual_stats=True,
+                 url='https://fantasy.premierleague.com/api/', cache=None):
+    '''
+    Downloads whichever of bootstrap-static, element-summary and understat are not given, concurrently in one event
+    loop, and returns (player_data, player_history, understat).
+
+    Understat is fetched alongside bootstrap-static, and element-summary requests start as soon as bootstrap-static
+    gives the player ids. Files are written on threads while downloads continue. Each source is timed as a span
+    under 'ingest' and the critical path through them is logged, see critical_path.
+    '''
+    cache = HttpCache() if cache is None else cache
+    results = {'bootstrap': player_data, 'element_summary': player_history, 'understat': understat}
+
+    async def source(name, fetch):
+        with instrument.span(name):
+            results[name] = await fetch()
+
+    async def bootstrap_and_history():
+        if results['bootstrap'] is None:
+            await source('bootstrap', lambda: get_bootstrap(url + 'bootstrap-static/', save_to_file, Fetcher(cache=cache)))
+        if results['element_summary'] is None:
+            await source('element_summary', lambda: get_player_hist(list(results['bootstrap']), url + 'element-summary/',
+                                                                    save_to_file, Fetcher(cache=cache)))
+
+    with instrument.span('ingest') as ingestion:
+        sources = [bootstrap_and_history()]
+        if results['understat'] is None:
+            sources.append(source('understat', lambda: get_understat(induvidual_stats, save_to_file)))
+        await asyncio.gather(*sources)
+
+    path = critical_path(ingestion)
+    if path:
+        logger.info("Ingestion critical path: " + ' -> '.join(f"{name} {seconds:.2f}s" for name, seconds in path) +
+                    f", {ingestion.seconds:.2f}s in total against {sum(child.seconds for child in ingestion.children):.2f}s"
+                    " run one after another.")
+    return results['bootstrap'], results['element_summary'], results['understat']
+
+
+def critical_path(ingestion, dependencies=dependencies):
+    '''
+    [(source, seconds)] of the chain of sources that finished last, which sets the time ingestion takes.
+    '''
+    spans = {child.name: child for child in ingestion.children}
+    if not spans:
+        return []
+    name = max(spans, key=lambda name: spans[name].started + spans[name].seconds)
+    path = []
+    while name in spans:
+        path.insert(0, (name, spans[name].seconds))
+        name = dependencies.get(name)
+    return path
+
+
 #%% main()
 @timer
 def main():
-    # Returns player data by player ID
-    data = get_data()
-
-    # Asynchrinous data I/O for understat and player hist
+    # Asynchrinous data I/O for bootstrap-static, understat and player hist
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(get_understat(induvidual_stats = True))
-    loop.run_until_complete(get_player_hist(player_ids = data.keys()))
+    loop.run_until_complete(ingest(induvidual_stats = True))
 
 
 #%% If name main
@@ -0,0 +1,180 @@
+#%% Imports
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import requests
+
+logger = logging.basicConfig(format='[%(levelname)s %(module)s] %(asctime)s - %(message)s', level = logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds a stored response is used without asking the server, by url pattern. Anything else is always revalidated.
+default_max_age = {r'bootstrap-static/$': 5*60,
+                   r'element-summary/\d+/$': 30*60,
+                   r'fixtures/': 30*60}
+
+#%% Cache
+
+class HttpCache:
+    '''
+    On-disk HTTP cache for the FPL endpoints.
+
+    Bodies are stored once per sha256 of their content under objects/, and index.json maps each url to its body,
+    ETag, Last-Modified and fetch time. Stale urls are revalidated with If-None-Match / If-Modified-Since and a 304
+    reuses the stored body. When the stored bodies exceed max_bytes the least recently used urls are evicted.
+    Several caches can share a directory: save merges the index on disk under a lock, keeping the latest fetch of
+    each url, and removes the bodies no url uses any more.
+    '''
+    def __init__(self, directory='.data/http_cache', max_bytes=256 * 2**20, max_age=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = default_max_age if max_age is None else max_age
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+
+        try:
+            with open(os.path.join(directory, 'index.json'), 'r') as file:
+                self.index = json.load(file)
+        except FileNotFoundError:
+            self.index = {}
+        # Bodies this cache stopped using since it last saved
+        self.replaced = set()
+
+    def _path(self, digest):
+        return os.path.join(self.directory, 'objects', digest)
+
+    def stored(self, url):
+        '''
+        True if url is in the index and its body is still stored, another cache may have removed it.
+        '''
+        return url in self.index and os.path.exists(self._path(self.index[url]['sha256']))
+
+    def is_fresh(self, url):
+        '''
+        True if url is stored and younger than its max-age.
+        '''
+        if not self.stored(url):
+            return False
+        entry = self.index[url]
+        max_age = next((age for pattern, age in self.max_age.items() if re.search(pattern, url)), 0)
+        return time.time() - entry['fetched'] < max_age
+
+    def validators(self, url):
+        '''
+        Conditional request headers for url.
+        '''
+        entry = self.index[url] if self.stored(url) else {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def body(self, url):
+        '''
+        Stored body of url, marking it as recently used.
+        '''
+        entry = self.index[url]
+        entry['accessed'] = time.time()
+        with open(self._path(entry['sha256']), 'rb') as file:
+            return file.read()
+
+    def stored_json(self, url):
+        '''
+        Parsed stored body of url however old it is, without a request, or None if url is not stored.
+        '''
+        return json.loads(self.body(url)) if self.stored(url) else None
+
+    def revalidated(self, url):
+        '''
+        Stored body of url after the server answered 304.
+        '''
+        self.index[url]['fetched'] = time.time()
+        return self.body(url)
+
+    def store(self, url, headers, body):
+        digest = hashlib.sha256(body).hexdigest()
+        if url in self.index and self.index[url]['sha256'] != digest:
+            self.replaced.add(self.index[url]['sha256'])
+        if not os.path.exists(self._path(digest)):
+            with open(self._path(digest), 'wb') as file:
+                file.write(body)
+        self.index[url] = {'sha256': digest, 'size': len(body), 'etag': headers.get('ETag'),
+                           'last_modified': headers.get('Last-Modified'), 'fetched': time.time(),
+                           'accessed': time.time()}
+
+    def evict(self):
+        '''
+        Drops least recently used urls until the stored bodies fit in max_bytes. Bodies shared by several urls are
+        removed once no url uses them.
+        '''
+        sizes = {entry['sha256']: entry['size'] for entry in self.index.values()}
+        total = sum(sizes.values())
+        users = {}
+        for entry in self.index.values():
+            users[entry['sha256']] = users.get(entry['sha256'], 0) + 1
+
+        for url in sorted(self.index, key=lambda url: self.index[url]['accessed']):
+            if total <= self.max_bytes:
+                break
+            digest = self.index.pop(url)['sha256']
+            users[digest] -= 1
+            if not users[digest]:
+                os.remove(self._path(digest))
+                total -= sizes[digest]
+                logger.debug(f"Evicted {url} from the http cache.")
+
+    def merge(self):
+        '''
+        Adds the entries of the index on disk, saved by other caches on the directory. Of two entries for a url the
+        latest fetched is kept and the other's body is marked as replaced.
+        '''
+        try:
+            with open(os.path.join(self.directory, 'index.json'), 'r') as file:
+                stored = json.load(file)
+        except FileNotFoundError:
+            stored = {}
+        # Entries whose body another cache removed
+        self.index = {url: entry for url, entry in self.index.items() if os.path.exists(self._path(entry['sha256']))}
+        for url, entry in stored.items():
+            mine = self.index.get(url)
+            if mine is None or entry['fetched'] > mine['fetched']:
+                self.index[url], entry = entry, mine
+            if entry is not None and entry['sha256'] != self.index[url]['sha256']:
+                self.replaced.add(entry['sha256'])
+
+    def save(self):
+        filename = os.path.join(self.directory, 'index.json')
+        with open(os.path.join(self.directory, 'index.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.merge()
+            for digest in self.replaced - {entry['sha256'] for entry in self.index.values()}:
+                if os.path.exists(self._path(digest)):
+                    os.remove(self._path(digest))
+            self.replaced.clear()
+            self.evict()
+            with open(filename + '.tmp', 'w') as outf:
+                json.dump(self.index, outf)
+            os.replace(filename + '.tmp', filename)
+
+    def get_json(self, url, session=requests):
+        '''
+        Blocking GET of a JSON document through the cache, returns the status code and parsed body.
+        A 304 is returned as a 200 with the stored body. Only bodies that parse are stored.
+        '''
+        if self.is_fresh(url):
+            return 200, json.loads(self.body(url))
+
+        response = session.get(url, headers=self.validators(url))
+        if response.status_code == 304 and self.stored(url):
+            data = json.loads(self.revalidated(url))
+        elif response.status_code == 200:
+            data = response.json()
+            self.store(url, response.headers, response.content)
+        else:
+            return response.status_code, None
+        self.save()
+        return 200, data
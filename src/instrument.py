@@ -0,0 +1,237 @@
+'''
+Stage instrumentation: nested timing spans for sync and async functions, with optional peak memory and row counts,
+exported as json or in the Prometheus text format.
+
+    @timer
+    def process_gw_data(df, hist_data): ...
+
+    with span('load'):
+        ...
+
+Spans opened while another is open become its children, also across awaits and in tasks created inside it,
+so pre_process.main produces a tree of its stages. Finished top level spans are kept in recorder.
+'''
+#%% Imports
+import os
+import time
+import json
+import asyncio
+import functools
+import contextlib
+import contextvars
+import threading
+import tracemalloc
+import logging
+from collections import deque
+
+logger = logging.basicConfig(format='[%(levelname)s %(module)s] %(asctime)s - %(message)s', level = logging.INFO)
+logger = logging.getLogger(__name__)
+
+current = contextvars.ContextVar('span', default=None)
+
+#%% Spans
+
+class Span:
+    '''
+    One timed stage. seconds is wall time from perf_counter, peak_memory the most memory traced by tracemalloc
+    above what was allocated when the span started (None when memory tracing is off), rows the length of the
+    returned frame or dict.
+    '''
+    def __init__(self, name, parent=None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.path = f'{parent.path}/{name}' if parent else name
+        self.attributes = attributes
+        self.children = []
+        self.seconds = None
+        self.rows = None
+        self.peak_memory = None
+        self.error = None
+        # Peak traced memory before tracemalloc's peak was last reset, by a child starting
+        self._peak = 0
+
+    def start(self):
+        self.started = time.time()
+        if tracemalloc.is_tracing():
+            current_memory, peak = tracemalloc.get_traced_memory()
+            self._start_memory = current_memory
+            # The peak the parent reached before this child is kept for the parent
+            if self.parent:
+                self.parent._peak = max(self.parent._peak, peak)
+            tracemalloc.reset_peak()
+        self._t_start = time.perf_counter()
+        return self
+
+    def stop(self, result=None, error=None):
+        self.seconds = time.perf_counter() - self._t_start
+        self.rows = rows(result)
+        self.error = repr(error) if error else None
+        if tracemalloc.is_tracing() and hasattr(self, '_start_memory'):
+            # Children reset the peak, so the span's peak is the larger of the peak since the last reset, its
+            # peaks before each child started and its children's peaks
+            peak = max(tracemalloc.get_traced_memory()[1], self._peak)
+            self.peak_memory = peak - self._start_memory
+            if self.parent:
+                self.parent._peak = max(self.parent._peak, peak)
+
+        if self.parent:
+            self.parent.children.append(self)
+        else:
+            recorder.add(self)
+        memory = f", peak memory {self.peak_memory / 2**20:.1f}MB" if self.peak_memory is not None else ""
+        logger.info(f"{self.name} took {1000*self.seconds:.5f}ms to compute{memory}.")
+
+    def to_dict(self):
+        return {'name': self.name, 'started': self.started, 'seconds': self.seconds, 'rows': self.rows,
+                'peak_memory': self.peak_memory, 'error': self.error, **self.attributes,
+                'children': [child.to_dict() for child in self.children]}
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+def rows(result):
+    '''
+    Length of a returned frame or dict, or of the first one in a returned tuple.
+    '''
+    if isinstance(result, tuple):
+        return next((rows(item) for item in result if rows(item) is not None), None)
+    if hasattr(result, 'shape') or isinstance(result, dict):
+        return len(result)
+    return None
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    '''
+    Times the block as a child of the open span.
+    '''
+    instance = Span(name, current.get(), **attributes).start()
+    token = current.set(instance)
+    try:
+        yield instance
+    except BaseException as error:
+        current.reset(token)
+        instance.stop(error=error)
+        raise
+    current.reset(token)
+    instance.stop()
+
+
+def timer(f):
+    '''
+    Times each call of f, a function or coroutine function, as a span named after it.
+    '''
+    if asyncio.iscoroutinefunction(f):
+        async def timed(coroutine):
+            instance = Span(f.__name__, current.get()).start()
+            token = current.set(instance)
+            try:
+                result = await coroutine
+            except BaseException as error:
+                instance.stop(error=error)
+                raise
+            finally:
+                current.reset(token)
+            instance.stop(result)
+            return result
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            # Calling f checks the arguments straight away, as calling an undecorated coroutine function does,
+            # and the span starts when the returned coroutine is awaited
+            return timed(f(*args, **kwargs))
+    else:
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            instance = Span(f.__name__, current.get()).start()
+            token = current.set(instance)
+            try:
+                result = f(*args, **kwargs)
+            except BaseException as error:
+                instance.stop(error=error)
+                raise
+            finally:
+                current.reset(token)
+            instance.stop(result)
+            return result
+    return wrapper
+
+
+def trace_memory(enabled=True):
+    '''
+    Turns recording of peak memory per span on or off. Tracing memory slows allocation heavy code down.
+    '''
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+#%% Export
+
+class Recorder:
+    '''
+    The last max_spans finished top level spans, and the number of calls of each stage.
+    Spans are added from any thread, the exports work on a snapshot taken under lock.
+    '''
+    def __init__(self, max_spans=100):
+        self.spans = deque(maxlen=max_spans)
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+            for instance in span.walk():
+                self.calls[instance.path] = self.calls.get(instance.path, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.spans.clear()
+            self.calls.clear()
+
+    def snapshot(self):
+        '''
+        (spans, calls) as lists and dicts that later spans do not change.
+        '''
+        with self.lock:
+            return list(self.spans), dict(self.calls)
+
+    def to_json(self, filename):
+        spans, _ = self.snapshot()
+        with open(filename + '.tmp', 'w') as outf:
+            json.dump([span.to_dict() for span in spans], outf, indent=1)
+        os.replace(filename + '.tmp', filename)
+
+    def prometheus(self, prefix='fpl_stage'):
+        '''
+        The latest call of every stage in the Prometheus text format, labelled by its path in the span tree.
+        '''
+        spans, calls = self.snapshot()
+        latest = {instance.path: instance for root in spans for instance in root.walk()}
+
+        metrics = [('seconds', 'gauge', 'Wall time of the latest call', lambda s: s.seconds),
+                   ('peak_memory_bytes', 'gauge', 'Peak traced memory of the latest call', lambda s: s.peak_memory),
+                   ('rows', 'gauge', 'Rows returned by the latest call', lambda s: s.rows),
+                   ('last_run_timestamp_seconds', 'gauge', 'Start time of the latest call', lambda s: s.started),
+                   ('failed', 'gauge', '1 if the latest call raised', lambda s: int(s.error is not None)),
+                   ('calls_total', 'counter', 'Calls since the process started', lambda s: calls[s.path])]
+        lines = []
+        for name, kind, description, value in metrics:
+            samples = [(path, value(instance)) for path, instance in latest.items() if value(instance) is not None]
+            if not samples:
+                continue
+            lines += [f'# HELP {prefix}_{name} {description}.', f'# TYPE {prefix}_{name} {kind}']
+            lines += [f'{prefix}_{name}{{stage="{path}"}} {sample}' for path, sample in samples]
+        return '\n'.join(lines) + '\n'
+
+    def to_prometheus(self, filename):
+        with open(filename + '.tmp', 'w') as outf:
+            outf.write(self.prometheus())
+        os.replace(filename + '.tmp', filename)
+
+
+recorder = Recorder()
@@ -0,0 +1,244 @@
+'''
+FPL squad selection and transfer planning as mixed integer programs, solved to optimality with scipy's milp (HiGHS).
+
+    optimizer = SquadOptimizer(df)
+    pick = optimizer.pick('form')                           # best 15, starting XI and captain for one gameweek
+    plan = optimizer.plan(projections, squad=pick['squad'], bank=5, free_transfers=1)
+
+df is the player frame from pre_process.main, indexed by FPL id with now_cost (in tenths of a million),
+element_type and team. Points are any projection column of df, or a Series indexed like it.
+'''
+#%% Imports
+import time
+import logging
+import numpy as np
+import pandas as pd
+from scipy.optimize import milp, LinearConstraint, Bounds
+from scipy.sparse import csr_matrix, hstack, vstack, identity, bmat
+
+logger = logging.basicConfig(format='[%(levelname)s %(module)s] %(asctime)s - %(message)s', level = logging.INFO)
+logger = logging.getLogger(__name__)
+
+#%% Rules
+squad_size, starting_size, max_per_team = 15, 11, 3
+squad_positions = {'Goalkeeper': 2, 'Defender': 5, 'Midfielder': 5, 'Forward': 3}
+# Fewest and most players of each position in a starting XI
+starting_positions = {'Goalkeeper': (1, 1), 'Defender': (3, 5), 'Midfielder': (2, 5), 'Forward': (1, 3)}
+
+
+class InfeasibleSquad(Exception):
+    pass
+
+
+#%% Optimizer
+
+class SquadOptimizer:
+    '''
+    Squad selection over the players of df, with the constraint rows built once and reused for every solve.
+
+    Each player has a squad, a starting and a captain variable per gameweek. The objective is the points of the
+    starting XI, doubled for the captain, plus bench_weight times the points of the bench.
+
+    pick only offers the solver candidates: a player is left out when enough players of the same position cost no
+    more and score at least as much (see candidates), since one of them can always take the place in an optimal
+    squad. That keeps the model to a few hundred players whatever the size of df. plan offers the current squad and
+    the candidates over all the gameweeks it plans.
+    '''
+    def __init__(self, df, budget=1000, bench_weight=0.1, cost_column='now_cost', time_limit=None):
+        self.df = df
+        self.ids = df.index.to_numpy()
+        self.cost = df[cost_column].to_numpy(dtype=float)
+        self.budget = budget
+        self.bench_weight = bench_weight
+        self.time_limit = time_limit
+        self.stats = {}
+
+        self.positions = df['element_type'].astype(str).to_numpy()
+        self.teams = pd.factorize(df['team'])[0]
+        self.constraints = self.gameweek_constraints()
+
+    def points(self, points):
+        values = self.df[points] if isinstance(points, str) else pd.Series(points).reindex(self.df.index)
+        return values.astype(float).fillna(0).to_numpy()
+
+    def gameweek_constraints(self):
+        '''
+        Rows over one gameweek's variables [squad, starting, captain] of every player, as (matrix, lower, upper).
+        '''
+        n = len(self.ids)
+        zero, one = np.zeros(n), np.ones(n)
+        rows, lower, upper = [], [], []
+
+        def add(squad, starting, captain, low, high):
+            rows.append(np.concatenate([squad, starting, captain]))
+            lower.append(low)
+            upper.append(high)
+
+        add(one, zero, zero, squad_size, squad_size)
+        for position, count in squad_positions.items():
+            add(self.positions == position, zero, zero, count, count)
+            add(zero, self.positions == position, zero, *starting_positions[position])
+        for team in range(self.teams.max(initial=-1) + 1):
+            add(self.teams == team, zero, zero, 0, max_per_team)
+        add(zero, one, zero, starting_size, starting_size)
+        add(zero, zero, one, 1, 1)
+        add(self.cost, zero, zero, -np.inf, self.budget)
+        return csr_matrix(np.array(rows, dtype=float)), np.array(lower, dtype=float), np.array(upper, dtype=float)
+
+    def model(self, players):
+        '''
+        The constraints restricted to players (positions in df), with the rows that link their variables:
+        players only start if in the squad and captain if starting.
+        '''
+        n, k = len(self.ids), len(players)
+        matrix, lower, upper = self.constraints
+        matrix = matrix[:, np.concatenate([players, players + n, players + 2 * n])]
+        eye, empty = identity(k, format='csr'), csr_matrix((k, k))
+        links = vstack([hstack([-eye, eye, empty]), hstack([empty, -eye, eye])])
+        return (vstack([matrix, links]).tocsr(), np.concatenate([lower, np.full(2 * k, -np.inf)]),
+                np.concatenate([upper, np.zeros(2 * k)]))
+
+    def candidates(self, projection):
+        '''
+        Positions of the players that can be in an optimal squad. A player is dropped when players from at least
+        as many teams as the position's squad places plus five each cost no more and score at least as much, one
+        of the two strictly. At most places - 1 of those teams hold a dominating player already in the squad and
+        at most five teams are full, so one of them can always take the place.
+        projection is one gameweek's points, or one column per gameweek (players, gameweeks), in which case a
+        dominating player scores at least as much in every gameweek, so it can take the place for all of them.
+        '''
+        keep = []
+        teams = self.teams.max(initial=-1) + 1
+        for position, count in squad_positions.items():
+            players = np.flatnonzero(self.positions == position)
+            cost, points = self.cost[players][:, None], projection[players].reshape(len(players), -1)
+            # dominates[i, j]: player j dominates player i
+            at_least = (points[None, :, :] >= points[:, None, :]).all(axis=2)
+            more = (points[None, :, :] > points[:, None, :]).any(axis=2)
+            dominates = (cost.T <= cost) & at_least & ((cost.T < cost) | more)
+            present = dominates.astype(np.int32) @ np.eye(teams, dtype=np.int32)[self.teams[players]]
+            keep.append(players[(present > 0).sum(axis=1) < count + squad_size // max_per_team])
+        return np.sort(np.concatenate(keep))
+
+    def objective(self, points):
+        # milp minimises
+        return -np.concatenate([self.bench_weight * points, (1 - self.bench_weight) * points, points])
+
+    def solve(self, c, constraints, integrality, bounds):
+        options = {'mip_rel_gap': 0}
+        if self.time_limit:
+            options['time_limit'] = self.time_limit
+        t_start = time.perf_counter()
+        result = milp(c, constraints=constraints, integrality=integrality, bounds=bounds, options=options)
+        self.stats.update({'seconds': time.perf_counter() - t_start, 'status': result.status,
+                           'message': result.message, 'nodes': getattr(result, 'mip_node_count', None)})
+        if result.x is None:
+            raise InfeasibleSquad(result.message)
+        if result.status != 0:
+            logger.info(f"Stopped before proving optimality: {result.message}")
+        return np.round(result.x)
+
+    def pick(self, points):
+        '''
+        The best squad for one gameweek: {'squad', 'starting', 'bench', 'captain', 'points', 'cost', 'optimal'}.
+        points is a projection column of df or a Series of projections by id, bench is ordered by points.
+        '''
+        projection = self.points(points)
+        players = self.candidates(projection)
+        self.stats = {'candidates': len(players)}
+        k = len(players)
+        matrix, lower, upper = self.model(players)
+        x = self.solve(self.objective(projection[players]), [LinearConstraint(matrix, lower, upper)],
+                       np.ones(3 * k), Bounds(0, 1))
+
+        chosen = np.zeros((3, len(self.ids)))
+        chosen[:, players] = x.reshape(3, k)
+        return self.selection(*chosen, projection)
+
+    def selection(self, squad, starting, captain, projection):
+        squad, starting = squad.astype(bool), starting.astype(bool)
+        bench = np.flatnonzero(squad & ~starting)
+        return {'squad': self.ids[squad].tolist(),
+                'starting': self.ids[starting].tolist(),
+                'bench': self.ids[bench[np.argsort(-projection[bench], kind='stable')]].tolist(),
+                'captain': self.ids[captain.astype(bool)][0],
+                'points': float(projection[starting].sum() + projection[captain.astype(bool)].sum()),
+                'cost': float(self.cost[squad].sum()),
+                'optimal': self.stats['status'] == 0}
+
+    def plan(self, projections, squad, bank=0, free_transfers=1, hit_cost=4, max_free_transfers=2):
+        '''
+        Transfers over several gameweeks from the current squad, maximising the points of every gameweek less
+        hit_cost for each transfer beyond the free ones. projections has one column of projected points per
+        gameweek, indexed like df. One free transfer is added each gameweek and unused ones are saved up to
+        max_free_transfers. Players are bought and sold at now_cost and the budget is the squad's value plus bank.
+
+        Returns [{'gameweek', 'in', 'out', 'hits', 'free_transfers', 'squad', 'starting', 'bench', 'captain', 'points'}] per gameweek.
+        '''
+        projections = projections.reindex(self.df.index).astype(float).fillna(0)
+        gameweeks = list(projections.columns)
+        projected = projections.to_numpy()
+        n, T = len(self.ids), len(gameweeks)
+        owned = np.isin(self.ids, list(squad))
+        if owned.sum() != squad_size:
+            raise InfeasibleSquad(f"squad has {int(owned.sum())} players of df, not {squad_size}.")
+        budget = self.cost @ owned + bank
+        # The current squad and the players not dominated over every gameweek by the same players, see candidates
+        players = np.union1d(np.flatnonzero(owned), self.candidates(projected))
+        self.stats = {'candidates': len(players)}
+        k = len(players)
+        current = owned[players].astype(float)
+
+        # Per gameweek [squad, starting, captain, in, out] for each player, then [transfers, free used, paid, free]
+        width = 5 * k + 4
+        matrix, lower, upper = self.model(players)
+        # The budget row of the squad, set to what it is worth
+        upper[len(self.constraints[2]) - 1] = budget
+        eye, empty = identity(k, format='csr'), csr_matrix((k, k))
+        column = lambda i: csr_matrix(([1.0], ([0], [5 * k + i])), shape=(1, width))
+        week = vstack([hstack([matrix, csr_matrix((matrix.shape[0], 2 * k + 4))]),
+                       # squad = previous squad + in - out, and no player both bought and sold
+                       hstack([eye, empty, empty, -eye, eye, csr_matrix((k, 4))]),
+                       hstack([empty, empty, empty, eye, eye, csr_matrix((k, 4))]),
+                       csr_matrix(np.concatenate([np.zeros(3 * k), np.ones(k), np.zeros(k), [-1, 0, 0, 0]])[None, :]),
+                       column(0) - column(1) - column(2),
+                       column(1) - column(3),
+                       column(3)]).tocsr()
+        # The previous gameweek's squad, and free transfers carried over: at most one more than were left unused
+        carry = vstack([csr_matrix((matrix.shape[0], width)),
+                        hstack([-eye, csr_matrix((k, 4 * k + 4))]),
+                        csr_matrix((k + 3, width)),
+                        column(1) - column(3)]).tocsr()
+        rows = [[week if i == t else carry if i == t - 1 else None for i in range(T)] for t in range(T)]
+
+        def week_bounds(t):
+            first = t == 0
+            return (np.concatenate([lower, current if first else np.zeros(k), np.full(k, -np.inf),
+                                    [0, 0, -np.inf, free_transfers if first else -np.inf]]),
+                    np.concatenate([upper, current if first else np.zeros(k), np.ones(k),
+                                    [0, 0, 0, free_transfers if first else 1]]))
+        bounds = [week_bounds(t) for t in range(T)]
+        constraints = LinearConstraint(bmat(rows, format='csr'), np.concatenate([low for low, _ in bounds]),
+                                       np.concatenate([high for _, high in bounds]))
+
+        c = np.zeros(width * T)
+        for t in range(T):
+            base = t * width
+            c[base:base + 3 * k] = self.objective(projected[players, t])
+            c[base + 5 * k + 2] = hit_cost
+        upper_bounds = np.tile(np.concatenate([np.ones(5 * k), [squad_size, squad_size, squad_size, max_free_transfers]]), T)
+        x = self.solve(c, [constraints], np.ones(width * T), Bounds(0, upper_bounds))
+
+        plan, free = [], free_transfers
+        for t, gameweek in enumerate(gameweeks):
+            week = x[t * width:(t + 1) * width]
+            chosen = np.zeros((5, n))
+            chosen[:, players] = week[:5 * k].reshape(5, k)
+            selection = self.selection(*chosen[:3], projected[:, t])
+            plan.append(dict(selection, gameweek=gameweek,
+                             **{'in': self.ids[chosen[3].astype(bool)].tolist(),
+                                'out': self.ids[chosen[4].astype(bool)].tolist(),
+                                'hits': int(week[5 * k + 2]),
+                                'free_transfers': free}))
+            free = min(max_free_transfers, free - int(week[5 * k + 1]) + 1)
+        return plan
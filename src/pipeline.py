@@ -0,0 +1,298 @@
+'''
+Stage runner with an on-disk cache keyed on the content of each stage's inputs.
+
+    stages = [Stage('process_raw_fpl', process_raw_fpl, inputs=['player_data'], outputs=['players', 'names'],
+                    params={'columns_to_drop': columns_to_drop}),
+              Stage('prune_data', prune_data, inputs=['merged'], outputs=['data'], params={'min_minutes': 90}), ...]
+    results = Pipeline(stages).run(['data'], player_data=player_data, ...)
+
+The key of a stage is a hash of its name, version, source code and that of the project functions it calls, params,
+the numpy and pandas versions and the keys of its inputs, where the key of a source passed to run is a hash of its
+content. Keys therefore change whenever anything upstream changes, they are
+all known before any stage runs, and a stage whose result is stored is loaded without running, or loading, anything
+upstream of it. report records whether each stage was a 'hit', a 'miss' or 'skipped' because nothing needed it.
+'''
+#%% Imports
+import os
+import json
+import pickle
+import inspect
+import hashlib
+import logging
+import platform
+import numpy as np
+import pandas as pd
+import instrument
+from collections.abc import Mapping
+
+logger = logging.basicConfig(format='[%(levelname)s %(module)s] %(asctime)s - %(message)s', level = logging.INFO)
+logger = logging.getLogger(__name__)
+
+stage_cache = '.data/stages'
+# Stage functions, and the helpers they call, defined under this directory are hashed into stage keys
+project = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Results are pickles of these libraries' objects, a result stored by other versions is not reused
+versions = {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__}
+
+#%% Fingerprints
+
+def file_digest(filename):
+    '''
+    sha256 of a file's content, or of nothing if it does not exist.
+    '''
+    digest = hashlib.sha256()
+    try:
+        with open(filename, 'rb') as file:
+            for block in iter(lambda: file.read(2**20), b''):
+                digest.update(block)
+    except FileNotFoundError:
+        pass
+    return digest.hexdigest()
+
+
+def fingerprint(value):
+    '''
+    sha256 of the content of a source: frames by their hashed rows, history files by their file and anything
+    else by its json, or its pickle when it has no json form.
+    '''
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest = hashlib.sha256(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        digest.update(repr(value.dtypes.to_dict() if isinstance(value, pd.DataFrame) else value.dtype).encode())
+        return digest.hexdigest()
+    if isinstance(getattr(value, 'filename', None), str) and isinstance(value, Mapping):
+        return file_digest(value.filename)
+    if isinstance(value, Mapping) and not isinstance(value, dict):
+        value = dict(value)
+    try:
+        encoded = json.dumps(value, sort_keys=True).encode()
+    except TypeError:
+        encoded = pickle.dumps(value)
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def source_code(function):
+    '''
+    Source of function, so editing a stage invalidates its results.
+    '''
+    try:
+        return inspect.getsource(function)
+    except (OSError, TypeError):
+        return getattr(function, '__qualname__', repr(function))
+
+
+def in_project(value):
+    '''
+    True for functions, classes and modules defined in the files of this project rather than installed packages.
+    '''
+    try:
+        filename = os.path.abspath(inspect.getfile(value))
+    except TypeError:
+        return False
+    return filename.startswith(project) and 'site-packages' not in filename
+
+
+def code_names(code):
+    '''
+    Global and attribute names used by code and the functions, lambdas and comprehensions nested in it.
+    '''
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if inspect.iscode(constant):
+            names |= code_names(constant)
+    return names
+
+
+def dependencies(function):
+    '''
+    {qualified name: source} of function and of every function and class of the project it calls, directly or
+    through other project functions, so editing a helper such as gameweek_history invalidates the stages that
+    use it and not only the stage's own wrapper. Names are resolved in the globals of the function using them,
+    and as attributes of the project modules it uses (storage.write).
+    '''
+    sources, pending = {}, [function]
+    while pending:
+        value = pending.pop()
+        value = getattr(value, '__wrapped__', value)
+        # Modules are named by their file, so src.storage and storage give the same key
+        module = (getattr(value, '__module__', None) or '').rsplit('.', 1)[-1]
+        name = f"{module}.{getattr(value, '__qualname__', repr(value))}"
+        if name in sources:
+            continue
+        sources[name] = source_code(value)
+
+        functions = [value] if inspect.isfunction(value) else \
+            [member for member in vars(value).values() if inspect.isfunction(member)] if inspect.isclass(value) else []
+        for function in functions:
+            names = code_names(function.__code__)
+            scope = function.__globals__
+            modules = [scope[name] for name in names if inspect.ismodule(scope.get(name)) and in_project(scope[name])]
+            for name in names:
+                for candidate in [scope.get(name)] + [getattr(module, name, None) for module in modules]:
+                    candidate = getattr(candidate, '__wrapped__', candidate)
+                    if (inspect.isfunction(candidate) or inspect.isclass(candidate)) and in_project(candidate):
+                        pending.append(candidate)
+    return dict(sorted(sources.items()))
+
+
+#%% Stages
+
+class Stage:
+    '''
+    One step of a pipeline. function is called with the values named by inputs, followed by params and options as
+    keyword arguments, and returns the values named by outputs (a tuple when there is more than one).
+
+    params are part of the key, options are not and must not change the result (e.g. save_to_file). The content of
+    files is part of the key, for stages that read state such as the crosswalk, as it was before the stage last
+    wrote it (see Pipeline.file_key). The source of the stage function and
+    of the project functions it calls is part of the key, see dependencies. Increase version when the result changes
+    without any of that code changing, e.g. when a library it calls is upgraded.
+    '''
+    def __init__(self, name, function, inputs=(), outputs=None, params=None, options=None, files=(), version=1):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs or [name])
+        self.params = params or {}
+        self.options = options or {}
+        self.files = list(files)
+        self.version = version
+
+    def key(self, input_keys, file_keys=None):
+        '''
+        Hash of everything the stage's result depends on, given the keys of its inputs and of its files (their
+        digests by default).
+        '''
+        if file_keys is None:
+            file_keys = [file_digest(filename) for filename in self.files]
+        return hashlib.sha256(json.dumps({'name': self.name,
+                                          'version': self.version,
+                                          'source': dependencies(self.function),
+                                          'versions': versions,
+                                          'params': repr(sorted(self.params.items())),
+                                          'files': file_keys,
+                                          'inputs': input_keys}).encode()).hexdigest()
+
+    def __call__(self, *values):
+        result = self.function(*values, **self.params, **self.options)
+        return result if len(self.outputs) > 1 else (result,)
+
+
+class Pipeline:
+    '''
+    Stages run in dependency order, each result stored under directory/<stage>-<key>.pkl.
+    The keep most recent results of each stage are kept, older ones are removed when a stage runs.
+    The digests of the files stages wrote, and of what the files held before, are kept in directory/files.json.
+    '''
+    def __init__(self, stages, directory=stage_cache, keep=3):
+        self.stages = {stage.name: stage for stage in stages}
+        self.producers = {output: stage for stage in stages for output in stage.outputs}
+        self.directory = directory
+        self.keep = keep
+        self.report = {}
+        os.makedirs(directory, exist_ok=True)
+        self.written_file = os.path.join(directory, 'files.json')
+        try:
+            with open(self.written_file) as file:
+                self.written = json.load(file)
+        except (FileNotFoundError, ValueError):
+            self.written = {}
+
+    def file_key(self, filename):
+        '''
+        Digest of a stage's file, or of what it held before a stage last wrote it if it is unchanged since, so a
+        stage that updates its own file (update_crosswalk) is not run again just because it wrote it.
+        '''
+        digest = file_digest(filename)
+        written = self.written.get(filename)
+        return written['before'] if written and written['written'] == digest else digest
+
+    def keys(self, sources):
+        '''
+        Keys of every source and stage output, sources hashed by content and stages by their definition and inputs.
+        '''
+        keys = {name: fingerprint(value) for name, value in sources.items()}
+        stage_keys = {}
+
+        def resolve(stage):
+            if stage.name not in stage_keys:
+                stage_keys[stage.name] = None
+                input_keys = [keys[name] if name in keys else output_key(name) for name in stage.inputs]
+                stage_keys[stage.name] = stage.key(input_keys, [self.file_key(filename) for filename in stage.files])
+            elif stage_keys[stage.name] is None:
+                raise ValueError(f"The inputs of {stage.name} depend on its own outputs.")
+            return stage_keys[stage.name]
+
+        def output_key(name):
+            if name not in self.producers:
+                raise KeyError(f"{name} is neither a source nor the output of a stage.")
+            return f"{resolve(self.producers[name])}:{name}"
+
+        for stage in self.stages.values():
+            resolve(stage)
+        return stage_keys
+
+    def path(self, stage, key):
+        return os.path.join(self.directory, f"{stage.name}-{key[:16]}.pkl")
+
+    def run(self, outputs=None, **sources):
+        '''
+        Returns {name: value} for the requested outputs, all stage outputs by default, computing only the stages
+        whose results are not stored and that are needed for them.
+        '''
+        stage_keys = self.keys(sources)
+        values = dict(sources)
+        self.report = {name: 'skipped' for name in self.stages}
+
+        def value(name):
+            if name not in values:
+                stage = self.producers[name]
+                values.update(zip(stage.outputs, self.result(stage, stage_keys[stage.name], value)))
+            return values[name]
+
+        results = {name: value(name) for name in outputs or self.producers}
+        logger.info("Stage cache: " + ', '.join(f"{name} {status}" for name, status in self.report.items()))
+        return results
+
+    def result(self, stage, key, value):
+        path = self.path(stage, key)
+        if os.path.exists(path):
+            try:
+                with instrument.span(stage.name, cache='hit'), open(path, 'rb') as file:
+                    result = pickle.load(file)
+                self.report[stage.name] = 'hit'
+                os.utime(path)
+                return result
+            except Exception as error:
+                # A truncated file or a pickle other library versions cannot read is a miss
+                logger.info(f"Could not load {path} ({error!r}), running {stage.name}.")
+
+        inputs = [value(name) for name in stage.inputs]
+        before = {filename: self.file_key(filename) for filename in stage.files}
+        result = stage(*inputs)
+        self.report[stage.name] = 'miss'
+        self.record_writes(before)
+        with open(path + '.tmp', 'wb') as outf:
+            pickle.dump(result, outf, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        self.evict(stage)
+        return result
+
+    def record_writes(self, before):
+        '''
+        Records the files a stage changed as {filename: {'written', 'before'}} digests.
+        '''
+        changed = {filename: {'written': file_digest(filename), 'before': key} for filename, key in before.items()
+                   if self.file_key(filename) != key}
+        if changed:
+            self.written.update(changed)
+            with open(self.written_file + '.tmp', 'w') as outf:
+                json.dump(self.written, outf)
+            os.replace(self.written_file + '.tmp', self.written_file)
+
+    def evict(self, stage):
+        stored = sorted((entry for entry in os.scandir(self.directory)
+                         if entry.name.startswith(stage.name + '-') and entry.name.endswith('.pkl')
+                         and entry.name[len(stage.name) + 1:-4].isalnum()),
+                        key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in stored[self.keep:]:
+            os.remove(entry.path)
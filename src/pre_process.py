@@ -1,44 +1,72 @@
 #%% Imports
+import re
+import glob
 import json
-import copy
+import os
+import pickle
+import unicodedata
 import numpy as np
 import pandas as pd
 import asyncio
 import datetime
 import logging
-from fuzzywuzzy import fuzz
+from itertools import chain
+from collections import ChainMap
+from rapidfuzz import fuzz, process
+from scipy.optimize import linear_sum_assignment
 from tools import timer
-from preferences import columns_to_drop, understat_columns_to_drop, players_to_rename
-from get_data import get_data, get_player_hist, get_understat
+from pipeline import Stage, Pipeline, stage_cache
+from gameweek_index import GameweekIndex, sort_gameweeks
+from fixtures import get_fixtures, FixtureMatrix, joined_columns
+import instrument
+from concurrent.futures import ProcessPoolExecutor
+from preferences import columns_to_drop, understat_columns_to_drop, players_to_rename, delta_columns, workers, season, form_features
+from get_data import get_data, bootstrap_teams, get_player_hist, get_understat, ingest, HistoryFile, write_history
+import storage
+from fetch import Fetcher
+from http_cache import HttpCache
 
 logger = logging.basicConfig(format='[%(levelname)s %(module)s] %(asctime)s - %(message)s', level = logging.INFO)
 logger = logging.getLogger(__name__)
-today = '_'.join(str(datetime.datetime.today()).split(' ')[0].split('-'))
 #%% Get data function
 
 @timer
 def load_data():
+    '''
+    Loads today's files, downloading the sources that have none concurrently with get_data.ingest.
+    '''
     logger.info('Loading data.')
-    logger.info(f"Looking for files starting {today}")
+    logger.info(f"Looking for files starting {storage.today()}")
+    player_data, player_history, understat = None, None, None
     try:
-        filename = ".data/" + today + "_player_data.json"
+        filename = ".data/" + storage.today() + "_player_data.json"
         with open(filename, "r") as file:
-            player_data = json.load(file)
+            player_data = {int(id): player for id, player in json.load(file).items()}
     except FileNotFoundError:
         logger.info(f"{filename} not found.")
-        player_data = get_data()
 
     try:
-        filename = ".data/" + today + "_history.json"
+        filename = ".data/" + storage.today() + "_history.ndjson"
+        player_history = HistoryFile(filename)
+    except FileNotFoundError:
+        logger.info(f"{filename} not found.")
+
+    try:
+        filename = ".data/" + storage.today() + "_raw_understats.json"
         with open(filename, "r") as file:
-            player_history = json.load(file)
+            understat = json.load(file)
     except FileNotFoundError:
         logger.info(f"{filename} not found.")
+
+    if player_data is None or player_history is None or understat is None:
         loop = asyncio.get_event_loop()
-        player_history = loop.run_until_complete(get_player_hist(player_ids = player_data.keys()))
+        return loop.run_until_complete(ingest(player_data, player_history, understat))
+    return player_data, player_history, understat
+
 
+def load_understat():
     try:
-        filename = ".data/" + today + "_raw_understats.json"
+        filename = ".data/" + storage.today() + "_raw_understats.json"
         with open(filename, "r") as file:
             understat = json.load(file)
     except FileNotFoundError:
@@ -46,7 +74,83 @@ def load_data():
             loop = asyncio.get_event_loop()
             understat = loop.run_until_complete(get_understat(induvidual_stats = True))
     
-    return player_data, player_history, understat
+    return understat
+
+
+def load_fixtures():
+    '''
+    (fixtures, teams) from the FPL api, or as last saved in the store when they cannot be downloaded. None if
+    neither, the gameweek data then goes without fixture difficulty.
+    '''
+    try:
+        return get_fixtures()
+    except Exception as error:
+        logger.info(f"Could not download fixtures ({error!r}), using the stored ones.")
+        return storage.read_fixtures()
+
+
+#%% Incremental refresh
+
+def latest_file(suffix):
+    '''
+    Returns the most recent .data file ending in suffix, or None.
+    '''
+    files = sorted(glob.glob(".data/[0-9][0-9][0-9][0-9]_[0-9][0-9]_[0-9][0-9]" + suffix))
+    return files[-1] if files else None
+
+
+def changed_players(player_data, snapshot, delta_columns=delta_columns):
+    '''
+    Ids of players that are new or whose delta_columns differ from the snapshot.
+    '''
+    return [id for id, player in player_data.items()
+            if id not in snapshot or any(player.get(column) != snapshot[id].get(column) for column in delta_columns)]
+
+
+@timer
+def refresh_data(delta_columns=delta_columns, save_to_file=True):
+    '''
+    Incremental alternative to load_data.
+
+    Bootstrap-static is always downloaded and compared with the snapshot stored alongside the latest history.
+    Element-summary is only downloaded for new players and players whose delta_columns changed, and is patched
+    into the stored history. The fourth value returned is {'since': date of the snapshot, 'changed': refreshed ids},
+    or None when nothing was stored and everything was loaded by load_data.
+    '''
+    history_file = latest_file("_history.ndjson")
+    snapshot_file = history_file and history_file.replace("_history.ndjson", "_player_data.json")
+    if snapshot_file is None or not os.path.exists(snapshot_file):
+        logger.info("No stored snapshot found, loading all data.")
+        return (*load_data(), None)
+
+    logger.info(f"Comparing bootstrap-static with {snapshot_file}.")
+    with open(snapshot_file, "r") as file:
+        snapshot = {int(id): player for id, player in json.load(file).items()}
+    player_history = HistoryFile(history_file)
+
+    player_data = get_data(save_to_file=False)
+    changed = changed_players(player_data, snapshot, delta_columns)
+    changed += [id for id in player_data if id not in player_history and id not in changed]
+    logger.info(f"{len(changed)} of {len(player_data)} players have changed.")
+
+    fetched = {}
+    if changed:
+        loop = asyncio.get_event_loop()
+        # These players changed since the snapshot, so a stored response younger than its max-age may be out of date
+        # too: every request is revalidated, unchanged responses still come back as a 304
+        fetcher = Fetcher(cache=HttpCache(max_age={}))
+        fetched = loop.run_until_complete(get_player_hist(player_ids=changed, save_to_file=False, fetcher=fetcher))
+
+    if save_to_file:
+        with open(".data/" + storage.today() + "_player_data.json", 'w') as outf:
+            json.dump(player_data, outf)
+        # Unchanged players are copied line by line from the old file
+        unchanged = ((id, player_history[id]) for id in player_history if id not in fetched)
+        player_history = write_history(".data/" + storage.today() + "_history.ndjson", chain(fetched.items(), unchanged))
+    else:
+        player_history = ChainMap(fetched, player_history)
+
+    return player_data, player_history, load_understat(), {'since': os.path.basename(snapshot_file)[:10], 'changed': changed}
 
 
 #%% Process raw fpl data
@@ -54,13 +158,15 @@ def load_data():
 @timer
 def process_raw_fpl(player_data, columns_to_drop=columns_to_drop):
     logger.info("Processing raw fpl player data.")
-    player_data = pd.DataFrame.from_dict(player_data, orient='index').drop(columns=columns_to_drop)
+    player_data = pd.DataFrame.from_dict(player_data, orient='index')
+    codes = player_data['code']
+    player_data = player_data.drop(columns=columns_to_drop)
     player_with_mins = player_data[player_data.minutes> 0]
 
-    # Get names used for fuzzy matching
+    # Get names used for fuzzy matching, with the player's code the crosswalk is keyed by
     full_names = player_with_mins[['first_name', 'second_name']].agg(' '.join, axis=1)
     web_names = player_with_mins['web_name']
-    names =pd.concat([full_names, web_names], axis=1).rename({0:'player_name', 'web_name':'short_name'}, axis='columns')
+    names =pd.concat([full_names, web_names, codes[player_with_mins.index]], axis=1).rename({0:'player_name', 'web_name':'short_name'}, axis='columns')
 
     return player_with_mins.join(names['player_name']).drop(columns=['first_name','second_name','web_name']), names
 
@@ -74,6 +180,7 @@ def process_raw_understat(understat, understat_columns_to_drop=understat_columns
     logger.info("Processing raw understat data.")
     # Move from dict object and drop unessesary columns
     understat = pd.DataFrame.from_dict(understat).drop(columns = understat_columns_to_drop)
+    understat['id'] = understat['id'].astype(int)
 
     # Rename required players
     understat['player_name'] = understat['player_name'].replace(players_to_rename)
@@ -83,62 +190,164 @@ def process_raw_understat(understat, understat_columns_to_drop=understat_columns
 
 #%% Matching names
 
-@timer
-def match_names(fpl_names, understat_names, save_to_file=True):
+def name_tokens(name):
     '''
-    Finds the best match
+    Lower case, accent free tokens of a name, used for blocking.
     '''
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().lower()
+    return set(re.split(r"[\s\-'.]+", name)) - {''}
 
-    try:
-        logger.info("Searching for a current best match file")
-        filename = ".data/" + today + "_player_matching.json"
-        with open(filename, "r") as file:
-            best_match =  json.load(file)
-        logger.info("File found, matching will be skipped.")
-        return best_match
 
-    except FileNotFoundError:
-        logger.info("File not found. Matching will begin")
-    
+def candidate_mask(understat_names, fpl_names):
+    '''
+    Blocking index, an understat name is a candidate for an FPL player when they share a name token.
+    '''
+    index = {}
+    for column, names in enumerate(zip(fpl_names['player_name'], fpl_names['short_name'])):
+        for token in set().union(*map(name_tokens, names)):
+            index.setdefault(token, []).append(column)
+
+    mask = np.zeros((len(understat_names), len(fpl_names)), dtype=bool)
+    for row, understat_player in enumerate(understat_names):
+        for token in name_tokens(understat_player):
+            mask[row, index.get(token, [])] = True
+    return mask
+
+
+def score_matrix(understat_names, fpl_names, workers=-1):
+    '''
+    Scores every understat name against every FPL player using all cores.
+    Players with multiple names are scored against the FPL full name, players with one name against the web name.
+    A direct match on the web name is given a confidence score of 150.
+    '''
+    understat_names = np.asarray(understat_names, dtype=object)
+    full = process.cdist(understat_names, fpl_names['player_name'], scorer=fuzz.partial_ratio, workers=workers)
+    short = process.cdist(understat_names, fpl_names['short_name'], scorer=fuzz.partial_ratio, workers=workers)
+    short[understat_names[:, None] == fpl_names['short_name'].to_numpy()[None, :]] = 150
+
+    multiple_names = np.array([len(understat_player.split()) > 1 for understat_player in understat_names])
+    return np.where(multiple_names[:, None], full, short)
+
+
+def assign_names(fpl_names, understat_names, workers=-1):
+    '''
+    Returns the positions of the matched understat names and FPL players along with their confidence scores.
+
+    The full understat x FPL score matrix is computed once and matches are resolved with a single optimal
+    one to one assignment. Pairs that share a name token are always preferred over pairs that do not.
+    '''
+    understat_names = list(understat_names)
+    scores = score_matrix(understat_names, fpl_names, workers=workers)
+
+    # Pairs outside the blocking index are only used when no candidate pair is left
+    weights = np.where(candidate_mask(understat_names, fpl_names), scores, scores - 150)
+    rows, columns = linear_sum_assignment(weights, maximize=True)
+
+    return rows, columns, scores[rows, columns].astype(float)
+
+
+@timer
+def match_names(fpl_names, understat_names, save_to_file=True, workers=-1):
+    '''
+    Finds the best match by name. The pipeline matches by id with update_crosswalk, this is kept for the notebooks.
+    '''
     logger.info("Matching player names for fpl and understat data")
-    # Copy the files ensuring they are not altered
-    understat_names = list(copy.deepcopy(understat_names))
-    fpl_names = copy.deepcopy(fpl_names)
-    conf_score = 100
-    best_match = {}
-    confidence = {}
-    while True:
-
-        for understat_player in understat_names:
-            if len(understat_player.split()) > 1 and conf_score > 70:
-                # Players with multiple names
-                ratings = {fuzz.partial_ratio(understat_player, player[1][0]):player[1][0] for player in fpl_names.iterrows()}
-            else:
+    understat_names = list(pd.unique(understat_names))
+    rows, columns, scores = assign_names(fpl_names, understat_names, workers=workers)
 
-                # Player with one name
-                # direct match tried as well as a fuzzy match. Direct match given confidence score of 150
-                ratings = {150 if understat_player == player[1][1] else fuzz.partial_ratio(understat_player, player[1][1]):player[1][0] for player in fpl_names.iterrows()}
-            
-            if max(ratings) >= conf_score:
-                best_match[understat_player] = ratings[max(ratings)]
-                confidence[understat_player] = max(ratings)
-                understat_names.remove(understat_player)
-                fpl_names.drop(fpl_names.index[fpl_names['player_name'] == ratings[max(ratings)]], inplace=True)
-
-        conf_score -= 2
-        if not len(understat_names):
-            break
+    best_match = {understat_names[row]: fpl_names['player_name'].iloc[column] for row, column in zip(rows, columns)}
+    confidence = {understat_names[row]: score for row, score in zip(rows, scores)}
     
     logger.info(f"{len(best_match)} players matched with a mean confidence score of {np.mean(list(confidence.values())):.2f}.")
     logger.info(f"The least confident match has a confidence of {np.min(list(confidence.values()))}.")
 
     if save_to_file:
         logger.info(f"Saving matched and confidence scored to file.")
-        with open('.data/' + today + '_player_matching.json', 'w') as outf:
+        with open('.data/' + storage.today() + '_player_matching.json', 'w') as outf:
             json.dump([best_match,confidence], outf)
 
     return best_match
 
+
+#%% Player crosswalk
+crosswalk_file = '.data/player_code_crosswalk.json'
+crosswalk_columns = ['understat_id', 'player_name', 'understat_name', 'confidence', 'source']
+# Fuzzy matches scoring less are not stored, the players are matched again on the next run
+min_confidence = 80
+
+def load_crosswalk(filename=crosswalk_file):
+    '''
+    Loads the FPL player code to understat player id crosswalk, indexed by code. Unlike element ids, which FPL
+    assigns afresh every season, a player's code stays the same.
+    '''
+    try:
+        with open(filename, "r") as file:
+            crosswalk = pd.DataFrame.from_dict(json.load(file), orient='index')
+    except FileNotFoundError:
+        logger.info(f"{filename} not found. Starting a new crosswalk.")
+        crosswalk = pd.DataFrame()
+
+    crosswalk = crosswalk.reindex(columns=crosswalk_columns)
+    crosswalk.index = crosswalk.index.astype(int).rename('code')
+    return crosswalk
+
+
+@timer
+def update_crosswalk(fpl_names, understat_players, players_to_rename=players_to_rename, filename=crosswalk_file,
+                     save_to_file=True, workers=-1, min_confidence=min_confidence):
+    '''
+    Adds players that are not yet in the stored crosswalk, only these players are fuzzy matched.
+    Players renamed in preferences are matched directly and replace any fuzzy match they had. Fuzzy matches
+    scoring below min_confidence are left out of the crosswalk, so these players are matched again next time.
+    fpl_names is indexed by FPL id with each player's code, the crosswalk is stored by code and returned for the
+    players of fpl_names, indexed by their id.
+    '''
+    crosswalk = load_crosswalk(filename)
+    codes = fpl_names['code']
+    understat_players = understat_players.drop_duplicates('id').set_index('id')['player_name']
+
+    # Manual overrides, process_raw_understat has already given these players their FPL name
+    manual = []
+    for understat_name, fpl_name in players_to_rename.items():
+        fpl_codes = codes[fpl_names['player_name'] == fpl_name]
+        understat_ids = understat_players.index[understat_players == fpl_name]
+        if len(fpl_codes) == 1 and len(understat_ids) == 1:
+            manual.append(pd.DataFrame([[understat_ids[0], fpl_name, understat_name, None, 'manual']],
+                                       columns=crosswalk_columns, index=fpl_codes.to_numpy()))
+        else:
+            logger.info(f"Could not find a single player to rename {understat_name} to {fpl_name}.")
+
+    for override in manual:
+        crosswalk = crosswalk[~crosswalk.index.isin(override.index) &
+                              ~crosswalk['understat_id'].isin(override['understat_id'])]
+        crosswalk = pd.concat([crosswalk, override])
+
+    # Fuzzy match only the players not seen before
+    new_fpl = fpl_names[~codes.isin(crosswalk.index)]
+    new_understat = understat_players[~understat_players.index.isin(crosswalk['understat_id'])]
+    logger.info(f"{len(new_understat)} understat players are not in the crosswalk.")
+
+    if len(new_understat) and len(new_fpl):
+        rows, columns, scores = assign_names(new_fpl, new_understat, workers=workers)
+        matched = pd.DataFrame({'understat_id': new_understat.index[rows],
+                                'player_name': new_fpl['player_name'].iloc[columns].to_numpy(),
+                                'understat_name': new_understat.iloc[rows].to_numpy(),
+                                'confidence': scores,
+                                'source': 'fuzzy'}, index=new_fpl['code'].iloc[columns].to_numpy())
+        confident = matched[scores >= min_confidence]
+        logger.info(f"{len(confident)} new players matched, {len(matched) - len(confident)} left unmatched with a "
+                    f"confidence under {min_confidence}.")
+        crosswalk = pd.concat([crosswalk, confident])
+
+    crosswalk['understat_id'] = crosswalk['understat_id'].astype(int)
+    crosswalk.index = crosswalk.index.astype(int).rename('code')
+    if save_to_file:
+        logger.info(f"Saving crosswalk to file - {filename}.")
+        with open(filename, 'w') as outf:
+            crosswalk.to_json(outf, orient='index', force_ascii=False)
+
+    return fpl_names[['code']].join(crosswalk, on='code', how='inner')
+
 #%% Change names
 
 @timer
@@ -150,9 +359,14 @@ def change_names(understat_names, best_match, column_name='player_name'):
 
 #%% Run merge
 
-def merge(fpl_players, understat_players, column_name='player_name'):
+def merge(fpl_players, understat_players, crosswalk):
+    '''
+    Joins FPL and understat players on their ids through the crosswalk.
+    '''
     logger.info("Merging datasets")
-    return pd.merge(fpl_players.reset_index(), understat_players, how ='inner', on=[column_name, column_name])
+    fpl_players = fpl_players.join(crosswalk['understat_id'], how='inner')
+    understat_players = understat_players.drop(columns=['player_name']).rename(columns={'id': 'understat_id'})
+    return pd.merge(fpl_players.reset_index(), understat_players, how ='inner', on='understat_id').drop(columns=['understat_id'])
 
 #%% Prune data
 @timer
@@ -199,146 +413,695 @@ def prune_data(df, min_minutes=90, remove_injured=False):
     return df
 
 
-#%% Process GW data
-def process_gw_data(df, hist_data):
+#%% Compact dtypes
+category_columns = ['element_type', 'team', 'player_name']
+# Integer columns of each frame and their types, as stored
+integer_columns = {'df': storage.integer_dtypes(storage.player_schema),
+                   'gw_df': storage.integer_dtypes(storage.gameweek_schema)}
+
+def frame_memory(df):
     '''
-    This function processes gameweek by gameweek data for each of the players in the main dataframe.
-    The output is a large dataframe containing the week by week statistics for each player.
+    Deep memory usage of a dataframe in MB.
+    '''
+    return df.memory_usage(deep=True).sum() / 2**20
 
+
+@timer
+def compact_dtypes(df, name='df', category_columns=category_columns, integers=None):
     '''
-    detailed_df = pd.DataFrame()
-    df = df.set_index('index')
+    Dtype policy applied to the frames main returns.
+    Position, team and name become categoricals. The integer columns declared for the frame in integer_columns
+    (integers when given) take their declared type, or its nullable type if they have missing values. Other floats
+    (rates such as form and xG) are float32, whatever their values.
+    '''
+    integers = integer_columns.get(name, {}) if integers is None else integers
+    before = frame_memory(df)
+    df = df.copy()
+    for column in df.columns:
+        values = df[column]
+        if column in category_columns:
+            df[column] = values.astype('category')
+        elif pd.api.types.is_bool_dtype(values) or not pd.api.types.is_numeric_dtype(values):
+            continue
+        elif column in integers:
+            df[column] = values.astype(integers[column].capitalize() if values.isna().any() else integers[column])
+        elif pd.api.types.is_float_dtype(values):
+            df[column] = values.astype('float32')
+
+    logger.info(f"{name} memory reduced from {before:.2f}MB to {frame_memory(df):.2f}MB.")
+    return df
 
-    for id in df.index:
 
-        history = pd.DataFrame(hist_data[id]['history'])
+#%% Parallel execution
 
-        # Goals for and against
-        history['goals_for'] = history['team_h_score'].where(history['was_home'], history['team_a_score'])
-        history['goals_against'] = history['team_a_score'].where(history['was_home'], history['team_h_score'])
+def partition(ids, workers=workers, chunk_size=None):
+    '''
+    Splits ids into consecutive chunks, four per worker unless chunk_size is given. One chunk when workers is 1.
+    '''
+    workers = workers or os.cpu_count()
+    if workers <= 1 or len(ids) < 2:
+        return [ids]
+    chunk_size = chunk_size or -(-len(ids) // (4 * workers))
+    return [ids[start:start + chunk_size] for start in range(0, len(ids), chunk_size)]
 
-        # Drop irrelevant columns
-        history = history.drop(columns=['team_h_score','team_a_score','element','fixture','kickoff_time','opponent_team'])
 
-        # groupBY sum gameweeks
-        mean_cols =['value', 'transfers_balance', 'selected', 'transfers_in','transfers_out']
-        history = pd.concat([history.groupby('round').sum().drop(columns=mean_cols), history.groupby('round')[mean_cols].mean()], axis=1)
+def history_subset(hist_data, ids):
+    '''
+    The histories of ids to send to a worker. A HistoryFile is sent as its file name and the offsets of ids.
+    '''
+    if isinstance(getattr(hist_data, 'offsets', None), dict):
+        return hist_data.subset(ids)
+    return {id: hist_data[id] for id in ids}
 
-        # Finding empty gameweeks
-        for empty_gw in np.arange(1,max(history.index)):
-            if empty_gw not in history.index:
-                history.loc[empty_gw] = None
-        history = history.sort_index()
 
-        # filling interpolated transfer data or zeros for gw data
-        history[['value', 'transfers_balance', 'selected','transfers_in', 'transfers_out']] = \
-            history[['value', 'transfers_balance', 'selected', 'transfers_in', 'transfers_out']].interpolate(method='linear')
-        history = history.fillna(0)
+def parallel_map(function, arguments, workers=workers):
+    '''
+    [function(*args) for args in arguments], run in a pool of workers processes (every core when workers is None)
+    and returned in the order of arguments. Runs serially with a single worker or a single task.
+    '''
+    workers = min(workers or os.cpu_count(), len(arguments))
+    if workers <= 1:
+        return [function(*args) for args in arguments]
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(function, *zip(*arguments)))
 
-        # Adding a cumulative sum of points
-        history['points_cumsum'] = history['total_points'].cumsum()
 
-        # Adding player ID to df
-        history['id'] = id
+#%% Process GW data
+gw_mean_cols = ['value', 'transfers_balance', 'selected', 'transfers_in', 'transfers_out']
+# The first fixture of the player's gameweek, and its opponent, 0 in a blank gameweek. FixtureMatrix.join finds the
+# team the player played for from them.
+gw_fixture_cols = ['fixture', 'opponent_team']
 
-        # Adding general player data 
-        player_df = pd.merge(history, df[['team', 'element_type', 'player_name']], left_on='id', right_index=True,)
+def interpolate_by_player(values, players):
+    '''
+    Linear interpolation of each column within each player, equivalent to DataFrame.interpolate(method='linear')
+    run on every player separately. Leading gaps are left empty and trailing gaps take the last valid value.
+    '''
+    position = pd.DataFrame(np.broadcast_to(np.arange(len(values))[:, None], values.shape).astype(float),
+                            index=values.index, columns=values.columns)
+    known = position.where(values.notna()).groupby(players)
+    prev_pos, next_pos = known.ffill(), known.bfill()
+    prev_val, next_val = values.groupby(players).ffill(), values.groupby(players).bfill()
 
-        detailed_df = pd.concat([detailed_df, player_df], axis=0)
+    filled = (next_val - prev_val) / (next_pos - prev_pos) * (position - prev_pos) + prev_val
+    return values.fillna(filled.fillna(prev_val))
 
-    return detailed_df
+
+@timer
+def process_gw_data(df, hist_data, workers=workers, chunk_size=None):
+    '''
+    This function processes gameweek by gameweek data for each of the players in the main dataframe.
+    The output is a large dataframe containing the week by week statistics for each player.
+
+    Every player's history is processed in one pass: a single groupby on (player, round), a reindex onto each
+    player's gameweeks 1 to their latest round, vectorised interpolation and cumsum and one join of player data.
+
+    With workers above 1 the players are split into chunks of chunk_size that are processed in a process pool, see
+    parallel_map. The result is the same as processing every player at once.
+    '''
+    df = df.set_index('index')
+    chunks = partition(df.index, workers, chunk_size)
+    if len(chunks) > 1:
+        # Workers are sent the ids and histories of their chunk and return columns as arrays
+        arrays = [array for array in parallel_map(gameweek_arrays, [(chunk, history_subset(hist_data, chunk))
+                                                                    for chunk in chunks], workers) if array]
+        if arrays:
+            history = pd.DataFrame({column: np.concatenate([array[column] for array in arrays]) for column in arrays[0]})
+            history = history.set_index('round')
+        else:
+            history = empty_history()
+    else:
+        history = gameweek_history(df.index, hist_data)
+    return history.join(df[['team', 'element_type', 'player_name']], on='id')
+
+
+def gameweek_history(ids, hist_data):
+    '''
+    Gameweek rows of the players in ids, in the order of ids, without the player data process_gw_data joins.
+    '''
+    # One flat frame of every fixture, keyed by the player's position in ids. Each player's history is looked up
+    # once, so hist_data can be a HistoryFile that parses it from disk.
+    records, lengths = [], []
+    for id in ids:
+        fixtures = hist_data[id]['history']
+        records.extend(fixtures)
+        lengths.append(len(fixtures))
+    if not records:
+        return empty_history()
+    lengths = np.array(lengths, dtype=int)
+    ids = list(pd.Index(ids)[lengths > 0])
+    history = pd.DataFrame.from_records(records)
+    history['player'] = np.repeat(np.arange(len(ids)), lengths[lengths > 0])
+
+    # Goals for and against
+    history['goals_for'] = history['team_h_score'].where(history['was_home'], history['team_a_score'])
+    history['goals_against'] = history['team_a_score'].where(history['was_home'], history['team_h_score'])
+
+    # Drop irrelevant columns, only numeric columns are summed (string stats such as ict_index are dropped)
+    history = history.drop(columns=['team_h_score','team_a_score','element','kickoff_time'])
+    sum_cols = [column for column in history.select_dtypes(include=['number', 'bool']).columns
+                if column not in gw_mean_cols + gw_fixture_cols + ['round', 'player']]
+
+    # groupBY sum gameweeks
+    grouped = history.groupby(['player', 'round'])
+    history = pd.concat([grouped[sum_cols].sum(), grouped[gw_mean_cols].mean(), grouped[gw_fixture_cols].first()], axis=1)
+
+    # Reindex onto gameweeks 1 to the latest round of each player, missing gameweeks become empty rows
+    last_round = history.index.to_frame(index=False).groupby('player')['round'].max()
+    players = np.repeat(last_round.index.to_numpy(), last_round.to_numpy())
+    rounds = np.arange(len(players)) - np.repeat(last_round.cumsum().to_numpy() - last_round.to_numpy(),
+                                                 last_round.to_numpy()) + 1
+    history = history.reindex(pd.MultiIndex.from_arrays([players, rounds], names=['player', 'round']))
+
+    # filling interpolated transfer data or zeros for gw data
+    history[gw_mean_cols] = interpolate_by_player(history[gw_mean_cols], players)
+    history = history.fillna(0)
+
+    # Adding a cumulative sum of points
+    history['points_cumsum'] = history['total_points'].groupby(players).cumsum()
+
+    # Adding player ID
+    history['id'] = pd.Index(ids)[players]
+    return history.reset_index(level='player', drop=True)
+
+
+def empty_history():
+    '''
+    gameweek_history of players without any fixtures: no rows, with the columns and types of the stored gameweek data.
+    '''
+    columns = [name for name in storage.gameweek_schema.names if name not in ['team', 'element_type', 'player_name', 'code']]
+    return storage.gameweek_schema.empty_table().to_pandas()[columns].set_index('round')
+
+
+def gameweek_arrays(ids, hist_data):
+    '''
+    gameweek_history of a chunk as {column: array} with the round first, or None if no player in it has played.
+    '''
+    if not any(hist_data[id]['history'] for id in ids):
+        return None
+    history = gameweek_history(ids, hist_data).reset_index()
+    return {column: history[column].to_numpy() for column in history.columns}
+
+
+@timer
+def patch_gw_data(gw_df, df, hist_data, changed):
+    '''
+    Updates a stored gameweek dataframe instead of rebuilding it. Only the changed players and players missing
+    from gw_df are processed, players no longer in df are dropped and player data is joined again for everyone.
+    Rows are ordered as process_gw_data orders them.
+    '''
+    ids = df['index']
+    stale = ids[ids.isin(changed) | ~ids.isin(gw_df['id'])]
+    logger.info(f"Patching gameweek data for {len(stale)} players.")
+
+    kept = gw_df[gw_df['id'].isin(ids) & ~gw_df['id'].isin(stale)].drop(columns=['team', 'element_type', 'player_name'])
+    if len(stale):
+        patched = process_gw_data(df[ids.isin(stale)], hist_data).drop(columns=['team', 'element_type', 'player_name'])
+        kept = pd.concat([kept, patched])
+
+    order = pd.Series(np.arange(len(ids)), index=ids)[kept['id']].to_numpy()
+    kept = kept.iloc[np.lexsort((kept.index.to_numpy(), order))]
+    return kept.join(df.set_index('index')[['team', 'element_type', 'player_name']], on='id')
 
 
 #%% Create slices for machine learning
 # this function is not called in main but is called in the ML notebook
+player_cols = ['player_name', 'id', 'team', 'element_type']
 
-def create_ml_df(gw_df, weeks=3):
+def gw_array(gw_df):
+    '''
+    Returns the gameweek dataframe as a dense (player, gameweek, feature) array along with the feature names
+    and one row of player data per player. Gameweeks a player has no row for are NaN.
+    gw_df can be a GameweekIndex, players are in the order of its ids.
+    '''
+    index = gw_df if isinstance(gw_df, GameweekIndex) else GameweekIndex(gw_df)
+    features = [column for column in index.gw_df.columns if column not in player_cols + gw_fixture_cols]
+
+    array = np.full((len(index), index.rounds.max(), len(features)), np.nan)
+    array[index.player_codes(), index.rounds - 1] = index.gw_df[features].to_numpy(dtype=float)
+
+    return array, features, index.gw_df.iloc[index.starts][player_cols].reset_index(drop=True)
+
+
+@timer
+def create_ml_df(gw_df, weeks=3, workers=workers, chunk_size=None):
     '''
     This function uses the gameweek dataframe to create data points for the machine learning notebook.
     The data is slices up into chunks and then flattened out into a singular data point before being compiled back into a df for ML.
 
+    Windows are strided views over the dense gameweek array, so every player and slice is built at once.
+    Passing a list of weeks returns a dict of dataframes keyed by weeks, all built from the same array.
+    Windows or targets that fall on a gameweek missing from gw_df are dropped. gw_df can be a GameweekIndex.
+    With workers above 1 the windows of chunks of players are built in a process pool, as in process_gw_data.
+    '''
+    if not np.isscalar(weeks):
+        array = gw_array(gw_df)
+        return {n_weeks: _create_ml_df(*array, weeks=n_weeks, workers=workers, chunk_size=chunk_size) for n_weeks in weeks}
+
+    return _create_ml_df(*gw_array(gw_df), weeks=weeks, workers=workers, chunk_size=chunk_size)
+
+
+def ml_windows(array, target_column, weeks=3):
+    '''
+    The flattened windows and targets of every player and slice of array that have no missing values, along with
+    the position of each in (player, slice) order.
     '''
-    gw = max(gw_df.index)
-    slices = [np.arange(i-(weeks-1),i+1) for i in range(weeks, gw)]
-    logger.info(f"{len(slices)} slices for each player will be made up to gameweek {gw}")
-    logger.info(f"There are {len(gw_df['id'].unique())} players in the dataframe")
-    logger.info(f"There will be {len(gw_df['id'].unique())*len(slices)} datapoints in returned dataframe.")
+    n_players, gw, n_features = array.shape
+    # (player, slice, feature, week) with the latest week first, the target is the gameweek after each slice
+    windows = np.lib.stride_tricks.sliding_window_view(array[:, :-1], weeks, axis=1)[..., ::-1].reshape(-1, n_features * weeks)
+    target = array[:, weeks:, target_column].reshape(-1)
+    rows = np.flatnonzero(~np.isnan(windows).any(axis=1) & ~np.isnan(target))
+    return windows[rows], target[rows], rows
+
+
+def _create_ml_df(array, features, player_data, weeks=3, workers=workers, chunk_size=None):
+    n_players, gw, n_features = array.shape
+    logger.info(f"{gw - weeks} slices for each player will be made up to gameweek {gw}")
+    logger.info(f"There are {n_players} players in the dataframe")
+    logger.info(f"There will be up to {n_players * (gw - weeks)} datapoints in returned dataframe.")
 
-    df = pd.DataFrame()
     logger.info("Slicing data")
-    for id in gw_df['id'].unique(): # [7, 413]:
-        player_df = gw_df[gw_df['id'] == id]
+    chunks = partition(np.arange(n_players), workers, chunk_size)
+    results = parallel_map(ml_windows, [(array[chunk], features.index('total_points'), weeks) for chunk in chunks], workers)
+    windows = np.concatenate([windows for windows, _, _ in results])
+    target = np.concatenate([target for _, target, _ in results])
+    rows = np.concatenate([rows + chunk[0] * (gw - weeks) for chunk, (_, _, rows) in zip(chunks, results)])
+
+    df = pd.DataFrame(windows, columns=[f"{feature}_{week}_weeks_ago" for feature in features for week in range(1, weeks + 1)])
+    df['target'] = target
+    df = pd.concat([df, player_data.take(rows // (gw - weeks)).reset_index(drop=True)], axis=1)
+
+    return df[df.notna().all(axis=1)].reset_index(drop=True)
+
+
+#%% Form features
+
+class FormFeatures:
+    '''
+    Rolling form features of every player, declared as in preferences.form_features.
+
+    fit computes them for every row of gw_df at once and keeps, for each player, the last window values of each
+    column and their sums and the latest exponentially weighted means. update then takes the next gameweek's rows
+    and computes their features from that state, in O(1) per player, giving the same values fit would over all
+    the gameweeks. Windows count a player's rows, which are consecutive gameweeks in gw_df from process_gw_data.
+    '''
+    def __init__(self, features=form_features):
+        self.features = dict(features)
+        for name, (kind, column, parameter) in self.features.items():
+            if kind not in ['mean', 'ewm', 'per_90']:
+                raise ValueError(f"Unknown kind {kind} of form feature {name}.")
+        # Running sums needed for the mean and per 90 features, each (column, window) once
+        self.windows = sorted({(column, window) for kind, column, window in self.features.values() if kind != 'ewm'} |
+                              {('minutes', window) for kind, column, window in self.features.values() if kind == 'per_90'})
+        self.ewms = sorted({(column, alpha) for kind, column, alpha in self.features.values() if kind == 'ewm'})
+
+    def columns(self):
+        return sorted({column for column, _ in self.windows} | {column for column, _ in self.ewms})
+
+    @timer
+    def fit(self, gw_df):
+        '''
+        Features of every row of gw_df, indexed by round with the player's id, in (id, round) order.
+        '''
+        index = gw_df if isinstance(gw_df, GameweekIndex) else GameweekIndex(gw_df)
+        counts = index.stops - index.starts
+        rows = np.arange(len(index.rounds))
+        seen = rows - np.repeat(index.starts, counts) + 1
+        values = {column: self.values(index.gw_df, column) for column in self.columns()}
+
+        sums = {}
+        for column, window in self.windows:
+            totals = np.concatenate([[0], np.cumsum(values[column])])
+            # Rolling sums from cumulative sums, the window starts at the player's first row at the earliest
+            sums[(column, window)] = totals[rows + 1] - totals[np.maximum(rows + 1 - window, rows + 1 - seen)]
+
+        ewms = {}
+        for column, alpha in self.ewms:
+            ewm = np.empty(len(rows))
+            for k in range(counts.max(initial=0)):
+                players = np.flatnonzero(counts > k)
+                current = index.starts[players] + k
+                ewm[current] = values[column][current] if k == 0 else \
+                    alpha * values[column][current] + (1 - alpha) * ewm[current - 1]
+            ewms[(column, alpha)] = ewm
+
+        # State for update, the last window values of each player in ring buffers indexed by rows seen
+        self.position = {id: position for position, id in enumerate(index.ids)}
+        self.seen = counts.copy()
+        self.sums, self.buffers = {}, {}
+        for column, window in self.windows:
+            self.sums[(column, window)] = sums[(column, window)][index.stops - 1] if len(rows) else np.zeros(0)
+            buffer = np.zeros((len(index.ids), window))
+            latest = index.latest_rows(window)
+            buffer[index.player_codes()[latest], (seen[latest] - 1) % window] = values[column][latest]
+            self.buffers[(column, window)] = buffer
+        self.ewm = {key: ewm[index.stops - 1] if len(rows) else np.zeros(0) for key, ewm in ewms.items()}
+
+        return self.frame(sums, ewms, seen, index.gw_df['id'].to_numpy(), index.gw_df.index)
+
+    def update(self, gw_rows):
+        '''
+        Features of the rows of the next gameweek of some players, one row per player, updating the state.
+        Players not seen before start from these rows.
+        '''
+        ids = gw_rows['id'].to_numpy()
+        new = [id for id in dict.fromkeys(ids) if id not in self.position]
+        if new:
+            self.grow(new)
+        players = np.array([self.position[id] for id in ids], dtype=int)
+        if len(np.unique(players)) != len(players):
+            raise ValueError("update takes at most one row per player.")
+        seen = self.seen[players] + 1
+
+        sums = {}
+        for column, window in self.windows:
+            x = self.values(gw_rows, column)
+            buffer, slot = self.buffers[(column, window)], (seen - 1) % window
+            # The value leaving the window is the one in the slot being overwritten, nothing until the window is full
+            leaving = np.where(seen > window, buffer[players, slot], 0)
+            self.sums[(column, window)][players] += x - leaving
+            buffer[players, slot] = x
+            sums[(column, window)] = self.sums[(column, window)][players]
+
+        ewms = {}
+        for column, alpha in self.ewms:
+            x = self.values(gw_rows, column)
+            ewm = np.where(seen == 1, x, alpha * x + (1 - alpha) * self.ewm[(column, alpha)][players])
+            self.ewm[(column, alpha)][players] = ewm
+            ewms[(column, alpha)] = ewm
+
+        self.seen[players] = seen
+        return self.frame(sums, ewms, seen, ids, gw_rows.index)
+
+    def values(self, frame, column):
+        '''
+        column of frame as floats. Missing values are refused, as one would carry into every later row of the
+        running sums, across players in fit and for good in update's state.
+        '''
+        values = frame[column].to_numpy(dtype=float)
+        if np.isnan(values).any():
+            raise ValueError(f"{column} has missing values, form features need them filled in (process_gw_data does).")
+        return values
+
+    def grow(self, ids):
+        n = len(ids)
+        self.position.update({id: len(self.position) + i for i, id in enumerate(ids)})
+        self.seen = np.concatenate([self.seen, np.zeros(n, dtype=self.seen.dtype)])
+        for key in self.windows:
+            self.sums[key] = np.concatenate([self.sums[key], np.zeros(n)])
+            self.buffers[key] = np.concatenate([self.buffers[key], np.zeros((n, key[1]))])
+        for key in self.ewms:
+            self.ewm[key] = np.concatenate([self.ewm[key], np.zeros(n)])
+
+    def frame(self, sums, ewms, seen, ids, index):
+        features = {'id': ids}
+        for name, (kind, column, parameter) in self.features.items():
+            if kind == 'mean':
+                features[name] = sums[(column, parameter)] / np.minimum(seen, parameter)
+            elif kind == 'ewm':
+                features[name] = ewms[(column, parameter)]
+            else:
+                minutes = sums[('minutes', parameter)]
+                features[name] = np.divide(90 * sums[(column, parameter)], minutes,
+                                           out=np.full(len(minutes), np.nan), where=minutes > 0)
+        return pd.DataFrame(features, index=index)
+
+
+# FormFeatures state of the last run that saved its gameweek data, for incremental runs to update
+form_state_file = '.data/form_state.pkl'
+
+def add_form_features(gw_data, features=form_features, delta=None, save_to_file=False, filename=form_state_file):
+    '''
+    gw_data with the FormFeatures of every row, in (id, round) order. Per 90 features of players without minutes
+    in the window are 0 rather than NaN, as create_ml_df drops the windows with a missing value.
+    With delta, on an incremental refresh, the features stored with the gameweek data are kept and only the rows
+    added since are computed, with FormFeatures.update from the state the last run saved (see updated_form).
+    Otherwise every row is fitted. save_to_file saves the state for the next run.
+    '''
+    index = GameweekIndex(gw_data)
+    engine = load_form_state(features, delta, filename)
+    form = updated_form(engine, index) if engine else None
+    if form is None:
+        engine = FormFeatures(features)
+        form = engine.fit(index)
+    if save_to_file:
+        with open(filename, 'wb') as outf:
+            pickle.dump({'date': storage.today(), 'features': dict(features), 'state': engine}, outf)
+    form = form.fillna(0)
+    return index.gw_df.assign(**{name: form[name].to_numpy() for name in features})
+
 
-        for slice in slices:
-            df_slice = player_df.loc[slice,:].iloc[::-1].reset_index(drop=True)
-            
-            unstacked = df_slice.drop(columns=['element_type', 'player_name', 'team', 'id']).unstack().to_frame().T
-            unstacked.columns = unstacked.columns.map(lambda x: x[0] + '_' + str(1+x[1])+'_weeks_ago')
+def load_form_state(features, delta, filename=form_state_file):
+    '''
+    The FormFeatures saved with the stored gameweek data, if delta was taken against it and the features are the
+    same, else None.
+    '''
+    if not delta or storage.read_manifest().get('gameweeks', {}).get('date') != delta['since']:
+        return None
+    try:
+        with open(filename, 'rb') as file:
+            saved = pickle.load(file)
+    except (FileNotFoundError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+    if saved['date'] != delta['since'] or saved['features'] != dict(features):
+        return None
+    return saved['state']
+
+
+def updated_form(engine, index):
+    '''
+    Form features of the rows of index, the stored ones for the rows engine has seen and engine.update for the
+    rows after them, one gameweek of every player at a time. None if a player's rows engine has seen are not the
+    stored ones, e.g. a past gameweek was corrected, as the features must then be fitted again.
+    '''
+    stored = GameweekIndex(storage.read_gameweeks(columns=['id', *engine.columns(), *engine.features]))
+    counts = index.stops - index.starts
+    old = np.array([engine.seen[engine.position[id]] if id in engine.position else 0 for id in index.ids], dtype=int)
+    positions = stored.positions(index.ids)
+    stored_counts = np.where(positions >= 0, (stored.stops - stored.starts)[positions], 0)
+    if (old > counts).any() or (stored_counts != old).any():
+        return None
+
+    # The first old rows of each player, in index and in the stored frame
+    within = np.arange(old.sum()) - np.repeat(np.cumsum(old) - old, old)
+    rows = np.repeat(index.starts, old) + within
+    stored_rows = np.repeat(stored.starts[positions.clip(0)], old) + within
+    columns = engine.columns()
+    if not (np.array_equal(index.rounds[rows], stored.rounds[stored_rows]) and
+            np.array_equal(index.gw_df[columns].to_numpy(dtype=float)[rows],
+                           stored.gw_df[columns].to_numpy(dtype=float)[stored_rows])):
+        return None
+
+    features = {name: np.full(len(index.rounds), np.nan) for name in engine.features}
+    for name in features:
+        features[name][rows] = stored.gw_df[name].to_numpy(dtype=float)[stored_rows]
+    logger.info(f"Updating form features with {(counts - old).sum()} new gameweek rows.")
+    for k in range((counts - old).max(initial=0)):
+        players = np.flatnonzero(counts - old > k)
+        new = index.starts[players] + old[players] + k
+        update = engine.update(index.gw_df.iloc[new])
+        for name in features:
+            features[name][new] = update[name].to_numpy()
+    return pd.DataFrame({'id': index.gw_df['id'].to_numpy(), **features}, index=index.gw_df.index)
+
+
+#%% Past seasons
+positions = {1: 'Goalkeeper', 2: 'Defender', 3: 'Midfielder', 4: 'Forward'}
+season_columns = list(storage.season_schema.names)
+
+def season_of(date):
+    '''
+    Season of a .data file date, YYYY_MM_DD, named by the year it starts. A season runs from July to June.
+    '''
+    year, month = int(date[:4]), int(date[5:7])
+    return year if month >= 7 else year - 1
+
+
+def player_codes(player_data):
+    '''
+    {FPL id: code} of the players of a bootstrap-static snapshot, the code stays with a player between seasons.
+    '''
+    return {int(id): player.get('code') for id, player in player_data.items()}
 
-            unstacked['target'] = player_df.loc[max(slice)+1,:]['total_points']
-            unstacked['player_name'] = player_df.loc[1,'player_name']
-            unstacked['id'] = player_df.loc[1,'id']
-            unstacked['team'] = player_df.loc[1,'team']
-            unstacked['element_type'] = player_df.loc[1,'element_type']
-            df = pd.concat([df, unstacked], axis=0)
-            
-    return df.reset_index(drop=True)
+
+def with_codes(gw_df, player_data):
+    '''
+    gw_df with the code of each row's player, as the gameweeks are stored.
+    '''
+    return gw_df.assign(code=gw_df['id'].astype(int).map(player_codes(player_data)))
+
+
+def season_totals(hist_data):
+    '''
+    Season totals of every player from history_past, one row per season and element code.
+    '''
+    rows = [past for id in hist_data for past in hist_data[id].get('history_past', [])]
+    if not rows:
+        return pd.DataFrame(columns=['season'] + season_columns)
+    totals = pd.DataFrame.from_records(rows)
+    totals['season'] = totals.pop('season_name').str[:4].astype(int)
+    totals = totals.rename(columns={'element_code': 'code'})
+    totals = totals[['season'] + [column for column in season_columns if column in totals.columns]]
+    return totals.apply(pd.to_numeric).drop_duplicates(['season', 'code'], keep='last')
+
+
+def archived_runs(current=season):
+    '''
+    {season: (history file, player data file)} of the latest run stored in .data for each season before current.
+    '''
+    runs = {}
+    for history_file in sorted(glob.glob(".data/[0-9][0-9][0-9][0-9]_[0-9][0-9]_[0-9][0-9]_history.ndjson")):
+        date = os.path.basename(history_file)[:10]
+        snapshot_file = history_file.replace("_history.ndjson", "_player_data.json")
+        if season_of(date) < current and os.path.exists(snapshot_file):
+            runs[season_of(date)] = (history_file, snapshot_file)
+    return runs
+
+
+@timer
+def backfill(hist_data, current=season, directory=storage.store):
+    '''
+    Adds past seasons to the store: season totals from the history_past of hist_data and the gameweeks of the
+    latest archived run of each season. Seasons are only written once, so after the first run of a season nothing
+    is read for past seasons again. Returns the seasons written.
+    '''
+    written = []
+    manifest = storage.read_manifest(directory)
+    if manifest.get('seasons', {}).get('backfilled_through', 0) < current - 1:
+        totals = season_totals(hist_data)
+        totals = totals[(totals['season'] < current) & ~totals['season'].isin(storage.stored_seasons('seasons', directory))]
+        if len(totals):
+            storage.write_seasons(totals, directory)
+            written += sorted(totals['season'].unique().tolist())
+        # The current season's history_past is complete, the next backfill is due when the season changes
+        storage.update_manifest('seasons', directory, backfilled_through=current - 1)
+
+    stored = storage.stored_seasons('gameweeks', directory)
+    for past, (history_file, snapshot_file) in archived_runs(current).items():
+        if past in stored:
+            continue
+        logger.info(f"Backfilling the gameweeks of {past} from {history_file}.")
+        with open(snapshot_file, "r") as file:
+            snapshot_data = json.load(file)
+        snapshot = pd.DataFrame.from_dict(snapshot_data, orient='index')
+        history = HistoryFile(history_file)
+        players = pd.DataFrame({'index': snapshot.index.astype(int),
+                                'team': snapshot['team'].to_numpy(),
+                                'element_type': snapshot['element_type'].map(positions).to_numpy(),
+                                'player_name': (snapshot['first_name'] + ' ' + snapshot['second_name']).to_numpy()})
+        players = players[players['index'].isin(list(history))]
+        storage.write_gameweeks(with_codes(process_gw_data(players, history), snapshot_data), season=past,
+                                directory=directory)
+        written.append(past)
+    return sorted(set(written))
+
+
+#%% Pipeline
+
+def gameweeks(data, hist_data, delta=None):
+    '''
+    Gameweek data of the pruned players, sorted by (id, round) for GameweekIndex. The stored gameweek data is
+    patched when it was built from the snapshot delta was taken against, which gives the same frame as processing
+    every player.
+    '''
+    if delta and storage.read_manifest().get('gameweeks', {}).get('date') == delta['since']:
+        # Codes, form features and fixture difficulty are added to the stored frame after this stage
+        stored = storage.read_gameweeks().drop(columns=['code', *form_features, *joined_columns()], errors='ignore')
+        return sort_gameweeks(patch_gw_data(stored, data, hist_data, delta['changed']))
+    return sort_gameweeks(process_gw_data(data, hist_data))
+
+
+def fixture_difficulty(gw_data, fixtures):
+    '''
+    gw_data with the difficulty of each row's fixtures, see FixtureMatrix.join, when fixtures (fixtures, teams)
+    are known.
+    '''
+    if fixtures is None:
+        return gw_data
+    return FixtureMatrix(*fixtures).join(gw_data)
+
+
+def compact_frames(data, gw_data):
+    return compact_dtypes(data, 'df'), compact_dtypes(gw_data, 'gw_df')
+
+
+def stages(min_minutes=90, remove_injured=False, columns_to_drop=columns_to_drop, save_to_file=True, delta=None,
+           crosswalk_file=crosswalk_file):
+    '''
+    The stages of main from the loaded player_data, hist_data and understat_data to the returned df and gw_df.
+    The stored crosswalk is part of update_crosswalk's key as it only matches players missing from it, as it was
+    before update_crosswalk last saved it so saving it does not make the next run match again.
+    '''
+    return [Stage('process_raw_fpl', process_raw_fpl, inputs=['player_data'], outputs=['players', 'names'],
+                  params={'columns_to_drop': columns_to_drop}),
+            Stage('process_raw_understat', process_raw_understat, inputs=['understat_data'], outputs=['understat'],
+                  params={'understat_columns_to_drop': understat_columns_to_drop, 'players_to_rename': players_to_rename}),
+            Stage('update_crosswalk', update_crosswalk, inputs=['names', 'understat'], outputs=['crosswalk'],
+                  params={'players_to_rename': players_to_rename, 'filename': crosswalk_file,
+                          'min_confidence': min_confidence},
+                  options={'save_to_file': save_to_file}, files=[crosswalk_file]),
+            Stage('merge', merge, inputs=['players', 'understat', 'crosswalk'], outputs=['merged']),
+            Stage('prune_data', prune_data, inputs=['merged'], outputs=['data'],
+                  params={'min_minutes': min_minutes, 'remove_injured': remove_injured}),
+            Stage('process_gw_data', gameweeks, inputs=['data', 'hist_data'], outputs=['gw_data'],
+                  options={'delta': delta}),
+            Stage('form_features', add_form_features, inputs=['gw_data'], outputs=['gw_form'],
+                  params={'features': form_features}, options={'delta': delta, 'save_to_file': save_to_file}),
+            Stage('fixture_difficulty', fixture_difficulty, inputs=['gw_form', 'fixtures'], outputs=['gw_difficulty']),
+            Stage('compact_dtypes', compact_frames, inputs=['data', 'gw_difficulty'], outputs=['df', 'gw_df'])]
 
 
 #%% main()
+# Cache status of each stage in the last run of main
+report = {}
+
 @timer
-def main(save_to_file=True, min_minutes=90, remove_injured=False):
+def main(save_to_file=True, min_minutes=90, remove_injured=False, incremental=False, cache=stage_cache):
     '''
     Main function that loads data if it needs to be loaded.
+    With incremental=True only changed players are downloaded and the stored gameweek data is patched.
 
     It then processes and matches understat and FPL data.
 
     Data it then filtered and pruned.
 
-    Historical gameweek data is then processed to provide further insight.
+    Historical gameweek data is then processed to provide further insight, with the form features of
+    preferences.form_features on every gameweek, which create_ml_df takes as features.
+
+    The processing stages run through a Pipeline with results stored in cache, so only the stages whose inputs,
+    parameters or code changed since a previous run are run again.
     '''
     # Load the data.
     # Download the data if it is not present
     logger.info(f"Loading data.")
-    player_data, hist_data, understat_data = load_data()
-    
-    # Process the raw fpl and understat data
-    logger.info(f"Processing data.")
-    player_data, names = process_raw_fpl(player_data)
-    understat_data = process_raw_understat(understat_data)
-    
-    # Match the names using fuzzy logic
-    logger.info(f"Matching data using fuzzy logic.")
-    matches = match_names(names, understat_data['player_name'])
-    understat_data = change_names(understat_data, matches)
-    
-    # Merge the dataframes
-    logger.info(f"Merging data sources.")
-    data = merge(player_data, understat_data)
-
-    # Dataframe is pruned to ensure only active players are in the DF
-    logger.info(f"Pruning merged data.")
-    data = prune_data(data, min_minutes, remove_injured)
-
-    # Process gameweek data
-    logger.info(f"Processing gameweek data.")
-    gw_data = process_gw_data(data, hist_data)
-  
-    # Save files
-    if save_to_file:
-        filename = ".data/" + today + "_joined_data.json"
-    
-        with open(filename,'w') as file:
-            logger.info(f"Saving joined data to file - {filename}.")
-            json.dump(data.to_dict('records'), file)
+    if incremental:
+        player_data, hist_data, understat_data, delta = refresh_data(save_to_file=save_to_file)
+    else:
+        (player_data, hist_data, understat_data), delta = load_data(), None
 
-        filename = ".data/" + today + "_gw_data.json"
-        with open(filename,'w') as file:
-            logger.info(f"Saving gameweek data to file - {filename}.")
-            json.dump(gw_data.to_dict('records'), file)
+    fixtures = load_fixtures()
 
-        data.set_index('index').to_pickle(".data/" + today + "_df")
-        gw_data.to_pickle(".data/" + today + "_gw_df")
+    # Process and match the raw fpl and understat data, prune it and process gameweek data
+    logger.info(f"Processing data.")
+    runner = Pipeline(stages(min_minutes, remove_injured, save_to_file=save_to_file, delta=delta), directory=cache)
+    results = runner.run(['df', 'gw_df'], player_data=player_data, hist_data=hist_data, understat_data=understat_data,
+                         fixtures=fixtures)
+    data, gw_data = results['df'], results['gw_df']
+    report.clear()
+    report.update(runner.report)
+
+    # Save files, and any past season not yet in the store
+    if save_to_file:
+        logger.info(f"Saving joined and gameweek data to {storage.store}.")
+        storage.write_players(data.set_index('index'), gameweek=int(gw_data.index.max()))
+        storage.write_gameweeks(with_codes(gw_data, player_data))
+        # The teams of the bootstrap-static response player_data came from
+        teams = bootstrap_teams()
+        if teams:
+            storage.write_teams(teams)
+        if fixtures is not None:
+            storage.write_fixtures(*fixtures)
+        backfill(hist_data)
 
     # Returns player data by player ID
     return data.set_index('index'), gw_data
@@ -346,4 +1109,7 @@ def main(save_to_file=True, min_minutes=90, remove_injured=False):
 
 #%% If name main
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    instrument.trace_memory()
+    main()
+    instrument.recorder.to_json('.data/stage_timings.json')
+    instrument.recorder.to_prometheus('.data/stage_timings.prom')
\ No newline at end of file
@@ -1,9 +1,42 @@
+import datetime
+
 
 columns_to_drop = ['code', 'cost_change_event', 'cost_change_event_fall', 'cost_change_start', 'cost_change_start_fall',
                    'ep_next', 'ep_this', 'photo', 'special', 'squad_number', 'team_code', 'transfers_in_event',
                    'transfers_out_event', 'influence_rank_type', 'creativity_rank_type', 'threat_rank_type',
                    'ict_index_rank_type', 'corners_and_indirect_freekicks_text', 'direct_freekicks_text', 'penalties_text']
 
-understat_columns_to_drop = ['id', 'time', 'goals', 'assists', 'yellow_cards', 'red_cards', 'position', 'team_title']
+understat_columns_to_drop = ['time', 'goals', 'assists', 'yellow_cards', 'red_cards', 'position', 'team_title']
+
+players_to_rename = {'Rúben Dias':'Rúben Santos Gato Alves Dias'}
+
+# bootstrap-static columns compared against the last snapshot to find players whose history needs refreshing
+delta_columns = ['event_points', 'minutes', 'total_points', 'transfers_in', 'now_cost', 'news_added', 'team']
+
+# Season being processed, named by the year it starts as understat names them, today's season as
+# pre_process.season_of works it out: a season runs from July to June
+season = datetime.date.today().year - (datetime.date.today().month < 7)
+# Dashboard scatter plot: 'server' draws each selection on the server with the figure cache, 'clientside' sends the
+# player columns to the browser once and filters and draws them there with WebGL
+dashboard_mode = 'server'
+# Draw the server scatter plots with WebGL (scattergl), faster for many points but not supported by every browser
+webgl = False
+
+# Run the dashboard data as a SharedDataset, for deployments of app.server with several worker processes
+shared_dataset = False
+
+# Processes for process_gw_data and create_ml_df, 1 runs them serially and None uses every core
+workers = 1
 
-players_to_rename = {'Rúben Dias':'Rúben Santos Gato Alves Dias'}
\ No newline at end of file
+# Form features of pre_process.FormFeatures, name: (kind, gw_df column, window or alpha). 'mean' is the mean over
+# the player's last window gameweeks, 'ewm' the exponentially weighted mean with smoothing alpha and 'per_90' the
+# column's total per 90 minutes played over the last window gameweeks
+form_features = {'points_mean_3': ('mean', 'total_points', 3),
+                 'points_mean_5': ('mean', 'total_points', 5),
+                 'minutes_mean_5': ('mean', 'minutes', 5),
+                 'bps_mean_5': ('mean', 'bps', 5),
+                 'points_ewm': ('ewm', 'total_points', 0.3),
+                 'minutes_ewm': ('ewm', 'minutes', 0.3),
+                 'points_per_90_5': ('per_90', 'total_points', 5),
+                 'goals_per_90_5': ('per_90', 'goals_scored', 5),
+                 'assists_per_90_5': ('per_90', 'assists', 5)}
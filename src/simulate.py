@@ -0,0 +1,270 @@
+'''
+Monte Carlo simulation of a gameweek's FPL points for every player.
+
+    fixtures, teams = get_fixtures()
+    simulator = PointsSimulator().fit(df, gw_df, fixtures)
+    summary = simulator.simulate(100_000)      # mean, std, quantiles and the chance of a blank per player
+    simulator.captaincy                        # armband value of the best captain candidates
+
+fit estimates each player's chance of playing and of playing 60 minutes, goals and assists per appearance (from
+understat xG and xA when df has them) and bonus from gw_df, and each team's goals scored and conceded per fixture
+from the results of fixtures. A simulated gameweek draws the score of each of its fixtures, then each player's
+minutes, goals and assists out of their team's goals, bonus, clean sheet and goals conceded, so teammates' points
+are correlated as they are in FPL and a team's goals are the goals its opponent concedes.
+'''
+#%% Imports
+import logging
+import numpy as np
+import pandas as pd
+from scipy.stats import binom
+from tools import timer
+
+logger = logging.basicConfig(format='[%(levelname)s %(module)s] %(asctime)s - %(message)s', level = logging.INFO)
+logger = logging.getLogger(__name__)
+
+#%% Scoring
+goal_points = {'Goalkeeper': 6, 'Defender': 6, 'Midfielder': 5, 'Forward': 4}
+clean_sheet_points = {'Goalkeeper': 4, 'Defender': 4, 'Midfielder': 1, 'Forward': 0}
+assist_points = 3
+# Goals and assists of a player in one gameweek are capped at max_events, team goals at max_team_goals
+max_events, max_team_goals = 3, 9
+
+
+#%% Simulator
+
+class PointsSimulator:
+    '''
+    Points of every player over simulated gameweeks, drawn chunk_size gameweeks at a time as (players, gameweeks)
+    arrays, so memory is bounded by chunk_size whatever the number of simulations.
+
+    The score of each fixture is drawn once, from the expected goals of both sides, so the goals one team scores
+    are the goals its opponent concedes. Given its team's goals a player's goals are binomial, each team goal being theirs with their share of the
+    team's goals when they play. Players of a team are independent given the team's goals, so their goals can add
+    up to more than the team scored, but the team's goals drive all of them. Points are counted into a histogram
+    per player, which gives exact quantiles without keeping every simulated gameweek, and only the points of the
+    captain candidates are kept.
+    '''
+    def __init__(self, chunk_size=2000, seed=None, min_points=-5, max_points=40):
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.min_points, self.max_points = min_points, max_points
+        self.rates = None
+        self.teams = None
+        self.fixtures = None
+        self.gameweek = None
+        self.captaincy = None
+
+    @timer
+    def fit(self, df, gw_df, fixtures, gameweek=None, weeks=None):
+        '''
+        Rates of the players of df from their last weeks gameweeks in gw_df, every gameweek by default, and of the
+        teams from the results of fixtures (records of the FPL fixtures endpoint) before gameweek, the gameweek
+        simulated. That is the first with a fixture not played yet by default.
+        df is indexed by id with team and element_type, and xG and xA if understat data was merged.
+        '''
+        gw_df = gw_df[gw_df['id'].isin(df.index)]
+        if weeks:
+            gw_df = gw_df[gw_df.index > gw_df.index.max() - weeks]
+        played = gw_df['minutes'] > 0
+        players = gw_df.groupby('id')
+        appearances = played.groupby(gw_df['id']).sum().reindex(df.index, fill_value=0)
+        per_appearance = lambda column: (gw_df[column].where(played, 0).groupby(gw_df['id']).sum()
+                                         .reindex(df.index, fill_value=0) / appearances.clip(lower=1))
+
+        rates = pd.DataFrame(index=df.index)
+        rates['team'] = df['team']
+        rates['element_type'] = df['element_type'].astype(str)
+        gameweeks = players.size().reindex(df.index, fill_value=0).clip(lower=1)
+        rates['p_play'] = appearances / gameweeks
+        rates['p_60'] = (gw_df['minutes'] >= 60).groupby(gw_df['id']).sum().reindex(df.index, fill_value=0) / gameweeks
+        rates['goals'] = per_appearance('goals_scored')
+        rates['assists'] = per_appearance('assists')
+        # Understat's expected goals and assists over the season per appearance, where there are any
+        if {'xG', 'xA', 'minutes'} <= set(df.columns):
+            minutes = per_appearance('minutes')
+            season_minutes = df['minutes'].astype(float).where(df['minutes'] > 0)
+            for column, understat in [('goals', 'xG'), ('assists', 'xA')]:
+                expected = df[understat].astype(float) / season_minutes * minutes
+                rates[column] = expected.where(expected.notna() & (appearances > 0), rates[column])
+        bonus = gw_df['bonus'].clip(upper=3).where(played)
+        for points in [1, 2, 3]:
+            rates[f'p_bonus_{points}'] = (bonus == points).groupby(gw_df['id']).sum().reindex(df.index, fill_value=0) \
+                                         / appearances.clip(lower=1)
+
+        self.fit_teams(fixtures, pd.unique(df['team']), gameweek, weeks)
+        team_goals = self.teams['goals_for'].reindex(rates['team']).to_numpy()
+        rates['goal_share'] = (rates['goals'] / np.maximum(team_goals, 1e-9)).clip(0, 1)
+        rates['assist_share'] = (rates['assists'] / np.maximum(team_goals, 1e-9)).clip(0, 1)
+        self.rates = rates.fillna(0)
+        return self
+
+    def fit_teams(self, fixtures, teams, gameweek=None, weeks=None):
+        '''
+        Goals scored and conceded per fixture of each team and of teams, from the results before gameweek (the last
+        weeks gameweeks of them), and the expected goals of each side of the gameweek's fixtures. A side is expected
+        to score the league's goals per home or away fixture, times its goals scored and its opponent's goals
+        conceded relative to the league's. Teams without results are taken to be average.
+        '''
+        fixtures = pd.DataFrame.from_records(fixtures, columns=['event', 'team_h', 'team_a', 'team_h_score',
+                                                                'team_a_score']).dropna(subset=['event'])
+        if gameweek is None:
+            unplayed = fixtures.loc[fixtures['team_h_score'].isna(), 'event']
+            gameweek = int(unplayed.min() if len(unplayed) else fixtures['event'].max())
+        results = fixtures[(fixtures['event'] < gameweek) & fixtures['team_h_score'].notna()]
+        if weeks:
+            results = results[results['event'] >= gameweek - weeks]
+        results = results.astype(float)
+
+        sides = pd.concat([pd.DataFrame({'team': results['team_h'], 'goals_for': results['team_h_score'],
+                                         'goals_against': results['team_a_score']}),
+                           pd.DataFrame({'team': results['team_a'], 'goals_for': results['team_a_score'],
+                                         'goals_against': results['team_h_score']})])
+        league = sides['goals_for'].mean() if len(sides) else 1.0
+        home, away = (results['team_h_score'].mean(), results['team_a_score'].mean()) if len(results) else (league, league)
+        playing = fixtures[fixtures['event'] == gameweek].astype({'team_h': int, 'team_a': int})
+        index = pd.unique(np.concatenate([np.asarray(teams, dtype=np.int64), playing['team_h'], playing['team_a']]))
+        self.teams = sides.groupby(sides['team'].astype(int))[['goals_for', 'goals_against']].mean().reindex(index).fillna(league)
+
+        strength = lambda column, team: self.teams[column].reindex(team).to_numpy() / league
+        self.fixtures = pd.DataFrame({'team_h': playing['team_h'].to_numpy(), 'team_a': playing['team_a'].to_numpy(),
+                                      'goals_h': home * strength('goals_for', playing['team_h']) * strength('goals_against', playing['team_a']),
+                                      'goals_a': away * strength('goals_for', playing['team_a']) * strength('goals_against', playing['team_h'])})
+        self.gameweek = gameweek
+        return self
+
+    def tables(self):
+        '''
+        Arrays the chunks are drawn with. A player appears once for each fixture their team plays in the gameweek
+        (none in a blank gameweek, two in a double), and appearances hold, in player order, the player and the rows
+        of the drawn scores their team scores and concedes. Per player: cumulative probabilities of their goals and
+        assists given each number of team goals, and of their bonus.
+        '''
+        rates = self.rates
+        n, f = len(rates), len(self.fixtures)
+        sides = pd.DataFrame({'team': np.concatenate([self.fixtures['team_h'], self.fixtures['team_a']]),
+                              'scored': np.arange(2 * f), 'conceded': np.r_[np.arange(f, 2 * f), np.arange(f)]})
+        appearances = pd.DataFrame({'player': np.arange(n), 'team': rates['team'].to_numpy()}).merge(sides, on='team')
+        appearances = appearances.sort_values(['player', 'scored'], kind='stable')
+        player = appearances['player'].to_numpy()
+        goals = np.arange(max_team_goals + 1)[None, None, :]
+        events = np.arange(max_events)[:, None, None]
+        # cdf[k, player, g], the chance of at most k events given g team goals
+        share_cdf = lambda share: binom.cdf(events, goals, share.to_numpy()[None, :, None]).astype(np.float32)
+        bonus = rates[['p_bonus_1', 'p_bonus_2', 'p_bonus_3']].to_numpy()
+        # Bonus is 0 below the first threshold, 1 below the second and so on
+        bonus_cdf = (1 - bonus.sum(axis=1))[:, None] + np.cumsum(np.c_[np.zeros(len(rates)), bonus[:, :2]], axis=1)
+        position = rates['element_type']
+        players, starts = np.unique(player, return_index=True)
+        return {'player': player,
+                'scored': appearances['scored'].to_numpy(),
+                'conceded': appearances['conceded'].to_numpy(),
+                # Players with appearances and where they start, for summing the points of double gameweeks
+                'players': players, 'starts': starts, 'once': np.array_equal(player, np.arange(n)),
+                'goals': share_cdf(rates['goal_share']),
+                'assists': share_cdf(rates['assist_share']),
+                'bonus': bonus_cdf.astype(np.float32)[player],
+                'p_play': rates['p_play'].to_numpy(np.float32)[player],
+                'p_60': np.minimum(rates['p_60'], rates['p_play']).to_numpy(np.float32)[player],
+                'goal_points': position.map(goal_points).fillna(0).to_numpy(np.int16)[player],
+                'clean_sheet_points': position.map(clean_sheet_points).fillna(0).to_numpy(np.int16)[player],
+                'concedes': position.isin(['Goalkeeper', 'Defender']).to_numpy()[player]}
+
+    def chunk(self, rng, size, tables):
+        '''
+        Points of every player in size simulated gameweeks, and whether they played, as (players, size) arrays.
+        '''
+        n, m = len(self.rates), len(tables['player'])
+        # The home then the away goals of every fixture as (2 * fixtures, size), each fixture's score drawn once
+        expected = np.concatenate([self.fixtures['goals_h'], self.fixtures['goals_a']])[:, None]
+        score = np.minimum(rng.poisson(expected, (len(expected), size)), max_team_goals).astype(np.int8)
+        # Flat positions in the cdf tables of each appearance's row for their team's goals
+        cells = tables['player'].astype(np.int32)[:, None] * (max_team_goals + 1) + score[tables['scored']]
+        conceded = score[tables['conceded']]
+
+        minutes = rng.random((m, size), dtype=np.float32)
+        played = minutes < tables['p_play'][:, None]
+        sixty = minutes < tables['p_60'][:, None]
+        points = played.astype(np.int16) + sixty
+
+        for event, weight in [('goals', tables['goal_points'][:, None]), ('assists', assist_points)]:
+            draw = rng.random((m, size), dtype=np.float32)
+            count = np.zeros((m, size), dtype=np.int16)
+            for cdf in tables[event]:
+                count += draw > cdf.ravel()[cells]
+            points += count * played * weight
+
+        points += (conceded == 0) * sixty * tables['clean_sheet_points'][:, None]
+        points -= (conceded // 2) * (sixty & tables['concedes'][:, None])
+        draw = rng.random((m, size), dtype=np.float32)
+        bonus = np.zeros((m, size), dtype=np.int16)
+        for threshold in tables['bonus'].T:
+            bonus += draw > threshold[:, None]
+        points += bonus * played
+        if tables['once']:
+            return points, played
+        return self.per_player(points, n, tables), self.per_player(played, n, tables)
+
+    def per_player(self, values, n, tables):
+        '''
+        Appearance values summed per player, players without appearances get zeros.
+        '''
+        total = np.zeros((n, values.shape[1]), dtype=values.dtype)
+        if len(values):
+            total[tables['players']] = np.add.reduceat(values, tables['starts'], axis=0)
+        return total
+
+    @timer
+    def simulate(self, n_sims=100_000, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), captains=10):
+        '''
+        Summary of the simulated points of every player: mean, std, quantiles, p_blank (at most 2 points) and
+        p_return (at least 6). Sets captaincy for the captains players with the highest mean points.
+        '''
+        tables = self.tables()
+        n, bins = len(self.rates), self.max_points - self.min_points + 1
+        histogram = np.zeros(n * bins, dtype=np.int64)
+        offsets = np.arange(n) * bins - self.min_points
+        candidates, kept = None, []
+
+        generators = [np.random.default_rng(seed) for seed in
+                      np.random.SeedSequence(self.seed).spawn(-(-n_sims // self.chunk_size))]
+        for chunk, rng in enumerate(generators):
+            size = min(self.chunk_size, n_sims - chunk * self.chunk_size)
+            points, played = self.chunk(rng, size, tables)
+            np.clip(points, self.min_points, self.max_points, out=points)
+            histogram += np.bincount((points + offsets[:, None]).ravel(), minlength=n * bins)
+            if candidates is None:
+                candidates = np.argsort(-points.mean(axis=1), kind='stable')[:captains]
+            kept.append((points[candidates].T, played[candidates].T))
+
+        counts = histogram.reshape(n, bins)
+        values = np.arange(self.min_points, self.max_points + 1)
+        mean = counts @ values / n_sims
+        summary = pd.DataFrame({'mean': mean, 'std': np.sqrt(np.maximum(counts @ values ** 2 / n_sims - mean ** 2, 0))},
+                               index=self.rates.index)
+        cumulative = np.cumsum(counts, axis=1) / n_sims
+        for quantile in quantiles:
+            summary[f'q{round(100 * quantile)}'] = values[(cumulative < quantile).sum(axis=1).clip(max=bins - 1)]
+        summary['p_blank'] = cumulative[:, 2 - self.min_points]
+        summary['p_return'] = 1 - cumulative[:, 5 - self.min_points]
+
+        self.captaincy = self.captain_values(np.concatenate([points for points, _ in kept]),
+                                             np.concatenate([played for _, played in kept]),
+                                             self.rates.index[candidates])
+        return summary
+
+    def captain_values(self, points, played, ids):
+        '''
+        The armband's value for each candidate: ev, the captain's extra points, p_best, the chance nobody else among
+        the candidates scores more, and the best vice captain with ev_with_vice, the extra points when the vice
+        captain takes the armband in the gameweeks the captain does not play.
+        '''
+        points, played = points.astype(np.float32), played.astype(np.float32)
+        # with_vice[c, v]: mean extra points with captain c and vice captain v
+        with_vice = (points * played).mean(axis=0)[:, None] + ((1 - played).T @ points) / len(points)
+        np.fill_diagonal(with_vice, -np.inf)
+        best = points.max(axis=1, keepdims=True)
+        vice = with_vice.argmax(axis=1)
+        return pd.DataFrame({'ev': points.mean(axis=0),
+                             'p_best': (points == best).mean(axis=0),
+                             'vice': ids[vice],
+                             'ev_with_vice': with_vice[np.arange(len(ids)), vice]}, index=ids)
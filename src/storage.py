@@ -0,0 +1,319 @@
+'''
+Parquet storage for the processed player (df) and gameweek (gw_df) frames.
+
+Each frame is a hive partitioned dataset under .data/store, players by season and the gameweek of the snapshot,
+gameweeks by season and round. Reads take the columns they need and filters that are pushed down to the
+partitions and row groups, so only those columns and gameweeks are read from disk.
+
+Past seasons sit alongside the current one: season totals from element-summary history_past in the seasons
+dataset, keyed by season and element code (the player id that is kept between seasons), and the gameweeks of
+archived runs in the gameweeks dataset. read_history and read_seasons query any range of seasons, and the
+gameweeks carry each player's code so read_history can follow a player from one season's id to the next.
+'''
+#%% Imports
+import os
+import json
+import time
+import shutil
+import datetime
+import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+from preferences import season
+
+logger = logging.basicConfig(format='[%(levelname)s %(module)s] %(asctime)s - %(message)s', level = logging.INFO)
+logger = logging.getLogger(__name__)
+
+def today():
+    '''
+    Today's date as YYYY_MM_DD, the date of .data files and manifest entries. A function, so long running processes
+    such as the dashboard date what they write on the day they write it.
+    '''
+    return datetime.date.today().strftime('%Y_%m_%d')
+
+store = '.data/store'
+current_season = season
+
+#%% Schemas
+# Types of the known columns, any other column is stored with the type pyarrow infers for it
+
+counts = ['total_points', 'minutes', 'goals_scored', 'assists', 'clean_sheets', 'goals_conceded', 'own_goals',
+          'penalties_saved', 'penalties_missed', 'yellow_cards', 'red_cards', 'saves', 'bonus', 'bps']
+
+player_schema = pa.schema(
+    [('index', pa.int32()), ('player_name', pa.string()), ('element_type', pa.string()), ('team', pa.int16()),
+     ('now_cost', pa.int16()), ('dreamteam_count', pa.int16()), ('event_points', pa.int16()),
+     ('in_dreamteam', pa.bool_()), ('transfers_in', pa.int32()), ('transfers_out', pa.int32())] +
+    [(column, pa.int32()) for column in counts] +
+    [(column, pa.float64()) for column in ['form', 'points_per_game', 'selected_by_percent', 'value_form',
+                                           'value_season', 'influence', 'creativity', 'threat', 'ict_index']] +
+    [(column, pa.int32()) for column in ['influence_rank', 'creativity_rank', 'threat_rank', 'ict_index_rank',
+                                         'games', 'shots', 'key_passes', 'npg']] +
+    [(column, pa.float64()) for column in ['xG', 'xA', 'npxG', 'xGChain', 'xGBuildup']])
+
+gameweek_schema = pa.schema(
+    [('id', pa.int32()), ('round', pa.int16())] +
+    [(column, pa.int32()) for column in counts + ['was_home', 'goals_for', 'goals_against']] +
+    [(column, pa.float64()) for column in ['value', 'transfers_balance', 'selected', 'transfers_in', 'transfers_out']] +
+    [('fixture', pa.int32()), ('opponent_team', pa.int16())] +
+    [('points_cumsum', pa.int32()), ('team', pa.int16()), ('element_type', pa.string()), ('player_name', pa.string()),
+     ('code', pa.int32())])
+
+season_schema = pa.schema(
+    [('code', pa.int32()), ('start_cost', pa.int16()), ('end_cost', pa.int16())] +
+    [(column, pa.int32()) for column in counts] +
+    [(column, pa.float64()) for column in ['influence', 'creativity', 'threat', 'ict_index']])
+
+def integer_dtypes(schema):
+    '''
+    {column: numpy dtype name} of the integer columns of schema.
+    '''
+    return {field.name: np.dtype(field.type.to_pandas_dtype()).name for field in schema if pa.types.is_integer(field.type)}
+
+partitions = {'players': pa.schema([('season', pa.int16()), ('gameweek', pa.int16())]),
+              'gameweeks': pa.schema([('season', pa.int16()), ('round', pa.int16())]),
+              'seasons': pa.schema([('season', pa.int16())])}
+
+#%% Write
+
+def to_table(df, schema):
+    '''
+    Converts df to an arrow table, casting the columns named in schema to their declared types.
+    '''
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    missing = [name for name in schema.names if name not in table.column_names]
+    if missing:
+        logger.info(f"Columns in the schema but not in the data: {missing}")
+    fields = [schema.field(name) if name in schema.names else table.schema.field(name) for name in table.column_names]
+    return table.cast(pa.schema(fields))
+
+
+def write(table, dataset, directory=store, entry=None, **manifest):
+    '''
+    Writes table to the dataset, replacing the partitions it covers, and records the write in the manifest
+    under entry, the dataset's name by default.
+    '''
+    path = os.path.join(directory, dataset)
+    ds.write_dataset(table, path, format='parquet', partitioning=ds.partitioning(partitions[dataset], flavor='hive'),
+                     existing_data_behavior='delete_matching', basename_template='part-{i}.parquet')
+
+    entries = read_manifest(directory)
+    entries[entry or dataset] = dict(manifest, date=today(), written=time.time(), rows=table.num_rows)
+    write_manifest(entries, directory)
+    logger.info(f"Saved {table.num_rows} rows to {path}.")
+
+
+def write_manifest(entries, directory=store):
+    with open(os.path.join(directory, 'manifest.json'), 'w') as outf:
+        json.dump(entries, outf)
+
+
+def update_manifest(entry, directory=store, **values):
+    '''
+    Sets values in a manifest entry, keeping its other values.
+    '''
+    entries = read_manifest(directory)
+    entries[entry] = dict(entries.get(entry, {}), **values)
+    write_manifest(entries, directory)
+
+
+def write_players(df, gameweek, season=season, directory=store):
+    '''
+    Saves the player frame as returned by pre_process.main, indexed by FPL id.
+    '''
+    table = to_table(df.reset_index().assign(season=season, gameweek=gameweek), player_schema)
+    write(table, 'players', directory, season=season, gameweek=gameweek)
+
+
+def write_gameweeks(gw_df, season=season, directory=store):
+    '''
+    Saves the gameweek frame as returned by pre_process.main, indexed by round.
+    Rounds no longer in gw_df are removed so the dataset always holds exactly gw_df.
+    '''
+    path = os.path.join(directory, 'gameweeks', f'season={season}')
+    rounds = set(gw_df.index)
+    if os.path.isdir(path):
+        for partition in os.listdir(path):
+            if int(partition.split('=')[1]) not in rounds:
+                shutil.rmtree(os.path.join(path, partition))
+
+    table = to_table(gw_df.reset_index().assign(season=season), gameweek_schema)
+    # Past seasons are recorded separately so the manifest entry of the current season stays the latest run's
+    entry = 'gameweeks' if season == current_season else f'gameweeks_{season}'
+    write(table, 'gameweeks', directory, entry, season=season, gameweek=int(max(rounds)))
+
+
+def write_seasons(seasons_df, directory=store):
+    '''
+    Saves season totals, one row per season and element code, replacing the seasons in seasons_df.
+    '''
+    table = to_table(seasons_df.reset_index(drop=True), season_schema)
+    write(table, 'seasons', directory, seasons=sorted(int(season) for season in seasons_df['season'].unique()))
+
+
+def write_teams(teams, season=season, directory=store):
+    '''
+    Saves the {team id: name} of a season.
+    '''
+    filename = os.path.join(directory, 'teams.json')
+    try:
+        with open(filename, 'r') as file:
+            stored = json.load(file)
+    except FileNotFoundError:
+        stored = {}
+    stored[str(season)] = {str(id): name for id, name in teams.items()}
+    os.makedirs(directory, exist_ok=True)
+    with open(filename, 'w') as outf:
+        json.dump(stored, outf)
+
+
+def write_fixtures(fixtures, teams, season=season, directory=store):
+    '''
+    Saves the fixtures and teams of a season as get_fixtures returns them.
+    '''
+    filename = os.path.join(directory, 'fixtures.json')
+    try:
+        with open(filename, 'r') as file:
+            stored = json.load(file)
+    except FileNotFoundError:
+        stored = {}
+    stored[str(season)] = {'fixtures': fixtures, 'teams': teams}
+    os.makedirs(directory, exist_ok=True)
+    with open(filename, 'w') as outf:
+        json.dump(stored, outf)
+
+#%% Read
+
+def read_manifest(directory=store):
+    '''
+    Returns {dataset: {'season', 'gameweek', 'date', 'written', 'rows'}} for the datasets written so far.
+    '''
+    try:
+        with open(os.path.join(directory, 'manifest.json'), 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def read(dataset, columns=None, filter=None, directory=store):
+    '''
+    Reads the columns of a dataset that match filter, an arrow expression on its columns and partition keys.
+    '''
+    dataset = ds.dataset(os.path.join(directory, dataset), format='parquet',
+                         partitioning=ds.partitioning(partitions[dataset], flavor='hive'))
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
+
+
+def read_players(columns=None, filter=None, season=season, gameweek=None, directory=store):
+    '''
+    Player frame indexed by FPL id, for the latest stored gameweek of season unless gameweek is given.
+    columns selects columns to read and filter is an extra arrow expression, e.g. ds.field('element_type') == 'Forward'.
+    '''
+    gameweek = gameweek or read_manifest(directory)['players']['gameweek']
+    expression = (ds.field('season') == season) & (ds.field('gameweek') == gameweek)
+    if filter is not None:
+        expression = expression & filter
+    columns = columns and ['index'] + [column for column in columns if column != 'index']
+
+    df = read('players', columns, expression, directory).set_index('index')
+    return df.drop(columns=[column for column in ['season', 'gameweek'] if column in df.columns])
+
+
+def stored_seasons(dataset, directory=store):
+    '''
+    Seasons with a partition in the dataset.
+    '''
+    try:
+        return sorted(int(partition.split('=')[1]) for partition in os.listdir(os.path.join(directory, dataset))
+                      if partition.startswith('season='))
+    except FileNotFoundError:
+        return []
+
+
+def season_filter(seasons):
+    '''
+    Expression selecting seasons: one season, a (first, last) range including both or a list of seasons.
+    '''
+    if isinstance(seasons, tuple):
+        return (ds.field('season') >= seasons[0]) & (ds.field('season') <= seasons[1])
+    if isinstance(seasons, (list, range, set)):
+        return ds.field('season').isin(list(seasons))
+    return ds.field('season') == seasons
+
+
+def read_gameweeks(columns=None, rounds=None, ids=None, filter=None, season=season, directory=store):
+    '''
+    Gameweek frame indexed by round. rounds and ids select gameweeks and players, filter is an extra arrow
+    expression. Only the partitions of the requested rounds are opened.
+    '''
+    expression = season_filter(season)
+    if rounds is not None:
+        expression = expression & ds.field('round').isin(list(rounds))
+    if ids is not None:
+        expression = expression & ds.field('id').isin(list(ids))
+    if filter is not None:
+        expression = expression & filter
+    columns = columns and ['round'] + [column for column in columns if column != 'round']
+
+    gw_df = read('gameweeks', columns, expression, directory)
+    gw_df = gw_df.sort_values(['id', 'round'], kind='stable') if 'id' in gw_df.columns else gw_df.sort_values('round')
+    return gw_df.set_index('round').drop(columns=[column for column in ['season'] if column in gw_df.columns])
+
+
+def read_history(seasons, columns=None, rounds=None, ids=None, codes=None, filter=None, directory=store):
+    '''
+    Gameweeks of several seasons indexed by (season, id, round), e.g. read_history((2018, 2021)).
+    seasons takes the forms season_filter does, only the partitions of those seasons and rounds are opened.
+    ids are the FPL ids of one season, codes select the same players in every season.
+    '''
+    expression = season_filter(seasons)
+    if rounds is not None:
+        expression = expression & ds.field('round').isin(list(rounds))
+    if ids is not None:
+        expression = expression & ds.field('id').isin(list(ids))
+    if codes is not None:
+        expression = expression & ds.field('code').isin(list(codes))
+    if filter is not None:
+        expression = expression & filter
+    columns = columns and ['season', 'id', 'round'] + [column for column in columns if column not in ['season', 'id', 'round']]
+
+    history = read('gameweeks', columns, expression, directory)
+    return history.sort_values(['season', 'id', 'round'], kind='stable').set_index(['season', 'id', 'round'])
+
+
+def read_seasons(seasons=None, codes=None, columns=None, directory=store):
+    '''
+    Season totals indexed by (season, code), for every stored season unless seasons is given.
+    '''
+    expression = season_filter(seasons) if seasons is not None else None
+    if codes is not None:
+        code_filter = ds.field('code').isin(list(codes))
+        expression = code_filter if expression is None else expression & code_filter
+    columns = columns and ['season', 'code'] + [column for column in columns if column not in ['season', 'code']]
+
+    seasons_df = read('seasons', columns, expression, directory)
+    return seasons_df.sort_values(['season', 'code'], kind='stable').set_index(['season', 'code'])
+
+
+def read_teams(season=season, directory=store):
+    '''
+    {team id: name} of a season, empty if it was never saved.
+    '''
+    try:
+        with open(os.path.join(directory, 'teams.json'), 'r') as file:
+            return {int(id): name for id, name in json.load(file).get(str(season), {}).items()}
+    except FileNotFoundError:
+        return {}
+
+
+def read_fixtures(season=season, directory=store):
+    '''
+    (fixtures, teams) of a season, or None if they were never saved.
+    '''
+    try:
+        with open(os.path.join(directory, 'fixtures.json'), 'r') as file:
+            stored = json.load(file).get(str(season))
+    except FileNotFoundError:
+        return None
+    return (stored['fixtures'], stored['teams']) if stored else None
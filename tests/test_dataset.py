@@ -0,0 +1,162 @@
+import os
+import json
+import asyncio
+import threading
+import pandas as pd
+from benchmarks import synthetic, bench_app_startup
+from src.dataset import Dataset, SharedDataset, publish, attach, read_pointer
+
+columns = ['now_cost', 'total_points', 'element_type', 'team', 'player_name']
+
+def snapshot(tmp_path, n_players=50):
+    bench_app_startup.write_snapshot(str(tmp_path), n_players)
+    return str(tmp_path / '.data/store')
+
+
+#%% Dataset
+def test_load_latest_snapshot(tmp_path):
+    dataset = Dataset(columns=columns, directory=snapshot(tmp_path))
+    assert dataset.summary()['status'] == 'empty' and dataset.df.empty
+
+    assert dataset.load()
+    assert list(dataset.df.columns) == columns and len(dataset.df) == 50
+    assert dataset.summary()['age_seconds'] < 60
+    assert not Dataset(directory=str(tmp_path / 'missing')).load()
+
+
+def test_snapshots_age_past_midnight(tmp_path, monkeypatch):
+    from src import dataset as module
+    store, shared = snapshot(tmp_path), str(tmp_path / 'shared')
+    worker = SharedDataset(columns=columns, directory=store, shared=shared)
+    assert worker.load() and worker.is_current() and Dataset(directory=store).is_current()
+
+    # The same process the next day
+    monkeypatch.setattr(module.storage, 'today', lambda: '2099_01_01')
+    assert not worker.is_current() and not Dataset(directory=store).is_current()
+    assert publish(synthetic.player_stats(80), synthetic.player_stats(1), shared)['date'] == '2099_01_01'
+
+
+def test_refresh_swaps_in_background(tmp_path):
+    started, release = threading.Event(), threading.Event()
+    fresh = synthetic.player_stats(80), synthetic.player_stats(1)
+
+    loops = []
+
+    def build():
+        loops.append(asyncio.get_event_loop())
+        started.set()
+        release.wait()
+        return fresh
+
+    dataset = Dataset(columns=columns, build=build, directory=snapshot(tmp_path))
+    dataset.load()
+    swapped = []
+    dataset.listeners.append(swapped.append)
+    old = dataset.frames
+
+    thread = dataset.refresh()
+    started.wait()
+    # The old snapshot is served until the build finishes, and a second refresh joins the running one
+    assert dataset.frames is old and dataset.summary()['status'] == 'refreshing'
+    assert dataset.refresh() is thread
+    release.set()
+    thread.join()
+
+    assert dataset.summary()['status'] == 'current'
+    assert len(dataset.df) == 80 and list(dataset.df.columns) == columns and dataset.gw_df is fresh[1]
+    assert swapped == [dataset.df]
+    # The refresh closes the event loop it ran on
+    assert loops[0].is_closed()
+
+
+def test_failed_refresh_keeps_snapshot(tmp_path):
+    def build():
+        raise ConnectionError('fpl is down')
+
+    dataset = Dataset(columns=columns, build=build, directory=snapshot(tmp_path))
+    dataset.load()
+    old = dataset.frames
+    dataset.refresh().join()
+
+    assert dataset.frames is old
+    assert dataset.summary()['status'] == 'failed' and 'fpl is down' in dataset.summary()['error']
+
+
+#%% Shared dataset
+def test_publish_attach_zero_copy(tmp_path):
+    df = synthetic.player_stats(100)
+    df['element_type'] = df['element_type'].astype('category')
+    gw_df = synthetic.player_stats(5)
+    publish(df, gw_df, str(tmp_path))
+    assert publish(df, gw_df, str(tmp_path))['generation'] == 2
+    assert os.listdir(tmp_path / 'generation=2') and not os.path.exists(tmp_path / 'generation=1')
+
+    attached, attached_gw, pointer = attach(str(tmp_path))
+    pd.testing.assert_frame_equal(attached, df)
+    assert pointer == read_pointer(str(tmp_path))
+    # Numeric columns are views of the mapped file, not copies
+    assert not attached['total_points'].to_numpy().flags.owndata
+    assert not attached['total_points'].to_numpy().flags.writeable
+
+
+def test_one_worker_refreshes(tmp_path):
+    started, release = threading.Event(), threading.Event()
+    builds = []
+
+    def build():
+        builds.append(1)
+        started.set()
+        release.wait()
+        return synthetic.player_stats(80), synthetic.player_stats(1)
+
+    store, shared = snapshot(tmp_path), str(tmp_path / 'shared')
+    workers = [SharedDataset(columns=columns, build=build, directory=store, shared=shared) for _ in range(3)]
+    for worker in workers:
+        assert worker.load()
+    assert read_pointer(shared)['generation'] == 1 and {worker.generation for worker in workers} == {1}
+    # The published data is from an earlier day
+    pointer = dict(read_pointer(shared), date='2022_03_10')
+    with open(os.path.join(shared, 'current.json'), 'w') as outf:
+        json.dump(pointer, outf)
+
+    # Each worker holds its own lock file handle, like separate processes
+    workers[0].refresh()
+    assert started.wait(10)
+    for worker in workers[1:]:
+        worker.refresh().join()
+        assert worker.summary()['status'] == 'refreshing in another worker'
+    release.set()
+    workers[0].thread.join()
+    assert len(builds) == 1 and read_pointer(shared)['generation'] == 2
+
+    watcher = workers[1]
+    watcher.watch(interval=0.01)
+    # The watcher sets the status just after attaching
+    for _ in range(200):
+        if watcher.generation == 2 and watcher.summary()['status'] == 'current':
+            break
+        threading.Event().wait(0.01)
+    assert watcher.generation == 2 and len(watcher.df) == 80 and watcher.summary()['status'] == 'current'
+
+
+def test_watch_survives_failed_checks(tmp_path):
+    store, shared = snapshot(tmp_path), str(tmp_path / 'shared')
+    worker = SharedDataset(columns=columns, directory=store, shared=shared)
+    assert worker.load()
+    pointer = read_pointer(shared)
+
+    # A half written pointer fails the check, the watcher keeps serving generation 1 and checking
+    with open(os.path.join(shared, 'current.json'), 'w') as outf:
+        outf.write('{"generation": ')
+    worker.watch(interval=0.01)
+    threading.Event().wait(0.1)
+    assert worker.watcher.is_alive() and worker.generation == 1
+
+    with open(os.path.join(shared, 'current.json'), 'w') as outf:
+        json.dump(pointer, outf)
+    publish(synthetic.player_stats(80), synthetic.player_stats(1), shared)
+    for _ in range(200):
+        if worker.generation == 2:
+            break
+        threading.Event().wait(0.01)
+    assert worker.generation == 2 and len(worker.df) == 80
@@ -0,0 +1,178 @@
+import time
+import json
+import asyncio
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from src.fetch import Fetcher, FetchError, TokenBucket
+from src import get_data
+from src.get_data import get_player_hist, ingest, HistoryFile
+
+#%% Local stand-in for the element-summary endpoint
+class FlakyHandler(BaseHTTPRequestHandler):
+    '''
+    /element-summary/<id>/ returns {'id': id} after a short delay.
+    Ids divisible by 3 fail with a 503 and ids divisible by 5 return garbled json on their first attempt.
+    Id 404 never succeeds.
+    '''
+    attempts = {}
+    in_flight, peak = 0, 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        id = int(self.path.strip('/').split('/')[-1])
+        with self.lock:
+            attempt = self.attempts[id] = self.attempts.get(id, 0) + 1
+            FlakyHandler.in_flight += 1
+            FlakyHandler.peak = max(FlakyHandler.peak, FlakyHandler.in_flight)
+        time.sleep(0.01)
+        with self.lock:
+            FlakyHandler.in_flight -= 1
+
+        if id == 404 or (id % 3 == 0 and attempt == 1):
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        body = b'{"id": ' if id % 5 == 0 and attempt == 1 else json.dumps({'id': id}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    FlakyHandler.attempts, FlakyHandler.peak = {}, 0
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}/element-summary/'
+    httpd.shutdown()
+
+
+#%% Fetcher
+def test_retries_until_success(server):
+    fetcher = Fetcher(concurrency=5, retries=3, backoff=0.01)
+    data = asyncio.run(get_player_hist(range(1, 31), url=server, save_to_file=False, fetcher=fetcher))
+
+    assert data == {id: {'id': id} for id in range(1, 31)}
+    stats = fetcher.stats.summary()
+    assert stats['requests'] == 30
+    assert stats['retries'] == 14
+    assert stats['failures'] == 0
+    assert stats['p50_ms'] <= stats['p99_ms']
+
+
+def test_bounded_concurrency(server):
+    fetcher = Fetcher(concurrency=3, retries=3, backoff=0.01)
+    asyncio.run(fetcher.get_json({id: f'{server}{id}/' for id in range(1, 31)}))
+    assert FlakyHandler.peak <= 3
+    assert len(fetcher.stats.latencies) == 30
+
+
+def test_persistent_failure_raises(server):
+    fetcher = Fetcher(retries=2, backoff=0.01)
+    with pytest.raises(FetchError) as error:
+        asyncio.run(fetcher.get_json({id: f'{server}{id}/' for id in [1, 2, 404]}))
+
+    assert list(error.value.failed) == [404]
+    assert FlakyHandler.attempts[404] == 3
+    assert fetcher.stats.summary()['failures'] == 1
+
+
+def test_stream_to_history_file(server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / '.data').mkdir()
+    fetcher = Fetcher(concurrency=5, retries=3, backoff=0.01)
+    history = asyncio.run(get_player_hist(list(range(1, 31)), url=server, fetcher=fetcher))
+
+    # Lines are written in the order responses arrive and read back by id
+    assert isinstance(history, HistoryFile)
+    assert dict(history) == {id: {'id': id} for id in range(1, 31)}
+    assert history[17] == {'id': 17} and 31 not in history
+    assert not list(tmp_path.glob('.data/*.tmp'))
+
+
+#%% Concurrent ingestion
+class IngestHandler(BaseHTTPRequestHandler):
+    '''
+    /bootstrap-static/ lists 20 players after 0.1s, /element-summary/<id>/ returns {'id': id} after 0.01s.
+    '''
+    def do_GET(self):
+        if 'bootstrap-static' in self.path:
+            time.sleep(0.1)
+            body = json.dumps({'elements': [{'id': id, 'web_name': str(id)} for id in range(1, 21)]}).encode()
+        else:
+            time.sleep(0.01)
+            body = json.dumps({'id': int(self.path.strip('/').split('/')[-1])}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class IngestServer(ThreadingHTTPServer):
+    # Room for the fetcher's 20 concurrent connections, a full backlog delays connections by a second
+    request_queue_size = 64
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / '.data' / 'player_data').mkdir(parents=True)
+    httpd = IngestServer(('127.0.0.1', 0), IngestHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    get_data.instrument.recorder.clear()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}/'
+    httpd.shutdown()
+
+
+def fake_understat(delay):
+    async def get_understat(induvidual_stats=True, save_to_file=True):
+        await asyncio.sleep(delay)
+        return [{'id': '1', 'player_name': 'Leno'}]
+    return get_understat
+
+
+@pytest.mark.parametrize('understat_delay, path', [(0.4, ['understat']), (0.01, ['bootstrap', 'element_summary'])])
+def test_ingest_overlaps_sources(api, tmp_path, monkeypatch, understat_delay, path):
+    monkeypatch.setattr(get_data, 'get_understat', fake_understat(understat_delay))
+    player_data, history, understat = asyncio.run(ingest(url=api, cache=False))
+
+    assert list(player_data) == list(range(1, 21)) and understat[0]['player_name'] == 'Leno'
+    assert dict(history) == {id: {'id': id} for id in range(1, 21)}
+    assert (tmp_path / '.data' / f'{get_data.storage.today()}_player_data.json').exists()
+
+    ingestion = get_data.instrument.recorder.spans[-1]
+    spans = {child.name: child for child in ingestion.children}
+    assert spans['element_summary'].started >= spans['bootstrap'].started + spans['bootstrap'].seconds - 0.001
+    assert ingestion.seconds < sum(child.seconds for child in ingestion.children)
+    assert [name for name, seconds in get_data.critical_path(ingestion)] == path
+
+
+def test_ingest_only_missing_sources(api, monkeypatch):
+    monkeypatch.setattr(get_data, 'get_understat', fake_understat(0))
+    player_data = {1: {'web_name': '1'}, 2: {'web_name': '2'}}
+    _, history, understat = asyncio.run(ingest(player_data, understat=[], url=api, save_to_file=False, cache=False))
+
+    assert history == {1: {'id': 1}, 2: {'id': 2}} and understat == []
+    assert [child.name for child in get_data.instrument.recorder.spans[-1].children] == ['element_summary']
+
+
+def test_token_bucket_rate():
+    async def take(bucket, n):
+        t_start = time.perf_counter()
+        for _ in range(n):
+            await bucket.acquire()
+        return time.perf_counter() - t_start
+
+    # A burst of 5 is free, the next 10 tokens take 10 / 50 seconds
+    assert asyncio.run(take(TokenBucket(rate=50, capacity=5), 15)) >= 0.18
@@ -0,0 +1,87 @@
+import os
+import json
+import base64
+import shutil
+import subprocess
+import pytest
+import numpy as np
+from benchmarks import synthetic, reference
+from src.figures import FigureCache, column_data
+
+positions = ['Goalkeeper', 'Defender', 'Midfielder', 'Forward']
+
+def player_frame(n_players=100):
+    df = synthetic.players({id: None for id in range(1, n_players + 1)})
+    return df.assign(now_cost=np.arange(n_players) + 40, total_points=np.arange(n_players) % 17)
+
+
+def values(array):
+    # Newer plotly versions serialise numpy arrays as base64
+    if isinstance(array, dict):
+        return list(np.frombuffer(base64.b64decode(array['bdata']), dtype=array['dtype']))
+    return list(array)
+
+
+def traces(figure):
+    return [(trace['name'], values(trace['x']), values(trace['y'])) for trace in figure['data']]
+
+
+#%% FigureCache
+def test_scatter_matches_callback():
+    df = player_frame()
+    figures = FigureCache(df, positions)
+    for filter_by, team in [(positions, list(range(1, 21))), (['Forward', 'Defender'], [3, 1, 7]), ([], [1])]:
+        expected = reference.update_graph(df, 'now_cost', 'total_points', filter_by, team)[0].to_plotly_json()
+        figure = figures.scatter('now_cost', 'total_points', filter_by, team)
+        assert traces(figure) == traces(expected)
+
+
+def test_cache_hits_and_eviction():
+    figures = FigureCache(player_frame(), positions, max_size=2)
+    first = figures.scatter('now_cost', 'total_points', ['Forward', 'Defender'], [1, 2])
+
+    # The same selection in another order is a hit
+    assert figures.scatter('now_cost', 'total_points', ['Defender', 'Forward'], [2, 1]) is first
+    figures.scatter('total_points', 'now_cost', ['Forward'], [1])
+    figures.scatter('now_cost', 'total_points', ['Forward'], [1])
+    assert (figures.hits, figures.misses, len(figures.figures)) == (1, 3, 2)
+    assert figures.scatter('now_cost', 'total_points', ['Forward', 'Defender'], [1, 2]) is not first
+
+
+def test_reload_invalidates():
+    df = player_frame()
+    figures = FigureCache(df, positions)
+    figures.scatter('now_cost', 'total_points', positions, [1])
+    figures.reload(df.assign(total_points=0))
+
+    assert not figures.figures
+    assert set(values(figures.scatter('now_cost', 'total_points', positions, [1])['data'][0]['y'])) == {0}
+
+
+#%% Clientside scatter
+def test_column_data():
+    df = player_frame(4).assign(form=[1.5, None, 0.1, 2])
+    df['form'] = df['form'].astype('float32')
+    data = column_data(df, ['form', 'now_cost'], positions)
+
+    assert data['columns'] == {'form': [1.5, None, 0.1, 2.0], 'now_cost': [40.0, 41.0, 42.0, 43.0]}
+    assert [data['positions'][code] for code in data['position']] == list(df['element_type'])
+    json.dumps(data)
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node is needed to run the clientside callback')
+def test_clientside_matches_server():
+    df = player_frame()
+    script = os.path.join(os.path.dirname(__file__), '..', 'src', 'assets', 'scatter.js')
+    call = (['now_cost', 'total_points', ['Forward', 'Defender'], [3, 1, 7]], column_data(df, ['now_cost', 'total_points'], positions))
+    output = subprocess.run(['node', '-e', f"""
+        window = {{}};
+        eval(require('fs').readFileSync({json.dumps(script)}, 'utf8'));
+        const [args, data] = {json.dumps(call)};
+        console.log(JSON.stringify(window.dash_clientside.fpl.scatter(...args, data)));"""],
+        capture_output=True, text=True, check=True).stdout
+    figure = json.loads(output)[0]
+
+    expected = FigureCache(df, positions).scatter('now_cost', 'total_points', ['Forward', 'Defender'], [3, 1, 7])
+    assert {trace['type'] for trace in figure['data']} == {'scattergl'}
+    assert sorted(traces(figure)) == sorted(traces(expected))
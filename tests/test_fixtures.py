@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+from src import storage
+from src.fixtures import FixtureMatrix, get_fixtures
+
+def season(n_teams=6, n_gameweeks=8, seed=0):
+    rng = np.random.default_rng(seed)
+    teams = [{'id': id, 'name': f'Team {id}', **{f'strength_{kind}_{side}': int(rng.integers(1000, 1400))
+                                               for kind in ['overall', 'attack', 'defence'] for side in ['home', 'away']}}
+             for id in range(1, n_teams + 1)]
+    fixtures = []
+    for event in range(1, n_gameweeks + 1):
+        order = rng.permutation(np.arange(1, n_teams + 1))
+        for home, away in zip(order[::2], order[1::2]):
+            fixtures.append({'id': len(fixtures) + 1, 'event': event, 'team_h': int(home), 'team_a': int(away),
+                             'team_h_difficulty': int(rng.integers(2, 6)), 'team_a_difficulty': int(rng.integers(2, 6))})
+    # Team 1 plays twice in gameweek 3 and not at all in gameweek 4, one fixture is not scheduled yet
+    for fixture in fixtures:
+        if fixture['event'] == 4 and 1 in (fixture['team_h'], fixture['team_a']):
+            fixture['event'] = 3
+    fixtures.append({'id': len(fixtures) + 1, 'event': None, 'team_h': 2, 'team_a': 3,
+                     'team_h_difficulty': 3, 'team_a_difficulty': 3})
+    return fixtures, teams
+
+
+def team_fixtures(fixtures, teams, team, event):
+    '''
+    (difficulty, attack) of each fixture of team in gameweek event, worked out one fixture at a time.
+    '''
+    strength = {t['id']: t for t in teams}
+    rows = []
+    for fixture in fixtures:
+        if fixture['event'] != event or team not in (fixture['team_h'], fixture['team_a']):
+            continue
+        home = fixture['team_h'] == team
+        opponent = fixture['team_a'] if home else fixture['team_h']
+        venue, other = ('home', 'away') if home else ('away', 'home')
+        rows.append((fixture['team_h_difficulty'] if home else fixture['team_a_difficulty'],
+                     strength[team][f'strength_attack_{venue}'] - strength[opponent][f'strength_defence_{other}']))
+    return rows
+
+
+#%% Matrix
+def test_matrix_matches_fixtures():
+    fixtures, teams = season()
+    matrix = FixtureMatrix(fixtures, teams)
+    assert matrix.opponent.shape == (7, 9, 2) and matrix.slots == 2
+    assert matrix.counts[1, 3] == 2 and matrix.counts[1, 4] == 0 and np.isnan(matrix.values['difficulty'][1, 4]).all()
+    assert matrix.counts[:, 1:].sum() == 2 * (len(fixtures) - 1)
+
+    for team in range(1, 7):
+        for event in range(1, 9):
+            expected = team_fixtures(fixtures, teams, team, event)
+            assert matrix.counts[team, event] == len(expected)
+            assert matrix.totals['difficulty'][team, event] == sum(difficulty for difficulty, _ in expected)
+            assert matrix.totals['attack'][team, event] == sum(attack for _, attack in expected)
+
+    # Lookahead for every team is a slice, windows past the season's end have no fixtures
+    assert (matrix.ahead('difficulty', 2, 3) == matrix.totals['difficulty'][:, 3:6].sum(axis=1)).all()
+    assert (matrix.ahead('fixtures', 6, 5) == matrix.counts[:, 7:].sum(axis=1)).all()
+    upcoming = matrix.upcoming(2, 3)
+    assert upcoming['opponent'].shape == (7, 3, 2) and (upcoming['opponent'] == matrix.opponent[:, 3:6]).all()
+
+
+def test_join():
+    fixtures, teams = season()
+    matrix = FixtureMatrix(fixtures, teams)
+    rounds = np.tile(np.arange(1, 11), 4)
+    gw_df = pd.DataFrame({'id': np.repeat([10, 11, 12, 13], 10), 'team': np.repeat([1, 2, 5, 99], 10)},
+                         index=pd.Index(rounds, name='round'))
+    joined = matrix.join(gw_df, ahead=3, behind=2)
+    assert joined.index.equals(gw_df.index) and list(joined.columns[:2]) == ['id', 'team']
+
+    for (round, row) in zip(joined.index, joined.itertuples()):
+        # Teams and rounds outside the fixtures have none and their difficulty is unknown
+        if row.team == 99 or round > 8:
+            assert row.fixtures == 0 and np.isnan(row.difficulty) and np.isnan(row.difficulty_next_3)
+            continue
+        expected = team_fixtures(fixtures, teams, row.team, round)
+        assert row.fixtures == len(expected)
+        if expected:
+            assert row.difficulty == np.mean([difficulty for difficulty, _ in expected])
+        else:
+            assert np.isnan(row.difficulty)
+        ahead = [fixture for event in range(round + 1, round + 4) for fixture in team_fixtures(fixtures, teams, row.team, event)]
+        behind = [fixture for event in range(round - 1, round + 1) for fixture in team_fixtures(fixtures, teams, row.team, event)]
+        assert row.difficulty_next_3 == sum(difficulty for difficulty, _ in ahead) and row.fixtures_next_3 == len(ahead)
+        assert row.difficulty_last_2 == sum(difficulty for difficulty, _ in behind) and row.fixtures_last_2 == len(behind)
+
+
+def test_join_uses_each_rows_fixture():
+    fixtures, teams = season()
+    matrix = FixtureMatrix(fixtures, teams)
+    # The player is now at team 2 but played gameweeks 1 and 2 for team 5, and had no fixture in gameweek 3
+    played = {fixture['event']: fixture for fixture in fixtures if 5 in (fixture['team_h'], fixture['team_a'])}
+    rows = [(played[round]['id'], played[round]['team_a' if played[round]['team_h'] == 5 else 'team_h']) for round in [1, 2]]
+    gw_df = pd.DataFrame({'id': 10, 'team': 2, 'fixture': [fixture for fixture, _ in rows] + [0],
+                          'opponent_team': [opponent for _, opponent in rows] + [0]},
+                         index=pd.Index([1, 2, 3], name='round'))
+    joined = matrix.join(gw_df)
+
+    for round, team in [(1, 5), (2, 5), (3, 2)]:
+        expected = team_fixtures(fixtures, teams, team, round)
+        assert joined.loc[round, 'fixtures'] == len(expected)
+        assert joined.loc[round, 'attack'] == np.mean([attack for _, attack in expected])
+
+
+#%% Ingest and store
+def test_get_and_store_fixtures(tmp_path):
+    fixtures, teams = season()
+
+    class Cache:
+        requests = []
+        def get_json(self, url):
+            self.requests.append(url)
+            return 200, fixtures if url.endswith('fixtures/') else {'teams': teams, 'elements': []}
+
+    cache = Cache()
+    assert get_fixtures(url='http://fpl/', cache=cache) == (fixtures, teams)
+    assert cache.requests == ['http://fpl/fixtures/', 'http://fpl/bootstrap-static/']
+
+    storage.write_fixtures(fixtures, teams, season=2021, directory=tmp_path)
+    assert storage.read_fixtures(2021, directory=tmp_path) == (fixtures, teams)
+    assert storage.read_fixtures(2020, directory=tmp_path) is None
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+from benchmarks import synthetic
+from src.pre_process import process_gw_data
+from src.gameweek_index import GameweekIndex, sort_gameweeks
+
+def gw_df(n_players=30, n_gameweeks=10):
+    hist_data = synthetic.element_summary(n_players=n_players, n_gameweeks=n_gameweeks)
+    df = synthetic.players(hist_data)
+    # Players in reverse id order, as process_gw_data keeps the order of df
+    return process_gw_data(df.iloc[::-1], hist_data)
+
+
+def masked(frame, mask):
+    return sort_gameweeks(frame[mask])
+
+
+#%% Queries
+def test_queries_match_masks():
+    frame = gw_df()
+    index = GameweekIndex(frame)
+    assert not index.gw_df.index.equals(frame.index) and index.dense
+
+    pd.testing.assert_frame_equal(index.player(7, first=3, last=6),
+                                  masked(frame, (frame['id'] == 7) & (frame.index >= 3) & (frame.index <= 6)))
+    # Players are returned in the order asked for, those without the gameweek are left out
+    pd.testing.assert_frame_equal(index.gameweek(4, ids=[9, 2, 404]),
+                                  masked(frame, frame['id'].isin([2, 9]) & (frame.index == 4)).iloc[::-1])
+    pd.testing.assert_frame_equal(index.gameweek(10), masked(frame, frame.index == 10))
+
+    latest = frame.groupby('id', group_keys=False).apply(lambda player: player.iloc[-3:])
+    pd.testing.assert_frame_equal(index.latest(3), sort_gameweeks(latest))
+    assert len(index.latest(3, ids=[1])) == 3
+
+
+def test_sparse_gameweeks():
+    # Rows missing from the middle of players' gameweeks, as in gameweeks read back with a filter
+    frame = gw_df()
+    frame = frame[(frame.index % 3 != 0) | (frame['id'] % 2 == 0)]
+    index = GameweekIndex(frame)
+    assert not index.dense
+
+    pd.testing.assert_frame_equal(index.gameweek(6), masked(frame, frame.index == 6))
+    pd.testing.assert_frame_equal(index.player(5, first=2, last=7), masked(frame, (frame['id'] == 5) & frame.index.isin(range(2, 8))))
+    assert np.array_equal(index.gw_df['id'].to_numpy()[index.starts], index.ids)
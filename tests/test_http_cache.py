@@ -0,0 +1,135 @@
+import os
+import json
+import asyncio
+import hashlib
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from src.http_cache import HttpCache
+from src.fetch import Fetcher
+from src.get_data import get_data, get_player_hist, bootstrap_teams
+
+#%% Local stand-in for the FPL api with ETags
+class ETagHandler(BaseHTTPRequestHandler):
+    '''
+    Serves bodies by path with an ETag and answers 304 when If-None-Match matches.
+    '''
+    bodies = {}
+    served = []
+
+    def do_GET(self):
+        body = json.dumps(self.bodies[self.path]).encode()
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.served.append(304)
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.served.append(200)
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    ETagHandler.bodies = {'/bootstrap-static/': {'elements': [{'id': 1, 'web_name': 'Leno'}, {'id': 4, 'web_name': 'Saka'}]}}
+    ETagHandler.bodies.update({f'/element-summary/{id}/': {'history': [], 'id': id % 2} for id in range(1, 11)})
+    ETagHandler.served = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ETagHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+
+
+#%% HttpCache
+def test_revalidates_stale_urls(server, tmp_path):
+    url = server + '/bootstrap-static/'
+    cache = HttpCache(tmp_path, max_age={})
+    assert get_data(url, save_to_file=False, cache=cache) == {1: {'web_name': 'Leno'}, 4: {'web_name': 'Saka'}}
+
+    # A new cache on the same directory, as after a restart, sends If-None-Match and reuses the body on 304
+    assert get_data(url, save_to_file=False, cache=HttpCache(tmp_path, max_age={})) == {1: {'web_name': 'Leno'}, 4: {'web_name': 'Saka'}}
+    assert ETagHandler.served == [200, 304]
+
+    ETagHandler.bodies['/bootstrap-static/']['elements'].pop()
+    assert get_data(url, save_to_file=False, cache=cache) == {1: {'web_name': 'Leno'}}
+    assert ETagHandler.served == [200, 304, 200]
+
+
+def test_fresh_urls_skip_requests(server, tmp_path):
+    cache = HttpCache(tmp_path, max_age={r'element-summary/': 60})
+    fetcher = Fetcher(cache=cache)
+    first = asyncio.run(get_player_hist(range(1, 11), url=server + '/element-summary/', save_to_file=False, fetcher=fetcher))
+    second = asyncio.run(get_player_hist(range(1, 11), url=server + '/element-summary/', save_to_file=False, fetcher=fetcher))
+
+    assert first == second
+    assert ETagHandler.served == [200] * 10
+    assert fetcher.stats.summary()['cached'] == 10
+
+
+def test_teams_from_the_stored_bootstrap(server, tmp_path):
+    ETagHandler.bodies['/bootstrap-static/']['teams'] = [{'id': 1, 'name': 'Arsenal'}]
+    cache = HttpCache(tmp_path, max_age={})
+    assert bootstrap_teams(server + '/bootstrap-static/', cache=cache) is None
+    get_data(server + '/bootstrap-static/', save_to_file=False, cache=cache)
+    assert bootstrap_teams(server + '/bootstrap-static/', cache=HttpCache(tmp_path, max_age={})) == {1: 'Arsenal'}
+    assert ETagHandler.served == [200]
+
+
+def test_not_modified_in_fetcher(server, tmp_path):
+    fetcher = Fetcher(cache=HttpCache(tmp_path, max_age={}))
+    asyncio.run(fetcher.get_json({id: f'{server}/element-summary/{id}/' for id in range(1, 11)}))
+    asyncio.run(fetcher.get_json({id: f'{server}/element-summary/{id}/' for id in range(1, 11)}))
+
+    assert ETagHandler.served.count(304) == 10
+    assert fetcher.stats.summary()['not_modified'] == 10
+
+
+def test_content_addressed_lru_eviction(server, tmp_path):
+    cache = HttpCache(tmp_path, max_bytes=60, max_age={})
+    fetcher = Fetcher(cache=cache)
+    asyncio.run(fetcher.get_json({id: f'{server}/element-summary/{id}/' for id in range(1, 11)}))
+
+    # Ten urls but only two distinct bodies
+    assert len(os.listdir(tmp_path / 'objects')) == 2
+    assert len(cache.index) == 10
+
+    cache.max_bytes = 40
+    cache.body(f'{server}/element-summary/10/')
+    cache.save()
+    assert f'{server}/element-summary/10/' in cache.index
+    assert len(os.listdir(tmp_path / 'objects')) == 1
+    assert len({entry['sha256'] for entry in cache.index.values()}) == 1
+
+
+def test_replaced_bodies_are_removed(server, tmp_path):
+    url = server + '/bootstrap-static/'
+    cache = HttpCache(tmp_path, max_age={})
+    get_data(url, save_to_file=False, cache=cache)
+    ETagHandler.bodies['/bootstrap-static/']['elements'].pop()
+    get_data(url, save_to_file=False, cache=cache)
+    assert os.listdir(tmp_path / 'objects') == [cache.index[url]['sha256']]
+
+
+def test_caches_sharing_a_directory_keep_each_others_entries(server, tmp_path):
+    # get_data, bootstrap_teams, get_fixtures and each Fetcher have a cache of their own
+    first, second = HttpCache(tmp_path, max_age={}), HttpCache(tmp_path, max_age={})
+    get_data(server + '/bootstrap-static/', save_to_file=False, cache=first)
+    asyncio.run(Fetcher(cache=second).get_json({1: f'{server}/element-summary/1/'}))
+    assert set(HttpCache(tmp_path).index) == {server + '/bootstrap-static/', f'{server}/element-summary/1/'}
+
+    # The latest fetch of a url wins, and the body it replaced is removed
+    ETagHandler.bodies['/bootstrap-static/']['elements'].pop()
+    get_data(server + '/bootstrap-static/', save_to_file=False, cache=second)
+    first.save()
+    index = HttpCache(tmp_path).index
+    assert index[server + '/bootstrap-static/'] == second.index[server + '/bootstrap-static/']
+    assert sorted(os.listdir(tmp_path / 'objects')) == sorted({entry['sha256'] for entry in index.values()})
@@ -0,0 +1,128 @@
+import json
+import asyncio
+import sys
+import threading
+import pytest
+import numpy as np
+import pandas as pd
+from src import instrument
+from src.instrument import timer, span, recorder
+
+@timer
+def frame(n):
+    return pd.DataFrame({'a': np.arange(n)})
+
+
+@timer
+def allocate(n_bytes):
+    data = bytearray(n_bytes)
+    return len(data)
+
+
+@timer
+def stages(n):
+    return frame(n), allocate(10 * 2**20)
+
+
+@timer
+async def fetch(delay):
+    await asyncio.sleep(delay)
+    return {'delay': delay}
+
+
+@timer
+async def fetch_all():
+    return await asyncio.gather(fetch(0.05), fetch(0.02))
+
+
+@pytest.fixture(autouse=True)
+def clear():
+    recorder.clear()
+    yield
+    instrument.trace_memory(False)
+
+
+#%% Spans
+def test_nested_spans_with_rows():
+    stages(7)
+    root = recorder.spans[-1]
+    assert (root.name, root.rows) == ('stages', 7)
+    assert [(child.path, child.rows) for child in root.children] == [('stages/frame', 7), ('stages/allocate', None)]
+    assert root.seconds >= sum(child.seconds for child in root.children)
+
+
+def test_async_functions_are_timed_when_awaited():
+    results = asyncio.run(fetch_all())
+    root = recorder.spans[-1]
+
+    assert results == [{'delay': 0.05}, {'delay': 0.02}]
+    assert root.name == 'fetch_all' and root.seconds >= 0.05
+    # The gathered calls run concurrently as children of fetch_all
+    assert sorted(child.seconds for child in root.children)[0] >= 0.02
+    assert root.seconds < 0.07 and [child.rows for child in root.children] == [1, 1]
+
+
+def test_peak_memory():
+    instrument.trace_memory()
+    stages(10)
+    root = recorder.spans[-1]
+    allocated = next(child for child in root.children if child.name == 'allocate')
+    assert allocated.peak_memory >= 10 * 2**20
+    assert root.peak_memory >= allocated.peak_memory
+
+    # Memory allocated and freed before the first child still counts for the parent
+    with span('load'):
+        allocate.__wrapped__(50 * 2**20)
+        frame(10)
+    assert recorder.spans[-1].peak_memory >= 50 * 2**20
+
+
+def test_errors_are_recorded():
+    with pytest.raises(ZeroDivisionError):
+        with span('load', source='fpl'):
+            1 / 0
+    assert 'ZeroDivisionError' in recorder.spans[-1].error
+    assert recorder.spans[-1].to_dict()['source'] == 'fpl'
+
+
+#%% Export
+def test_exports(tmp_path):
+    stages(3)
+    stages(3)
+    recorder.to_json(str(tmp_path / 'timings.json'))
+    with open(tmp_path / 'timings.json') as file:
+        timings = json.load(file)
+    assert [child['name'] for child in timings[0]['children']] == ['frame', 'allocate']
+
+    text = recorder.prometheus()
+    assert '# TYPE fpl_stage_seconds gauge' in text
+    assert 'fpl_stage_rows{stage="stages/frame"} 3' in text
+    assert 'fpl_stage_calls_total{stage="stages/allocate"} 2' in text
+    assert 'fpl_stage_peak_memory_bytes' not in text
+
+
+def test_exports_while_spans_are_added(tmp_path):
+    # The dashboard writes the metrics while refreshes in other threads add spans
+    recorder.clear()
+    done = threading.Event()
+    def add():
+        while not done.is_set():
+            with span('refresh'):
+                with span('stage'):
+                    pass
+    threads = [threading.Thread(target=add) for _ in range(2)]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    for thread in threads:
+        thread.start()
+    try:
+        while not recorder.spans:
+            done.wait(0.001)
+        for _ in range(200):
+            recorder.to_json(str(tmp_path / 'timings.json'))
+            assert 'fpl_stage_calls_total{stage="refresh/stage"}' in recorder.prometheus()
+    finally:
+        done.set()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(interval)
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import pytest
+from collections import Counter
+from benchmarks import synthetic
+from src.optimizer import SquadOptimizer, InfeasibleSquad, squad_positions, starting_positions
+
+def player_pool(n_players=200, seed=0):
+    df = synthetic.player_stats(n_players, seed)
+    rng = np.random.default_rng(seed + 1)
+    df['now_cost'] = rng.integers(40, 100, n_players)
+    # Points that rise with cost, so the budget binds
+    df['xp'] = (rng.gamma(2, 2, n_players) * df['now_cost'] / 80).round(2)
+    return df
+
+
+def check_rules(df, pick, budget=1000):
+    squad = df.loc[pick['squad']]
+    assert len(squad) == 15 and squad['now_cost'].sum() <= budget
+    assert Counter(squad['element_type']) == squad_positions
+    assert squad['team'].value_counts().max() <= 3
+    starting = Counter(df.loc[pick['starting'], 'element_type'])
+    assert len(pick['starting']) == 11 and set(pick['starting']) <= set(pick['squad'])
+    assert all(low <= starting[position] <= high for position, (low, high) in starting_positions.items())
+    assert pick['captain'] in pick['starting']
+
+
+#%% Pick
+def test_pick_is_valid_and_optimal():
+    df = player_pool()
+    optimizer = SquadOptimizer(df)
+    pick = optimizer.pick('xp')
+    check_rules(df, pick)
+    assert pick['optimal'] and optimizer.stats['candidates'] < len(df)
+    assert sorted(pick['squad']) == sorted(pick['starting'] + pick['bench'])
+
+    # Solving over every player gives the same squad value as solving over the candidates
+    everyone = optimizer.candidates
+    optimizer.candidates = lambda projection: np.arange(len(df))
+    full = optimizer.pick('xp')
+    assert optimizer.stats['candidates'] == len(df)
+    assert full['points'] == pytest.approx(pick['points'])
+    assert df.loc[full['squad'], 'xp'].sum() == pytest.approx(df.loc[pick['squad'], 'xp'].sum())
+    optimizer.candidates = everyone
+
+
+def test_pick_series_and_budget():
+    df = player_pool()
+    optimizer = SquadOptimizer(df, budget=850)
+    points = df['xp'].copy()
+    points.iloc[:10] = np.nan
+    pick = optimizer.pick(points.sample(frac=1, random_state=0))
+    check_rules(df, pick, budget=850)
+
+    with pytest.raises(InfeasibleSquad):
+        SquadOptimizer(df, budget=100).pick('xp')
+
+
+#%% Plan
+def test_plan_transfers_and_hits():
+    df = player_pool()
+    optimizer = SquadOptimizer(df)
+    squad = optimizer.pick('xp')['squad']
+    # The best player outside the squad of a position with a starter to replace scores 30 in every gameweek
+    position = df.loc[squad[0], 'element_type']
+    outside = df.index[(df['element_type'] == position) & ~df.index.isin(squad)]
+    star = df.loc[outside, 'now_cost'].idxmin()
+    projections = pd.DataFrame({gameweek: df['xp'] for gameweek in [5, 6, 7]})
+    projections.loc[star] = 30
+
+    plan = optimizer.plan(projections, squad, bank=200)
+    assert [week['gameweek'] for week in plan] == [5, 6, 7]
+    assert star in plan[0]['in'] and star not in plan[0]['out']
+    free_transfers = 1
+    for week in plan:
+        assert len(week['in']) == len(week['out'])
+        assert week['hits'] == max(0, len(week['in']) - free_transfers)
+        free_transfers = min(2, max(0, free_transfers - len(week['in'])) + 1)
+        check_rules(df, week, budget=df.loc[squad, 'now_cost'].sum() + 200)
+        assert star in week['squad']
+
+    # Planning over every player gains nothing over the squad and the candidates
+    assert optimizer.stats['candidates'] < len(df)
+    value = lambda plan: sum(week['points'] - 4 * week['hits'] for week in plan)
+    everyone = optimizer.candidates
+    optimizer.candidates = lambda projection: np.arange(len(df))
+    assert value(optimizer.plan(projections, squad, bank=200)) == pytest.approx(value(plan))
+    optimizer.candidates = everyone
+
+    # Nothing is worth a hit of 100 points, and a squad carried over unchanged keeps its free transfers
+    plan = optimizer.plan(pd.DataFrame({gameweek: df['xp'] for gameweek in [1, 2, 3]}), squad, hit_cost=100)
+    assert all(week['hits'] == 0 and week['in'] == [] for week in plan)
+    assert [week['free_transfers'] for week in plan] == [1, 2, 2]
+
+    with pytest.raises(InfeasibleSquad):
+        optimizer.plan(projections, squad[:14])
+
+
+def test_plan_keeps_players_dominated_by_different_players_each_week():
+    # A squad of fillers scoring nothing, midfielders scoring 4 every week, and cheaper midfielders from ten teams
+    # scoring 5 in one week only: each week the steady players are dominated, by different players every week
+    positions = {'Goalkeeper': 4, 'Defender': 10, 'Midfielder': 10, 'Forward': 6}
+    fillers = [position for position, count in positions.items() for _ in range(count)]
+    frame = pd.DataFrame({'element_type': fillers + ['Midfielder'] * 38,
+                          'team': [i % 20 for i in range(len(fillers))] + list(range(8)) + list(range(10, 20)) * 3,
+                          'now_cost': [40] * len(fillers) + [50] * 8 + [45] * 30})
+    projections = pd.DataFrame(0.0, index=frame.index, columns=[1, 2, 3])
+    projections.iloc[len(fillers):len(fillers) + 8] = 4
+    for t, gameweek in enumerate(projections.columns):
+        start = len(fillers) + 8 + 10 * t
+        projections.iloc[start:start + 10, t] = 5
+    squad = [id for position, count in squad_positions.items()
+             for id in frame.index[:len(fillers)][frame['element_type'][:len(fillers)] == position][:count]]
+
+    optimizer = SquadOptimizer(frame)
+    value = lambda plan: sum(week['points'] - 4 * week['hits'] for week in plan)
+    plan = optimizer.plan(projections, squad, bank=400)
+    assert set(range(len(fillers), len(fillers) + 8)) & set(plan[0]['in'])
+    optimizer.candidates = lambda projection: np.arange(len(frame))
+    assert value(optimizer.plan(projections, squad, bank=400)) == pytest.approx(value(plan))
@@ -0,0 +1,114 @@
+import os
+import json
+import pandas as pd
+from src.pipeline import Stage, Pipeline, fingerprint
+from src.get_data import write_history
+
+calls = []
+
+def double(values, factor=2):
+    calls.append('double')
+    return values * factor
+
+
+def split(values):
+    calls.append('split')
+    return values[values > 4], values[values <= 4]
+
+
+def total(high, low):
+    calls.append('total')
+    return high.sum() - low.sum()
+
+
+def stages(factor=2, version=1):
+    return [Stage('total', total, inputs=['high', 'low']),
+            Stage('double', double, inputs=['values'], outputs=['doubled'], params={'factor': factor}, version=version),
+            Stage('split', split, inputs=['doubled'], outputs=['high', 'low'])]
+
+
+#%% Pipeline
+def test_only_invalidated_stages_rerun(tmp_path):
+    values = pd.Series([1, 2, 3, 4])
+    calls.clear()
+    assert Pipeline(stages(), tmp_path).run(values=values)['total'] == 14 - 6
+    assert calls == ['double', 'split', 'total']
+
+    # Stored results are reused, and stages upstream of a hit are not loaded at all
+    calls.clear()
+    pipeline = Pipeline(stages(), tmp_path)
+    assert pipeline.run(['total'], values=values) == {'total': 8}
+    assert calls == [] and pipeline.report == {'total': 'hit', 'double': 'skipped', 'split': 'skipped'}
+
+    # A parameter change reruns its stage, downstream stages rerun only if their inputs changed
+    pipeline = Pipeline(stages(factor=3), tmp_path)
+    assert pipeline.run(['total'], values=values) == {'total': 24}
+    assert pipeline.report == {'total': 'miss', 'double': 'miss', 'split': 'miss'}
+
+    pipeline = Pipeline(stages(version=2), tmp_path)
+    pipeline.run(['total'], values=values)
+    assert pipeline.report == {'total': 'miss', 'double': 'miss', 'split': 'miss'}
+
+    pipeline = Pipeline(stages(), tmp_path)
+    pipeline.run(['total'], values=pd.Series([1, 2, 3, 5]))
+    assert pipeline.report['double'] == 'miss'
+
+
+def test_results_are_evicted(tmp_path):
+    for factor in range(5):
+        Pipeline(stages(factor=factor), tmp_path, keep=2).run(values=pd.Series([1, 2]))
+    assert len(list(tmp_path.glob('double-*.pkl'))) == 2
+
+
+def test_fingerprint(tmp_path):
+    history = write_history(str(tmp_path / 'history.ndjson'), [(1, {'history': []}), (2, {'history': [1]})])
+    assert fingerprint(history) == fingerprint(write_history(str(tmp_path / 'copy.ndjson'), history.items()))
+    assert fingerprint({1: {'a': 1}, 2: {}}) == fingerprint({2: {}, 1: {'a': 1}})
+    assert fingerprint(pd.DataFrame({'a': [1, 2]})) != fingerprint(pd.DataFrame({'a': [1.0, 2.0]}))
+
+
+def test_keys_follow_helpers_and_unreadable_results_rerun(tmp_path):
+    from src import pre_process as pp
+    from src.pipeline import dependencies
+
+    # Editing a helper of a stage, however deep, changes the stage's key
+    helpers = dependencies(pp.gameweeks)
+    assert {'pre_process.gameweek_history', 'pre_process.interpolate_by_player', 'gameweek_index.sort_gameweeks'} <= set(helpers)
+    assert 'pre_process.compact_dtypes' in dependencies(pp.compact_frames)
+    assert not any(name.startswith('pandas') for name in helpers)
+
+    # A stored result that cannot be unpickled, e.g. written by other library versions, is a miss
+    values = pd.Series([1, 2, 3, 4])
+    Pipeline(stages(), tmp_path).run(values=values)
+    for path in tmp_path.glob('total-*.pkl'):
+        path.write_bytes(b'\x80\x04\x95\x15\x00\x00\x00\x00\x00\x00\x00\x8c\x07missing\x94\x8c\x01x\x94\x93\x94.')
+    pipeline = Pipeline(stages(), tmp_path)
+    assert pipeline.run(['total'], values=values) == {'total': 8}
+    assert pipeline.report['total'] == 'miss'
+
+
+
+def remember(values, filename):
+    # Adds values to those stored in filename and saves them, like update_crosswalk
+    calls.append('remember')
+    stored = set(json.load(open(filename))) if os.path.exists(filename) else set()
+    with open(filename, 'w') as outf:
+        json.dump(sorted(stored | set(values.tolist())), outf)
+    return len(stored | set(values.tolist()))
+
+
+def test_stages_writing_their_files_are_not_rerun(tmp_path):
+    filename = str(tmp_path / 'stored.json')
+    stage = lambda: [Stage('remember', remember, inputs=['values'], params={'filename': filename}, files=[filename])]
+    values = pd.Series([1, 2])
+    calls.clear()
+    for _ in range(3):
+        pipeline = Pipeline(stage(), tmp_path / 'stages')
+        assert pipeline.run(values=values) == {'remember': 2}
+    assert calls == ['remember'] and pipeline.report == {'remember': 'hit'}
+
+    # Editing the file outside the pipeline reruns the stage
+    with open(filename, 'w') as outf:
+        json.dump([5], outf)
+    pipeline = Pipeline(stage(), tmp_path / 'stages')
+    assert pipeline.run(values=values) == {'remember': 3} and pipeline.report == {'remember': 'miss'}
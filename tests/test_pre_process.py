@@ -0,0 +1,362 @@
+import os
+import json
+import asyncio
+import pytest
+import numpy as np
+import pandas as pd
+from benchmarks import synthetic, reference, bench_pipeline
+from src import pre_process as pp
+from src.pre_process import process_gw_data, create_ml_df, match_names, update_crosswalk, merge, patch_gw_data
+from src.get_data import HistoryFile, write_history
+from src import storage
+
+#%% Process GW data
+def test_gw_data_matches_reference():
+    hist_data = synthetic.element_summary(n_players=60, n_gameweeks=12)
+    df = synthetic.players(hist_data)
+    # The reference drops each gameweek's fixture
+    pd.testing.assert_frame_equal(process_gw_data(df, hist_data).drop(columns=pp.gw_fixture_cols),
+                                  reference.process_gw_data(df, hist_data), check_dtype=False)
+
+
+def test_gw_data_string_ids():
+    # ids are strings when hist_data is loaded back from json
+    hist_data = {str(id): data for id, data in synthetic.element_summary(n_players=10, n_gameweeks=6).items()}
+    df = synthetic.players(hist_data)
+    gw_df = process_gw_data(df, hist_data)
+    assert set(gw_df['id']) == set(hist_data.keys())
+    assert gw_df.index.name == 'round'
+
+
+def test_gw_data_parallel_matches_serial(tmp_path):
+    hist_data = synthetic.element_summary(n_players=45, n_gameweeks=8)
+    df = synthetic.players(hist_data)
+    # A chunk of players without any fixtures is skipped
+    for id in list(hist_data)[5:10]:
+        hist_data[id]['history'] = []
+    serial = process_gw_data(df, hist_data)
+
+    pd.testing.assert_frame_equal(process_gw_data(df, hist_data, workers=2, chunk_size=5), serial)
+    history = write_history(str(tmp_path / 'history.ndjson'), hist_data.items())
+    pd.testing.assert_frame_equal(process_gw_data(df, history, workers=3), serial)
+
+
+def test_gw_data_without_fixtures():
+    hist_data = {id: {'history': [], 'history_past': []} for id in [1, 2, 3]}
+    gw_df = process_gw_data(synthetic.players(hist_data), hist_data)
+    assert gw_df.empty and gw_df.index.name == 'round'
+    assert {'id', 'total_points', 'points_cumsum', 'value', 'fixture', 'team', 'player_name'} <= set(gw_df.columns)
+    pd.testing.assert_frame_equal(process_gw_data(synthetic.players(hist_data), hist_data, workers=2, chunk_size=2), gw_df)
+
+
+#%% Create ML df
+def complete_gw_df(n_players=20, n_gameweeks=10):
+    hist_data = synthetic.element_summary(n_players=n_players, n_gameweeks=n_gameweeks)
+    gw_df = process_gw_data(synthetic.players(hist_data), hist_data)
+    # The reference needs every player to have every gameweek
+    last_round = gw_df.reset_index().groupby('id')['round'].transform('max').to_numpy()
+    return gw_df[last_round == n_gameweeks]
+
+
+def test_ml_df_matches_reference():
+    gw_df = complete_gw_df()
+    pd.testing.assert_frame_equal(create_ml_df(gw_df, weeks=3),
+                                  reference.create_ml_df(gw_df.drop(columns=pp.gw_fixture_cols), weeks=3),
+                                  check_dtype=False)
+
+
+def test_ml_df_multiple_weeks():
+    gw_df = complete_gw_df()
+    ml_dfs = create_ml_df(gw_df, weeks=[2, 4])
+    assert list(ml_dfs.keys()) == [2, 4]
+    for weeks, ml_df in ml_dfs.items():
+        pd.testing.assert_frame_equal(ml_df, create_ml_df(gw_df, weeks=weeks))
+        assert len(ml_df) == gw_df['id'].nunique() * (10 - weeks)
+
+
+def test_ml_df_parallel_matches_serial():
+    gw_df = complete_gw_df(n_players=30)
+    gw_df = gw_df[~((gw_df['id'] == gw_df['id'].iloc[0]) & (gw_df.index == 6))]
+    parallel = create_ml_df(gw_df, weeks=[2, 3], workers=2, chunk_size=7)
+    for weeks, ml_df in parallel.items():
+        pd.testing.assert_frame_equal(ml_df, create_ml_df(gw_df, weeks=weeks))
+
+
+def test_ml_df_drops_missing_gameweeks():
+    gw_df = complete_gw_df()
+    gw_df = gw_df[~((gw_df['id'] == gw_df['id'].iloc[0]) & (gw_df.index == 10))]
+    ml_df = create_ml_df(gw_df, weeks=3)
+    assert ml_df.notna().all().all()
+    assert len(ml_df) == gw_df['id'].nunique() * 7 - 1
+
+
+#%% Match names
+fpl_names = pd.DataFrame({'player_name': ['Mohamed Salah', 'Heung-Min Son', 'Frederico Rodrigues de Paula Santos',
+                                          'Emile Smith Rowe', 'Rúben Santos Gato Alves Dias', 'Mohamed Elneny'],
+                          'short_name': ['Salah', 'Son', 'Fred', 'Smith Rowe', 'Rúben', 'Elneny'],
+                          'code': [118748, 85971, 184341, 205533, 171314, 110979]},
+                         index=[233, 359, 312, 22, 256, 9])
+
+
+def test_match_names():
+    understat_names = pd.Series(['Son Heung-Min', 'Mohamed Salah', 'Fred', 'Emile Smith-Rowe', 'Rúben Dias'])
+
+    best_match = match_names(fpl_names, understat_names, save_to_file=False)
+    assert best_match == {'Son Heung-Min': 'Heung-Min Son', 'Mohamed Salah': 'Mohamed Salah',
+                          'Fred': 'Frederico Rodrigues de Paula Santos', 'Emile Smith-Rowe': 'Emile Smith Rowe',
+                          'Rúben Dias': 'Rúben Santos Gato Alves Dias'}
+
+
+#%% Player crosswalk
+def test_crosswalk_is_incremental(tmp_path):
+    filename = tmp_path / 'crosswalk.json'
+    understat = pd.DataFrame({'id': [1250, 453, 6817], 'player_name': ['Mohamed Salah', 'Son Heung-Min', 'Fred']})
+    crosswalk = update_crosswalk(fpl_names, understat, players_to_rename={}, filename=filename)
+    assert crosswalk['understat_id'].to_dict() == {233: 1250, 359: 453, 312: 6817}
+
+    # Known players keep their match even when their names no longer match, only the new player is matched
+    understat = pd.DataFrame({'id': [1250, 453, 6817, 7230], 'player_name': ['M. Salah', 'Son', 'Fred', 'Emile Smith-Rowe']})
+    crosswalk = update_crosswalk(fpl_names, understat, players_to_rename={}, filename=filename)
+    assert crosswalk['understat_id'].to_dict() == {233: 1250, 359: 453, 312: 6817, 22: 7230}
+    assert crosswalk.loc[22, 'source'] == 'fuzzy'
+
+    # The crosswalk is stored by code, so players keep their match when FPL renumbers them the next season
+    next_season = fpl_names.set_axis([1, 2, 3, 4, 5, 6])
+    crosswalk = update_crosswalk(next_season, understat.iloc[:0], players_to_rename={}, filename=filename)
+    assert crosswalk['understat_id'].to_dict() == {1: 1250, 2: 453, 3: 6817, 4: 7230}
+
+
+def test_crosswalk_leaves_weak_matches_for_later(tmp_path):
+    filename = tmp_path / 'crosswalk.json'
+    understat = pd.DataFrame({'id': [1250, 8101], 'player_name': ['Mohamed Salah', 'Kepa Arrizabalaga']})
+    crosswalk = update_crosswalk(fpl_names, understat, players_to_rename={}, filename=filename)
+    assert crosswalk['understat_id'].to_dict() == {233: 1250}
+
+    understat = pd.concat([understat, pd.DataFrame({'id': [7230], 'player_name': ['Emile Smith-Rowe']})])
+    crosswalk = update_crosswalk(fpl_names, understat, players_to_rename={}, filename=filename)
+    assert crosswalk['understat_id'].to_dict() == {233: 1250, 22: 7230}
+
+
+def test_crosswalk_manual_override(tmp_path):
+    filename = tmp_path / 'crosswalk.json'
+    understat = pd.DataFrame({'id': [1250, 2379], 'player_name': ['Mohamed Salah', 'Rúben Santos Gato Alves Dias']})
+    crosswalk = update_crosswalk(fpl_names, understat, filename=filename,
+                                 players_to_rename={'Rúben Dias': 'Rúben Santos Gato Alves Dias'})
+    assert crosswalk.loc[256, 'understat_id'] == 2379
+    assert crosswalk.loc[256, 'source'] == 'manual'
+
+
+def test_merge_on_ids(tmp_path):
+    understat = pd.DataFrame({'id': [1250, 453], 'player_name': ['Mo Salah', 'Son Heung-Min'], 'xG': [16.3, 7.6]})
+    crosswalk = update_crosswalk(fpl_names, understat, players_to_rename={}, filename=tmp_path / 'crosswalk.json')
+    fpl_players = fpl_names[['player_name']].assign(total_points=[180, 150, 60, 90, 100, 10])
+
+    data = merge(fpl_players, understat, crosswalk).set_index('index')
+    assert data.loc[233, 'xG'] == 16.3
+    assert data.loc[359, 'player_name'] == 'Heung-Min Son'
+    assert list(data.columns) == ['player_name', 'total_points', 'xG']
+
+
+#%% Incremental refresh
+def test_refresh_only_fetches_changed_players(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('.data')
+    snapshot = {id: {'minutes': 90, 'now_cost': 50, 'web_name': str(id)} for id in range(1, 11)}
+    with open('.data/2022_03_10_player_data.json', 'w') as outf:
+        json.dump(snapshot, outf)
+    write_history('.data/2022_03_10_history.ndjson', ((id, {'history': []}) for id in snapshot))
+
+    player_data = {id: dict(player) for id, player in snapshot.items()}
+    player_data[3]['minutes'] = 180
+    player_data[11] = {'minutes': 0, 'now_cost': 45, 'web_name': '11'}
+    fetched = []
+
+    async def get_player_hist(player_ids, save_to_file, fetcher):
+        # Stored responses of changed players are revalidated however fresh they are
+        assert fetcher.cache.max_age == {}
+        fetched.extend(player_ids)
+        return {id: {'history': [id]} for id in player_ids}
+
+    monkeypatch.setattr(pp, 'get_data', lambda save_to_file: player_data)
+    monkeypatch.setattr(pp, 'get_player_hist', get_player_hist)
+    monkeypatch.setattr(pp, 'load_understat', lambda: [])
+    # refresh_data runs on the current event loop, which asyncio.run in other tests leaves unset
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+    _, player_history, _, delta = pp.refresh_data()
+    assert delta == {'since': '2022_03_10', 'changed': [3, 11]}
+    assert fetched == [3, 11]
+    assert player_history[3] == {'history': [3]} and player_history[1] == {'history': []}
+    assert len(player_history) == 11
+    assert dict(HistoryFile(f'.data/{pp.storage.today()}_history.ndjson')) == dict(player_history)
+
+
+def test_patch_gw_data_matches_rebuild():
+    hist_data = synthetic.element_summary(n_players=30, n_gameweeks=8)
+    df = synthetic.players(hist_data)
+    gw_df = process_gw_data(df.iloc[:25], hist_data)
+
+    # Player 2 gets a new gameweek, 26 to 30 are new and 5 has left
+    hist_data[2]['history'].append(dict(hist_data[2]['history'][-1], round=9, total_points=12))
+    df = df[df['index'] != 5]
+    pd.testing.assert_frame_equal(patch_gw_data(gw_df, df, hist_data, changed=[2]), process_gw_data(df, hist_data),
+                                  check_dtype=False)
+
+
+def test_compact_dtypes():
+    hist_data = synthetic.element_summary(n_players=50, n_gameweeks=10)
+    df = synthetic.players(hist_data).assign(form=0.5, news=None, in_dreamteam=False, xG=2.0)
+    df.loc[df.index[0], 'index'] = None
+    gw_df = process_gw_data(df.dropna(subset=['index']), hist_data)
+
+    compact = pp.compact_dtypes(df)
+    assert compact['team'].dtype == 'category' and compact['player_name'].dtype == 'category'
+    # Declared integer columns take their stored type, floats stay floats even when they are whole numbers
+    assert str(compact['index'].dtype) == 'Int32'
+    assert compact['form'].dtype == 'float32' and compact['xG'].dtype == 'float32'
+    assert compact['in_dreamteam'].dtype == bool
+    pd.testing.assert_frame_equal(compact.astype(df.dtypes.to_dict()), df)
+
+    compact = pp.compact_dtypes(gw_df, 'gw_df')
+    assert pp.frame_memory(compact) < pp.frame_memory(gw_df)
+    assert compact['total_points'].dtype == 'int32'
+    assert compact['value'].dtype == 'float32' and compact['opponent_team'].dtype == 'int16'
+    pd.testing.assert_frame_equal(compact, gw_df, check_dtype=False, check_categorical=False)
+
+
+#%% Synthetic pipeline
+def test_pipeline_stages_on_synthetic_payloads(tmp_path):
+    data = bench_pipeline.payloads(n_players=200, n_gameweeks=8)
+    assert all(len(player) == 66 for player in data['player_data'].values())
+
+    results = bench_pipeline.stages(data)
+    assert list(results) == ['process_raw_fpl', 'process_raw_understat', 'match_names', 'update_crosswalk', 'merge',
+                             'prune_data', 'process_gw_data', 'create_ml_df', 'end_to_end']
+    assert 'end_to_end' not in bench_pipeline.stages(data, match_limit=100)
+
+    # The fuzzy crosswalk agrees with the exact name matches
+    fpl, names = pp.process_raw_fpl(data['player_data'])
+    understat = pp.process_raw_understat(data['understat'])
+    crosswalk = update_crosswalk(names, understat, filename=tmp_path / 'crosswalk.json', save_to_file=False)
+    exact = bench_pipeline.exact_crosswalk(names, understat)
+    assert (crosswalk['understat_id'].reindex(exact.index) == exact['understat_id']).mean() > 0.95
+
+    assert bench_pipeline.regressions({'200': {'merge': 0.5, 'prune_data': 0.09}},
+                                      {'200': {'merge': 0.2, 'prune_data': 0.05}}) == \
+           ['merge at 200 players took 0.500s, baseline 0.200s']
+
+
+#%% Stage cache
+def test_main_reruns_invalidated_stages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('.data')
+    data = bench_pipeline.payloads(n_players=100, n_gameweeks=6)
+    monkeypatch.setattr(pp, 'load_data', lambda: (data['player_data'], data['hist_data'], data['understat']))
+    monkeypatch.setattr(pp, 'load_fixtures', lambda: None)
+
+    df, gw_df = pp.main(save_to_file=False)
+    assert set(pp.report.values()) == {'miss'}
+
+    cached_df, cached_gw_df = pp.main(save_to_file=False)
+    assert pp.report['compact_dtypes'] == 'hit' and 'miss' not in pp.report.values()
+    pd.testing.assert_frame_equal(cached_df, df)
+    pd.testing.assert_frame_equal(cached_gw_df, gw_df)
+    assert set(pp.form_features) <= set(gw_df.columns)
+
+    pp.main(save_to_file=False, min_minutes=900)
+    assert pp.report == {'process_raw_fpl': 'skipped', 'process_raw_understat': 'skipped', 'update_crosswalk': 'skipped',
+                         'merge': 'hit', 'prune_data': 'miss', 'process_gw_data': 'miss', 'form_features': 'miss',
+                         'fixture_difficulty': 'miss', 'compact_dtypes': 'miss'}
+
+
+#%% Past seasons
+def test_backfill_past_seasons_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('.data')
+    store = str(tmp_path / 'store')
+    hist_data = synthetic.element_summary(n_players=20, n_gameweeks=6, n_seasons=3)
+
+    # The last run of the 2020 season
+    archived = synthetic.element_summary(n_players=15, n_gameweeks=38, seed=1)
+    write_history('.data/2021_05_23_history.ndjson', archived.items())
+    with open('.data/2021_05_23_player_data.json', 'w') as outf:
+        json.dump({id: {'first_name': 'Player', 'second_name': str(id), 'team': id % 20 + 1, 'element_type': 2,
+                        'code': 100000 + id} for id in archived}, outf)
+
+    assert pp.backfill(hist_data, current=2021, directory=store) == [2018, 2019, 2020]
+    totals = storage.read_seasons(directory=store)
+    assert len(totals) == 40 and totals.loc[(2019, 7), 'total_points'] == hist_data[7]['history_past'][1]['total_points']
+    history = storage.read_history((2020, 2020), directory=store)
+    assert history.index.get_level_values('id').nunique() == 15
+    assert set(history['element_type']) == {'Defender'}
+    assert (history['code'] == history.index.get_level_values('id') + 100000).all()
+
+    class Unread(dict):
+        def __getitem__(self, id):
+            raise AssertionError("Past seasons are read again")
+
+    assert pp.backfill(Unread(hist_data), current=2021, directory=store) == []
+
+
+#%% Form features
+def test_form_features_match_pandas():
+    gw_df = complete_gw_df(n_players=25)
+    form = pp.FormFeatures().fit(gw_df)
+    players = gw_df.groupby('id')
+
+    def rolling(column, window, statistic):
+        return getattr(players[column].rolling(window, min_periods=1), statistic)().reset_index(level='id', drop=True)
+
+    pd.testing.assert_series_equal(form['points_mean_3'], rolling('total_points', 3, 'mean'), check_names=False)
+    pd.testing.assert_series_equal(form['points_ewm'], players['total_points'].transform(
+        lambda points: points.ewm(alpha=0.3, adjust=False).mean()), check_names=False)
+    goals, minutes = rolling('goals_scored', 5, 'sum'), rolling('minutes', 5, 'sum')
+    pd.testing.assert_series_equal(form['goals_per_90_5'], (90 * goals / minutes).where(minutes > 0), check_names=False)
+
+
+def test_form_features_update_matches_fit():
+    gw_df = complete_gw_df(n_players=25)
+    index = pp.GameweekIndex(gw_df)
+    full = pp.FormFeatures().fit(index)
+
+    # Gameweeks 5 to 10 are added one at a time, and player 3 is only seen from gameweek 5
+    engine = pp.FormFeatures()
+    engine.fit(gw_df[(gw_df.index <= 4) & (gw_df['id'] != 3)])
+    late = pp.FormFeatures().fit(gw_df[(gw_df.index >= 5) & (gw_df['id'] == 3)])
+    for round in range(5, 11):
+        expected = full[full.index == round]
+        expected = pd.concat([expected[expected['id'] != 3], late[late.index == round]])
+        rows = index.gameweek(round, ids=[id for id in index.ids if id != 3] + [3])
+        pd.testing.assert_frame_equal(engine.update(rows), expected)
+
+
+def test_incremental_form_features_match_a_full_fit(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('.data')
+    gw_df = complete_gw_df(n_players=25)
+    full = pp.add_form_features(gw_df)
+
+    # The last run stored gameweeks 1 to 6 without player 3, and saved its state
+    stored = pp.add_form_features(gw_df[(gw_df.index <= 6) & (gw_df['id'] != 3)], save_to_file=True)
+    monkeypatch.setattr(pp.storage, 'read_manifest', lambda: {'gameweeks': {'date': pp.storage.today()}})
+    monkeypatch.setattr(pp.storage, 'read_gameweeks', lambda columns: stored[columns])
+    delta = {'since': pp.storage.today(), 'changed': []}
+
+    fit = pp.FormFeatures.fit
+    def refit(*args):
+        raise AssertionError("Form features are fitted again")
+    monkeypatch.setattr(pp.FormFeatures, 'fit', refit)
+    pd.testing.assert_frame_equal(pp.add_form_features(gw_df, delta=delta), full)
+
+    # A corrected past gameweek is fitted again
+    monkeypatch.setattr(pp.FormFeatures, 'fit', fit)
+    corrected = gw_df.copy()
+    corrected.loc[(corrected.index == 2) & (corrected['id'] == corrected['id'].iloc[0]), 'total_points'] += 5
+    pd.testing.assert_frame_equal(pp.add_form_features(corrected, delta=delta), pp.add_form_features(corrected))
+
+
+def test_form_features_refuse_missing_values():
+    gw_df = complete_gw_df(n_players=5)
+    gw_df.loc[gw_df['id'] == gw_df['id'].iloc[0], 'minutes'] = np.nan
+    with pytest.raises(ValueError, match='minutes'):
+        pp.FormFeatures().fit(gw_df)
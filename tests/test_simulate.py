@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import binom, poisson
+from benchmarks import synthetic
+from src.pre_process import process_gw_data
+from src.simulate import PointsSimulator, goal_points, clean_sheet_points, assist_points, max_events, max_team_goals
+
+def frames(n_players=120, n_gameweeks=10):
+    hist_data = synthetic.element_summary(n_players=n_players, n_gameweeks=n_gameweeks)
+    players = synthetic.players(hist_data)
+    return players.set_index('index'), process_gw_data(players, hist_data), synthetic.fixtures(n_gameweeks=n_gameweeks)
+
+
+def expected_points(simulator):
+    '''
+    Mean points of each player worked out from the rates, with the caps the simulation applies, summed over the
+    fixtures of their team.
+    '''
+    rates, fixtures = simulator.rates, simulator.fixtures
+    goals = np.arange(max_team_goals + 1)
+    def team_goals(expected):
+        # Chance of each number of team goals, the tail counted at the cap
+        pmf = poisson.pmf(goals[None, :], np.full((len(rates), 1), expected))
+        pmf[:, -1] += 1 - pmf.sum(axis=1)
+        return pmf
+    def events(share, scored):
+        counts = np.arange(max_events + 1)[:, None, None]
+        pmf = binom.pmf(counts, goals[None, None, :], share.to_numpy()[None, :, None])
+        capped = (np.minimum(counts, max_events) * pmf).sum(axis=0) + max_events * (1 - pmf.sum(axis=0))
+        return (capped * scored).sum(axis=1)
+
+    position = rates['element_type']
+    concedes = position.isin(['Goalkeeper', 'Defender'])
+    total = pd.Series(0.0, index=rates.index)
+    sides = [(fixture.team_h, fixture.goals_h, fixture.goals_a) for fixture in fixtures.itertuples()] + \
+            [(fixture.team_a, fixture.goals_a, fixture.goals_h) for fixture in fixtures.itertuples()]
+    for team, scored, conceded in sides:
+        scored, against = team_goals(scored), team_goals(conceded)
+        points = (rates['p_play'] + rates['p_60']
+                  + rates['p_play'] * (position.map(goal_points) * events(rates['goal_share'], scored)
+                                       + assist_points * events(rates['assist_share'], scored)
+                                       + rates['p_bonus_1'] + 2 * rates['p_bonus_2'] + 3 * rates['p_bonus_3'])
+                  + rates['p_60'] * (position.map(clean_sheet_points) * against[:, 0]
+                                     - concedes * (against * (goals // 2)).sum(axis=1)))
+        total += points.where(rates['team'] == team, 0)
+    return total
+
+
+#%% Fit
+def test_fit_rates():
+    df, gw_df, fixtures = frames()
+    simulator = PointsSimulator(seed=0).fit(df, gw_df, fixtures)
+    rates = simulator.rates
+    assert rates.index.equals(df.index) and not rates.isna().any().any()
+    assert (rates['p_60'] <= rates['p_play']).all() and rates['p_play'].between(0, 1).all()
+    assert rates[['goal_share', 'assist_share']].stack().between(0, 1).all()
+    assert set(simulator.teams.index) == set(df['team']) and simulator.gameweek == 11
+    # Team rates come from the results, the simulated gameweek's fixtures from the fixture list
+    results = pd.DataFrame.from_records(fixtures).query('event <= 10')
+    scored = pd.concat([results.groupby('team_h')['team_h_score'].sum(), results.groupby('team_a')['team_a_score'].sum()])
+    assert simulator.teams.loc[3, 'goals_for'] == scored[3].sum() / 10
+    assert len(simulator.fixtures) == 10 and set(simulator.fixtures[['team_h', 'team_a']].stack()) == set(range(1, 21))
+
+    # Understat expected goals replace the goals scored of players who have them
+    df['minutes'], df['xG'], df['xA'] = 900, np.nan, 0.0
+    df.loc[df.index[:5], 'xG'] = 10.0
+    understat = PointsSimulator().fit(df, gw_df, fixtures).rates
+    played = understat['p_play'] > 0
+    assert (understat.loc[df.index[:5], 'goals'][played] > rates.loc[df.index[:5], 'goals'][played]).all()
+    assert understat['goals'].iloc[5:].equals(rates['goals'].iloc[5:])
+    assert (understat['assists'][played] == 0).all()
+
+
+#%% Simulate
+def test_simulated_means_match_rates():
+    df, gw_df, fixtures = frames()
+    simulator = PointsSimulator(chunk_size=7000, seed=1).fit(df, gw_df, fixtures)
+    summary = simulator.simulate(40_000)
+    expected = expected_points(simulator)
+    assert (np.abs(summary['mean'] - expected) < 4 * summary['std'] / np.sqrt(40_000) + 1e-3).all()
+
+    quantiles = summary[['q5', 'q25', 'q50', 'q75', 'q95']].to_numpy()
+    assert (np.diff(quantiles, axis=1) >= 0).all()
+    assert summary[['p_blank', 'p_return']].stack().between(0, 1).all()
+
+    # The same seed simulates the same gameweeks
+    again = PointsSimulator(chunk_size=7000, seed=1).fit(df, gw_df, fixtures).simulate(40_000)
+    pd.testing.assert_frame_equal(summary, again)
+
+
+def test_team_correlation():
+    df, gw_df, fixtures = frames()
+    simulator = PointsSimulator().fit(df, gw_df, fixtures)
+    points, played = simulator.chunk(np.random.default_rng(0), 20_000, simulator.tables())
+    rates = simulator.rates.reset_index()
+    defenders = rates[rates['element_type'].isin(['Goalkeeper', 'Defender']) & (rates['p_60'] > 0.3)]
+    team = defenders.groupby('team').filter(lambda team: len(team) > 1)['team'].iloc[0]
+    first, second = defenders.index[defenders['team'] == team][:2]
+    fixture = simulator.fixtures[(simulator.fixtures[['team_h', 'team_a']] == team).any(axis=1)].iloc[0]
+    opponent = fixture['team_a'] if fixture['team_h'] == team else fixture['team_h']
+    other = defenders.index[~defenders['team'].isin([team, opponent])][0]
+    # Teammates share clean sheets and goals conceded, players of teams that do not meet share nothing
+    assert np.corrcoef(points[first], points[second])[0, 1] > 0.1
+    assert abs(np.corrcoef(points[first], points[other])[0, 1]) < 0.05
+    assert (points[~played] == 0).all()
+
+    # The goals the opponent's attackers score are the goals the defenders concede
+    attacker = rates[(rates['team'] == opponent) & (rates['p_play'] > 0.3)]['goal_share'].idxmax()
+    assert np.corrcoef(points[first], points[attacker])[0, 1] < -0.02
+
+
+def test_blank_and_double_gameweeks():
+    df, gw_df, fixtures = frames()
+    # Team 2 blanks in gameweek 11, and team 1 plays team 2's opponent as well
+    for fixture in fixtures:
+        if fixture['event'] == 11 and 2 in (fixture['team_h'], fixture['team_a']):
+            fixture['team_h' if fixture['team_h'] == 2 else 'team_a'] = 1
+    simulator = PointsSimulator(chunk_size=5000, seed=3).fit(df, gw_df, fixtures)
+    summary = simulator.simulate(20_000)
+    expected = expected_points(simulator)
+    assert (summary.loc[df['team'] == 2, 'mean'] == 0).all() and (summary.loc[df['team'] == 2, 'p_blank'] == 1).all()
+    assert (np.abs(summary['mean'] - expected) < 4 * summary['std'] / np.sqrt(20_000) + 1e-3).all()
+    assert (expected[df['team'] == 1] > 0).all()
+
+
+def test_captaincy():
+    df, gw_df, fixtures = frames()
+    simulator = PointsSimulator(chunk_size=3000, seed=2).fit(df, gw_df, fixtures)
+    summary = simulator.simulate(10_000, captains=5)
+    captaincy = simulator.captaincy
+    assert len(captaincy) == 5 and captaincy.index.isin(df.index).all()
+    np.testing.assert_allclose(captaincy['ev'], summary.loc[captaincy.index, 'mean'], rtol=1e-5)
+    assert (captaincy['ev_with_vice'] >= captaincy['ev'] - 1e-6).all()
+    assert (captaincy['vice'] != captaincy.index).all() and captaincy['vice'].isin(captaincy.index).all()
+    assert captaincy['p_best'].sum() >= 1
@@ -0,0 +1,88 @@
+import pandas as pd
+import pyarrow.dataset as ds
+from benchmarks import synthetic
+from src import storage
+from src.pre_process import process_gw_data
+
+#%% Storage
+def frames(n_players=20, n_gameweeks=6):
+    hist_data = synthetic.element_summary(n_players=n_players, n_gameweeks=n_gameweeks)
+    df = synthetic.players(hist_data)
+    return df.set_index('index').assign(now_cost=55, xG=0.5), process_gw_data(df, hist_data)
+
+
+def test_gameweeks_round_trip(tmp_path):
+    _, gw_df = frames()
+    storage.write_gameweeks(gw_df, directory=tmp_path)
+    pd.testing.assert_frame_equal(storage.read_gameweeks(directory=tmp_path), gw_df.reset_index(drop=False)
+                                  .sort_values(['id', 'round'], kind='stable').set_index('round'),
+                                  check_dtype=False, check_index_type=False)
+    assert storage.read_manifest(tmp_path)['gameweeks']['gameweek'] == gw_df.index.max()
+
+
+def test_gameweeks_projection_and_pushdown(tmp_path):
+    _, gw_df = frames()
+    storage.write_gameweeks(gw_df, directory=tmp_path)
+
+    subset = storage.read_gameweeks(columns=['id', 'total_points'], rounds=[2, 3], ids=[1, 2], directory=tmp_path)
+    assert list(subset.columns) == ['id', 'total_points']
+    assert set(subset.index) == {2, 3} and set(subset['id']) == {1, 2}
+
+    forwards = storage.read_gameweeks(filter=ds.field('element_type') == 'Forward', directory=tmp_path)
+    assert len(forwards) == (gw_df['element_type'] == 'Forward').sum()
+
+
+def test_gameweeks_rewrite_drops_old_rounds(tmp_path):
+    _, gw_df = frames()
+    storage.write_gameweeks(gw_df, directory=tmp_path)
+    storage.write_gameweeks(gw_df.loc[gw_df.index <= 3], directory=tmp_path)
+    assert set(storage.read_gameweeks(directory=tmp_path).index) == {1, 2, 3}
+
+
+def test_players_round_trip(tmp_path):
+    df, _ = frames()
+    storage.write_players(df, gameweek=6, directory=tmp_path)
+    pd.testing.assert_frame_equal(storage.read_players(directory=tmp_path), df, check_dtype=False, check_index_type=False,
+                                  check_names=False)
+    assert list(storage.read_players(columns=['xG'], directory=tmp_path).columns) == ['xG']
+
+
+#%% Past seasons
+def test_history_across_seasons(tmp_path):
+    _, gw_df = frames()
+    current = storage.current_season
+    for season in [current - 2, current - 1, current]:
+        # FPL ids change between seasons, codes do not
+        renumbered = gw_df.assign(total_points=season, code=gw_df['id'] + 100000, id=gw_df['id'] + current - season)
+        storage.write_gameweeks(renumbered, season=season, directory=tmp_path)
+
+    history = storage.read_history((current - 2, current - 1), columns=['total_points'], ids=[3], directory=tmp_path)
+    assert history.index.names == ['season', 'id', 'round']
+    assert set(history.index.get_level_values('season')) == {current - 2, current - 1}
+    assert (history.loc[current - 2, 'total_points'] == current - 2).all()
+    assert len(history) == (gw_df['id'] == 3 - 2).sum() + (gw_df['id'] == 3 - 1).sum()
+    assert storage.stored_seasons('gameweeks', tmp_path) == [current - 2, current - 1, current]
+
+    # One player's gameweeks in every season, whatever their id
+    player = storage.read_history((current - 2, current), columns=['code'], codes=[100003], directory=tmp_path)
+    assert player.index.droplevel('round').unique().tolist() == [(current - 2, 5), (current - 1, 4), (current, 3)]
+
+    # Only the current season's writes are the manifest's gameweeks entry
+    manifest = storage.read_manifest(tmp_path)
+    assert manifest['gameweeks']['season'] == current and manifest[f'gameweeks_{current - 2}']['season'] == current - 2
+
+
+def test_season_totals_round_trip(tmp_path):
+    totals = pd.DataFrame({'season': [2019, 2019, 2020], 'code': [10, 11, 10], 'total_points': [150, 90, 170],
+                           'influence': [500.2, 310.0, 620.8]})
+    storage.write_seasons(totals, directory=tmp_path)
+
+    assert storage.read_seasons(directory=tmp_path).loc[(2020, 10), 'total_points'] == 170
+    assert list(storage.read_seasons([2019], codes=[11], directory=tmp_path).index) == [(2019, 11)]
+
+
+def test_teams(tmp_path):
+    storage.write_teams({1: 'Arsenal', 2: 'Aston Villa'}, season=2021, directory=tmp_path)
+    storage.write_teams({1: 'Arsenal'}, season=2022, directory=tmp_path)
+    assert storage.read_teams(2021, directory=tmp_path) == {1: 'Arsenal', 2: 'Aston Villa'}
+    assert storage.read_teams(2020, directory=tmp_path) == {}